@@ -0,0 +1,266 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import atexit
+import click
+from contextlib import contextmanager
+import datetime
+import fcntl
+import glob
+import os
+import threading
+import time
+
+import utils
+
+
+# Appending to the Directory record, log and import checkpoint, each of which
+# may be appended to for every command run. How durably this is done is set in
+# the user config:
+#
+# - `immediate` (the default): each append is written straight away;
+# - `sync`: each append is also synced to disk before the command continues;
+# - `buffered`: appends are kept in memory and written together (and synced
+#   once) when the current top-level command or import finishes, or once many
+#   have built up. While appends are buffered a marker file is kept alongside
+#   the file, so if the process dies before writing them this can be reported
+#   by the next command. Only appends which may be lost like this are buffered
+#   (i.e. to the log); the record and import checkpoint are still written
+#   straight away, as otherwise the record could no longer replay changes
+#   already made in IPA, or `import --resume` would run lines again.
+#
+# Other `directory` processes may be appending to the same files at once, so
+# each write takes an exclusive advisory lock on the file and writes all its
+# text in a single `write`, so rows are never interleaved. How long is spent
+# waiting for these locks is counted, so contention can be logged.
+DURABILITY_CONFIG_KEY = 'RECORD_DURABILITY'
+IMMEDIATE = 'immediate'
+SYNC = 'sync'
+BUFFERED = 'buffered'
+
+# The most appends to buffer for a file before writing them anyway.
+MAX_BUFFERED_APPENDS = 1000
+
+_PENDING_MARKER_SUFFIX = '.pending'
+
+_buffers = {}
+_rotations = {}
+_lock = threading.RLock()
+
+# For each file whose lock had to be waited for: the number of waits, the total
+# seconds waited and the longest wait.
+_lock_waits = {}
+
+
+def durability():
+    # Only read once for an import, rather than for every line.
+    if click.get_current_context(silent=True) is None:
+        return _configured_durability()
+    return utils.memoized_during_import('durability', _configured_durability)
+
+
+def _configured_durability():
+    policy = utils.get_user_config(DURABILITY_CONFIG_KEY)
+    return policy if policy in [SYNC, BUFFERED] else IMMEDIATE
+
+
+# If `rotate` is given, as `(max_bytes, rotated)`, then once the file has
+# reached `max_bytes` it is moved aside (while still locked, so no other appends
+# are made to it) and `rotated` is called with the path it was moved to. Unless
+# `may_buffer`, the text is written straight away even when buffering.
+def append(path, text, rotate=None, may_buffer=True):
+    policy = durability()
+    if policy != BUFFERED or not may_buffer:
+        _write(path, [text], sync=policy == SYNC, rotate=rotate)
+        return
+
+    with _lock:
+        if rotate:
+            _rotations[path] = rotate
+        buffer = _buffers.setdefault(path, [])
+        if not buffer:
+            _mark_pending(path)
+        buffer.append(text)
+        if len(buffer) >= MAX_BUFFERED_APPENDS:
+            _flush_path(path)
+
+
+# Write all buffered appends, in the order the files were first appended to.
+def flush():
+    with _lock:
+        for path in list(_buffers):
+            _flush_path(path)
+
+
+# Drop any buffered appends to the file, e.g. as it is being removed.
+def discard(path):
+    with _lock:
+        _rotations.pop(path, None)
+        if _buffers.pop(path, None):
+            _remove_pending_marker(path)
+
+
+def _flush_path(path):
+    texts = _buffers.pop(path, [])
+    rotate = _rotations.pop(path, None)
+    if texts:
+        _write(path, texts, sync=True, rotate=rotate)
+        _remove_pending_marker(path)
+
+
+def _write(path, texts, sync=False, rotate=None):
+    # Text is written as given, e.g. so CSV rows keep their line endings.
+    data = ''.join(texts).encode()
+    rotated_path = None
+    with _locked_file(path) as fd:
+        written = os.write(fd, data)
+        # Only short if e.g. the disk is full; still under the lock, so the
+        # rest can't be interleaved with another process's append.
+        while written < len(data):
+            written += os.write(fd, data[written:])
+        if sync:
+            os.fsync(fd)
+
+        if rotate and os.fstat(fd).st_size >= rotate[0]:
+            rotated_path = '{}.{}'.format(
+                path, datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+            )
+            os.rename(path, rotated_path)
+
+    # Anything done with the moved file needn't hold up other appends.
+    if rotated_path:
+        rotate[1](rotated_path)
+
+
+# Hold the lock on the file, e.g. while replacing it, so no appends are made
+# until this is done.
+@contextmanager
+def locked(path):
+    with _locked_file(path):
+        yield
+
+
+@contextmanager
+def _locked_file(path):
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        try:
+            _lock_file(path, fd)
+            # If the file was replaced while we waited then lock the new file
+            # instead, or this append would be lost.
+            if _same_file(path, fd):
+                break
+        except BaseException:
+            os.close(fd)
+            raise
+        os.close(fd)
+
+    try:
+        yield fd
+    finally:
+        # Closing the file also releases the lock.
+        os.close(fd)
+
+
+def _lock_file(path, fd):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return
+    except BlockingIOError:
+        pass
+
+    started = time.monotonic()
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    waited = time.monotonic() - started
+    with _lock:
+        waits, total, longest = _lock_waits.get(path, (0, 0, 0))
+        _lock_waits[path] = (waits + 1, total + waited, max(longest, waited))
+
+
+def _same_file(path, fd):
+    try:
+        path_stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return os.path.samestat(path_stat, os.fstat(fd))
+
+
+# Give the lock waits counted since this was last called, by file.
+def take_lock_waits():
+    global _lock_waits
+    with _lock:
+        lock_waits, _lock_waits = _lock_waits, {}
+    return lock_waits
+
+
+def _pending_marker(path, pid=None):
+    return '{}.{}{}'.format(path, pid or os.getpid(), _PENDING_MARKER_SUFFIX)
+
+
+def _mark_pending(path):
+    _warn_of_unwritten_appends(path)
+    with open(_pending_marker(path), 'w') as marker:
+        marker.write(
+            'Appends buffered since {}\n'.format(datetime.datetime.now())
+        )
+
+
+def _remove_pending_marker(path):
+    try:
+        os.remove(_pending_marker(path))
+    except FileNotFoundError:
+        pass
+
+
+# Report, once, any appends left unwritten by a process which has since died.
+def _warn_of_unwritten_appends(path):
+    for marker in glob.glob(glob.escape(path) + '.*' + _PENDING_MARKER_SUFFIX):
+        pid = marker[len(path) + 1:-len(_PENDING_MARKER_SUFFIX)]
+        if not pid.isdigit() or _process_running(int(pid)):
+            continue
+
+        with open(marker) as marker_file:
+            since = marker_file.read().strip()
+        click.echo(
+            'Warning: {} may be missing entries from an earlier command '
+            'which did not finish ({}).'.format(path, since),
+            err=True
+        )
+        os.remove(marker)
+
+
+def _process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+atexit.register(flush)
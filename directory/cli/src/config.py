@@ -61,6 +61,15 @@ def _support_eject_success_message(appliance_url=None):
 _DIRECTORY_CONFIG = {
     'DIRECTORY_RECORD': join(_STANDARD_CONFIG['APPLIANCE_DIR'], 'record'),
     'DIRECTORY_LOG': join(_STANDARD_CONFIG['APPLIANCE_DIR'], 'log.csv'),
+    'DIRECTORY_JSON_LOG': join(_STANDARD_CONFIG['APPLIANCE_DIR'], 'log.jsonl'),
+    'DIRECTORY_LOG_INDEX': join(
+        _STANDARD_CONFIG['APPLIANCE_DIR'], 'log-index.sqlite'
+    ),
+    'DIRECTORY_CACHE': join(_STANDARD_CONFIG['APPLIANCE_DIR'], 'cache.sqlite'),
+    'DIRECTORY_IMPORT_CHECKPOINT': join(
+        _STANDARD_CONFIG['APPLIANCE_DIR'], 'import-checkpoint.jsonl'
+    ),
+    'DIRECTORY_KRB5_CCACHE_DIR': join(_STANDARD_CONFIG['APPLIANCE_DIR'], 'krb5cc'),
 
     'DIRECTORY_USER_CONFIG': join(_STANDARD_CONFIG['APPLIANCE_DIR'], 'etc/user_config'),
 
@@ -75,13 +84,17 @@ _DIRECTORY_CONFIG = {
     'ORIGINAL_COMMAND_META_KEY': __name__ + '.command',
     'IMPORT_STATUS_META_KEY': __name__ + '.importing',
     'IMPORTED_USER_PASSWORDS_META_KEY': __name__ + '.imported-user-passwords',
+    'IMPORT_LINE_META_KEY': __name__ + '.import-line',
+    'IMPORT_MEMO_META_KEY': __name__ + '.import-memo',
 
     'SUPPORT_EJECT_INFO_MESSAGE': (
         'This will eject your Flight Directory support, allowing you full '
         'command-line access via SSH and full access to FreeIPA.'
     ),
     'SUPPORT_EJECT_SUCCESS_MESSAGE_CALLBACK': _support_eject_success_message,
-    'IPA_WRAPPER_SCRIPT_PATH': join(_STANDARD_CONFIG['APPLIANCE_DIR'], 'libexec/userware-ipa-wrapper')
+    'IPA_WRAPPER_SCRIPT_PATH': join(_STANDARD_CONFIG['APPLIANCE_DIR'], 'libexec/userware-ipa-wrapper'),
+    'PASSWORD_GENERATOR_PATH': join(_STANDARD_CONFIG['APPLIANCE_DIR'], 'libexec/password-generator'),
+    'IPA_CA_CERT': '/etc/ipa/ca.crt',
 }
 
 CONFIG = appliance_cli.config.finalize_config(
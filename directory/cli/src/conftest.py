@@ -37,3 +37,41 @@ from appliance_cli.shared_fixtures import *  # NOQA.
 def mock_directory_record(monkeypatch, tmpdir):
     mock_record = tmpdir.mkdir("directory").join('record').strpath
     monkeypatch.setattr(CONFIG, 'DIRECTORY_RECORD', mock_record)
+
+
+@pytest.fixture(autouse=True)
+def mock_directory_log(monkeypatch, tmpdir):
+    monkeypatch.setattr(
+        CONFIG, 'DIRECTORY_LOG', tmpdir.join('log.csv').strpath
+    )
+    monkeypatch.setattr(
+        CONFIG, 'DIRECTORY_JSON_LOG', tmpdir.join('log.jsonl').strpath
+    )
+    monkeypatch.setattr(
+        CONFIG, 'DIRECTORY_LOG_INDEX', tmpdir.join('log-index.sqlite').strpath
+    )
+
+
+# No user config is present unless a test writes one to this path.
+@pytest.fixture(autouse=True)
+def mock_user_config(monkeypatch, tmpdir):
+    mock_config = tmpdir.join('user_config').strpath
+    monkeypatch.setattr(CONFIG, 'DIRECTORY_USER_CONFIG', mock_config)
+
+
+@pytest.fixture(autouse=True)
+def mock_directory_cache(monkeypatch, tmpdir):
+    mock_cache = tmpdir.join('cache.sqlite').strpath
+    monkeypatch.setattr(CONFIG, 'DIRECTORY_CACHE', mock_cache)
+
+
+@pytest.fixture(autouse=True)
+def mock_import_checkpoint(monkeypatch, tmpdir):
+    mock_checkpoint = tmpdir.join('import-checkpoint.jsonl').strpath
+    monkeypatch.setattr(CONFIG, 'DIRECTORY_IMPORT_CHECKPOINT', mock_checkpoint)
+
+
+@pytest.fixture(autouse=True)
+def mock_krb5_ccache_dir(monkeypatch, tmpdir):
+    mock_ccache_dir = tmpdir.join('krb5cc').strpath
+    monkeypatch.setattr(CONFIG, 'DIRECTORY_KRB5_CCACHE_DIR', mock_ccache_dir)
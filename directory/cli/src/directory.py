@@ -26,23 +26,40 @@
 #==============================================================================
 import click
 from click import ClickException, Group
+import importlib
 import shlex
 import re
+import sys
+import time
 from os import getenv
 
-from config import CONFIG
 import utils
-import user
-import group
-import host
-import hostgroup
-import import_export
+import appender
 import logger
-from appliance_cli.commands import command_modules as standard_command_modules
-from appliance_cli.sandbox import ExitSandboxException
 from exceptions import IpaRunError
 
 
+# The module adding each top-level command, imported (and its `add_commands`
+# called) only once the command is needed, so running one command doesn't
+# wait on importing everything needed by all the others.
+_COMMAND_MODULES = {
+    'sandbox': 'appliance_cli.sandbox',
+    'support': 'appliance_cli.support',
+    'help': 'appliance_cli.help',
+    'user': 'user',
+    'group': 'group',
+    'import': 'import_export',
+    'export': 'import_export',
+    'record': 'record',
+    'log': 'log_search',
+}
+
+_ADVANCED_COMMAND_MODULES = {
+    'host': 'host',
+    'hostgroup': 'hostgroup',
+}
+
+
 # Customized Group class to use for the Directory CLI top-level command.
 class DirectoryGroup(Group):
 
@@ -52,21 +69,43 @@ class DirectoryGroup(Group):
     def parse_args(self, ctx, args):
         quoted_args = [shlex.quote(arg.strip()) for arg in args]
         original_command = ' '.join(quoted_args)
-        ctx.meta[CONFIG.ORIGINAL_COMMAND_META_KEY] = original_command
+        utils.set_original_command(original_command)
         return Group.parse_args(self, ctx, args)
 
+    # Log each time the CLI is started (rather than whenever this module is
+    # imported).
+    def main(self, *args, **kwargs):
+        logger.write_to_log(["access", "Success"])
+        return Group.main(self, *args, **kwargs)
+
+    def list_commands(self, ctx):
+        return sorted(set(self.commands) | set(_command_modules()))
+
+    def get_command(self, ctx, name):
+        if name not in self.commands and name in _command_modules():
+            module = importlib.import_module(_command_modules()[name])
+            module.add_commands(self)
+        return self.commands.get(name)
+
     def _log_and_run_cmd(self, ctx):
+        started = time.monotonic()
         try:
             super().invoke(ctx)
-            logger.log_cmd(args=["Success"])
+            logger.log_cmd(
+                args=["Success"], duration=time.monotonic() - started
+            )
         # Ignores the actual 'exit' command from the log (as it throws an ExitSandboxException)
         # Instead we write to the log immediately after, as the sandbox exits, with the original command retrieved from the Click context
         # TODO also filter out logs produced through EOF commands like Ctrl+D
         #   may take an overhaul of logging method + use of atexit module
-        except ExitSandboxException:
-            raise
         except Exception as error:
-            logger.log_cmd(args=["Failure"], error=error)
+            if _exiting_sandbox(error):
+                raise
+            logger.log_cmd(
+                args=["Failure"],
+                error=error,
+                duration=time.monotonic() - started
+            )
             raise error
 
     def invoke(self, ctx):
@@ -76,6 +115,15 @@ class DirectoryGroup(Group):
             # Convert any unhandled `IpaRunError` to a `ClickException`, for
             # nice error display.
             raise ClickException(ex.message)
+        finally:
+            # Write any buffered record and log appends once each top-level
+            # command (including a whole import) has finished.
+            if not utils.currently_importing():
+                appender.flush()
+                # Logged after flushing, so waits while writing any buffered
+                # appends are included.
+                logger.log_lock_waits()
+                appender.flush()
 
 @click.command(
     cls=DirectoryGroup,
@@ -83,19 +131,19 @@ class DirectoryGroup(Group):
 )
 
 def directory():
-    # TODO: This might not be needed for all directory subcommands; should
-    # maybe move calling so only done if needed.
-    utils.obtain_kerberos_ticket()
-
-command_modules = standard_command_modules + [
-            user,
-            group,
-            import_export,
-        ]
-if utils.advanced_mode_enabled():
-    command_modules += [host, hostgroup]
-
-for module in command_modules:
-    module.add_commands(directory)
-
-logger.write_to_log(["access", "Success"])
+    # A Kerberos ticket is only obtained when first running `ipa`; see
+    # `kerberos.ensure_ticket`.
+    pass
+
+
+def _command_modules():
+    if utils.advanced_mode_enabled():
+        return {**_COMMAND_MODULES, **_ADVANCED_COMMAND_MODULES}
+    return _COMMAND_MODULES
+
+
+def _exiting_sandbox(error):
+    # The sandbox can only be exited once its module has been loaded.
+    sandbox = sys.modules.get('appliance_cli.sandbox')
+    return sandbox is not None and \
+        isinstance(error, sandbox.ExitSandboxException)
@@ -0,0 +1,414 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+from collections import namedtuple
+from contextlib import closing
+import json
+import os
+import sqlite3
+import time
+
+from config import CONFIG
+import ipa_utils
+import utils
+from exceptions import IpaRunError
+
+
+# On-disk snapshot of the users, groups, hosts and host groups in IPA, so that
+# read only commands can be answered without running a full `ipa *-find` every
+# time. Each kind of entity is fetched in full (with all fields) when it is
+# first needed, and then reused until it is older than the configured TTL.
+#
+# Caching is enabled by setting `CACHE_TTL` (in seconds) in the user config;
+# by default this is 0 and everything is fetched from IPA as before, since
+# changes not made through this CLI (e.g. by the host join triggers) would not
+# be seen until the snapshot expires.
+
+TTL_CONFIG_KEY = 'CACHE_TTL'
+
+# Separately from the snapshot, an index of the name of the group with each
+# GID is kept, for resolving users' primary groups. This only changes when
+# groups (including users' private groups) are added, renamed or deleted, so
+# can be kept for longer than the snapshot by setting `GID_INDEX_TTL` (in
+# seconds). As with `CACHE_TTL` this is 0 by default, disabling the index; when
+# enabled, a GID missing from the index (e.g. for a group added outside this
+# CLI) causes it to be fetched again rather than shown as having no group.
+GID_INDEX_TTL_CONFIG_KEY = 'GID_INDEX_TTL'
+DEFAULT_GID_INDEX_TTL = 0
+
+GID_INDEX = 'gid-index'
+
+# `ipa` commands which can change the group with a GID.
+_GID_INDEX_COMMANDS = [
+    'user-add',
+    'user-mod',
+    'user-del',
+    'group-add',
+    'group-mod',
+    'group-del',
+]
+
+SnapshotKind = namedtuple(
+    'SnapshotKind',
+    ['ipa_find_command', 'ipa_find_args', 'key_field', 'nothing_found']
+)
+
+SNAPSHOT_KINDS = {
+    'user': SnapshotKind('user-find', [], 'User login', '0 users matched'),
+    'group': SnapshotKind('group-find', [], 'Group name', '0 groups matched'),
+    'private-group': SnapshotKind(
+        'group-find', ['--private'], 'Group name', '0 groups matched'
+    ),
+    'host': SnapshotKind('host-find', [], 'Host name', '0 hosts matched'),
+    'hostgroup': SnapshotKind(
+        'hostgroup-find', [], 'Host-group', '0 hostgroups matched'
+    ),
+}
+
+# Mutating `ipa` commands which output the resulting entry, and its kind.
+_ENTRY_RESULT_KINDS = {
+    'user-add': 'user',
+    'user-mod': 'user',
+    'group-add': 'group',
+    'group-mod': 'group',
+    'group-add-member': 'group',
+    'group-remove-member': 'group',
+    'host-add': 'host',
+    'host-mod': 'host',
+    'hostgroup-add': 'hostgroup',
+    'hostgroup-mod': 'hostgroup',
+    'hostgroup-add-member': 'hostgroup',
+    'hostgroup-remove-member': 'hostgroup',
+}
+
+# Deleting `ipa` commands, and the kind of entry they delete.
+_DELETED_KINDS = {
+    'user-del': 'user',
+    'group-del': 'group',
+    'host-del': 'host',
+    'hostgroup-del': 'hostgroup',
+}
+
+# `ipa` commands which change a single field of an entry, without outputting
+# the entry.
+_FIELD_UPDATES = {
+    'user-enable': ('user', 'Account disabled', 'False'),
+    'user-disable': ('user', 'Account disabled', 'True'),
+}
+
+# Other kinds of entry which can be changed as a side effect of a command,
+# e.g. membership shown on the other side of a relationship.
+_SIDE_EFFECT_KINDS = {
+    'user-add': ['private-group'],
+    'user-del': ['private-group', 'group'],
+    'group-del': ['user'],
+    'group-add-member': ['user'],
+    'group-remove-member': ['user'],
+    'host-del': ['hostgroup'],
+    'hostgroup-del': ['host'],
+    'hostgroup-add-member': ['host'],
+    'hostgroup-remove-member': ['host'],
+}
+
+# Fields of a command result which should never be kept in the snapshot.
+_UNCACHED_FIELDS = ['Random password']
+
+_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS entries ('
+    '  kind TEXT, key TEXT, position INTEGER, data TEXT,'
+    '  PRIMARY KEY (kind, key))',
+    'CREATE TABLE IF NOT EXISTS snapshots ('
+    '  kind TEXT PRIMARY KEY, refreshed_at REAL)',
+    'CREATE TABLE IF NOT EXISTS gid_index ('
+    '  gid TEXT PRIMARY KEY, group_name TEXT)',
+]
+
+
+def ttl():
+    try:
+        return int(utils.get_user_config(TTL_CONFIG_KEY) or 0)
+    except ValueError:
+        return 0
+
+
+def enabled():
+    return ttl() > 0
+
+
+def gid_index_ttl():
+    try:
+        value = utils.get_user_config(GID_INDEX_TTL_CONFIG_KEY)
+        return DEFAULT_GID_INDEX_TTL if value is None else int(value)
+    except ValueError:
+        return DEFAULT_GID_INDEX_TTL
+
+
+# Map from each GID to the name of the group (public or private) with it,
+# using the GID index unless this is disabled (or a refresh is asked for).
+def group_names_by_gid(refresh=False):
+    if gid_index_ttl() <= 0:
+        return _fetch_group_names_by_gid()
+
+    with closing(_connect()) as connection:
+        if refresh or not _fresh(connection, GID_INDEX):
+            _refresh_gid_index(connection)
+
+        rows = connection.execute('SELECT gid, group_name FROM gid_index')
+        return dict(rows.fetchall())
+
+
+# All entries of the given kind, fetching a new snapshot if needed.
+def entries(kind):
+    with closing(_connect()) as connection:
+        if not _fresh(connection, kind):
+            _refresh(connection, kind)
+
+        rows = connection.execute(
+            'SELECT data FROM entries WHERE kind = ? ORDER BY position',
+            (kind,)
+        )
+        return [json.loads(data) for (data,) in rows]
+
+
+# The entry of the given kind with the given key; raises an `IpaRunError`, as
+# the equivalent `ipa *-find` would, if there is no such entry.
+def find(kind, key):
+    with closing(_connect()) as connection:
+        if not _fresh(connection, kind):
+            _refresh(connection, kind)
+
+        row = connection.execute(
+            'SELECT data FROM entries WHERE kind = ? AND key = ?',
+            (kind, _normalize_key(key))
+        ).fetchone()
+
+    if row is None:
+        raise IpaRunError(SNAPSHOT_KINDS[kind].nothing_found)
+    return [json.loads(row[0])]
+
+
+# Mark the snapshots of the given kinds (or of all kinds, and the GID index,
+# if none given) as stale, so they are fetched again when next needed.
+def invalidate(*kinds):
+    kinds = kinds or list(SNAPSHOT_KINDS.keys()) + [GID_INDEX]
+    with closing(_connect()) as connection, connection:
+        for kind in kinds:
+            _mark_stale(connection, kind)
+
+
+# Extra args to pass to a mutating command so its output includes the whole
+# resulting entry, in the same form as in the snapshot.
+def result_args(ipa_command):
+    if ipa_command in _ENTRY_RESULT_KINDS and enabled():
+        return ['--all']
+    return []
+
+
+# Update the snapshot from the output of a successful mutating command, so it
+# does not need to be fetched again after changes made through this CLI.
+def apply_result(ipa_command, args, output):
+    if ipa_command in _GID_INDEX_COMMANDS and gid_index_ttl() > 0:
+        invalidate(GID_INDEX)
+
+    if not (args and enabled()):
+        return
+
+    key = args[0]
+    with closing(_connect()) as connection, connection:
+        if ipa_command in _ENTRY_RESULT_KINDS:
+            kind = _ENTRY_RESULT_KINDS[ipa_command]
+            entry = ipa_utils.parse_find_output(output)[0]
+            _store_entry(connection, kind, entry)
+        elif ipa_command in _DELETED_KINDS:
+            _delete_entry(connection, _DELETED_KINDS[ipa_command], key)
+        elif ipa_command in _FIELD_UPDATES:
+            kind, field, value = _FIELD_UPDATES[ipa_command]
+            _update_field(connection, kind, key, field, value)
+
+        for kind in _SIDE_EFFECT_KINDS.get(ipa_command, []):
+            _mark_stale(connection, kind)
+
+
+def _store_entry(connection, kind, entry):
+    if not _fresh(connection, kind):
+        # Will be fetched in full when next needed anyway.
+        return
+
+    key_field = SNAPSHOT_KINDS[kind].key_field
+    if key_field not in entry:
+        # Unexpected output; can't tell which entry has changed.
+        _mark_stale(connection, kind)
+        return
+
+    entry = {
+        field: value for field, value in entry.items()
+        if field not in _UNCACHED_FIELDS
+    }
+    key = _normalize_key(entry[key_field][0])
+
+    existing = connection.execute(
+        'SELECT position FROM entries WHERE kind = ? AND key = ?', (kind, key)
+    ).fetchone()
+    if existing:
+        position = existing[0]
+    else:
+        (last_position,) = connection.execute(
+            'SELECT MAX(position) FROM entries WHERE kind = ?', (kind,)
+        ).fetchone()
+        position = 0 if last_position is None else last_position + 1
+
+    connection.execute(
+        'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+        (kind, key, position, json.dumps(entry))
+    )
+
+
+def _delete_entry(connection, kind, key):
+    connection.execute(
+        'DELETE FROM entries WHERE kind = ? AND key = ?',
+        (kind, _normalize_key(key))
+    )
+
+
+def _update_field(connection, kind, key, field, value):
+    row = connection.execute(
+        'SELECT data FROM entries WHERE kind = ? AND key = ?',
+        (kind, _normalize_key(key))
+    ).fetchone()
+    if row is None:
+        return
+
+    entry = json.loads(row[0])
+    entry[field] = [value]
+    connection.execute(
+        'UPDATE entries SET data = ? WHERE kind = ? AND key = ?',
+        (json.dumps(entry), kind, _normalize_key(key))
+    )
+
+
+def _mark_stale(connection, kind):
+    connection.execute(
+        'UPDATE snapshots SET refreshed_at = 0 WHERE kind = ?', (kind,)
+    )
+
+
+def _fresh(connection, kind):
+    kind_ttl = gid_index_ttl() if kind == GID_INDEX else ttl()
+    row = connection.execute(
+        'SELECT refreshed_at FROM snapshots WHERE kind = ?', (kind,)
+    ).fetchone()
+    return row is not None and row[0] + kind_ttl > time.time()
+
+
+def _refresh(connection, kind):
+    snapshot_kind = SNAPSHOT_KINDS[kind]
+    item_dicts = ipa_utils.ipa_find(
+        snapshot_kind.ipa_find_command,
+        snapshot_kind.ipa_find_args,
+        error_allowed=snapshot_kind.nothing_found
+    )
+
+    # Nothing being found gives a single empty item; skip this.
+    rows = [
+        (kind, _normalize_key(item_dict[snapshot_kind.key_field][0]),
+         position, json.dumps(item_dict))
+        for position, item_dict in enumerate(item_dicts)
+        if item_dict
+    ]
+
+    with connection:
+        connection.execute('DELETE FROM entries WHERE kind = ?', (kind,))
+        connection.executemany('INSERT INTO entries VALUES (?, ?, ?, ?)', rows)
+        connection.execute(
+            'INSERT OR REPLACE INTO snapshots VALUES (?, ?)',
+            (kind, time.time())
+        )
+
+
+def _refresh_gid_index(connection):
+    group_names_by_gid = _fetch_group_names_by_gid()
+
+    with connection:
+        connection.execute('DELETE FROM gid_index')
+        connection.executemany(
+            'INSERT INTO gid_index VALUES (?, ?)', group_names_by_gid.items()
+        )
+        connection.execute(
+            'INSERT OR REPLACE INTO snapshots VALUES (?, ?)',
+            (GID_INDEX, time.time())
+        )
+
+
+def _fetch_group_names_by_gid():
+    # Want to get all groups, normal/public and private; there's no single
+    # `ipa` command which gives these so both kinds are needed. Later kinds
+    # take precedence, so a user's private group is used for their GID over
+    # any public group with the same GID.
+    kinds = ['group', 'private-group']
+    if enabled():
+        kinds_item_dicts = [entries(kind) for kind in kinds]
+    else:
+        kinds_item_dicts = ipa_utils.ipa_find_concurrently(
+            [
+                (
+                    SNAPSHOT_KINDS[kind].ipa_find_command,
+                    SNAPSHOT_KINDS[kind].ipa_find_args,
+                    SNAPSHOT_KINDS[kind].nothing_found,
+                )
+                for kind in kinds
+            ],
+            all_fields=False
+        )
+
+    group_names_by_gid = {}
+    for item_dicts in kinds_item_dicts:
+        for item_dict in item_dicts:
+            # Sometimes groups don't have a GID (e.g. the `ipausers` group);
+            # skip over these (and the empty item when nothing is found).
+            if 'GID' in item_dict:
+                group_names_by_gid[item_dict['GID'][0]] = \
+                    item_dict['Group name'][0]
+    return group_names_by_gid
+
+
+def _connect():
+    new_cache = not os.path.exists(CONFIG.DIRECTORY_CACHE)
+
+    connection = sqlite3.connect(CONFIG.DIRECTORY_CACHE, timeout=30)
+    for statement in _SCHEMA:
+        connection.execute(statement)
+
+    if new_cache:
+        # Snapshot contains details of every user; keep it private.
+        os.chmod(CONFIG.DIRECTORY_CACHE, 0o600)
+
+    return connection
+
+
+def _normalize_key(key):
+    # IPA matches names case insensitively.
+    return key.lower()
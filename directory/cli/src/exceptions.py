@@ -33,3 +33,18 @@ class IpaRunError(Exception):
 
     def __str__(self):
         return self.message
+
+
+# Raised by `ipa_rpc` when a JSON-RPC request to IPA fails or returns an error.
+class IpaRpcError(Exception):
+    pass
+
+
+# Raised by `ipa_utils` when commands run in a batch fail; `failures` is a list
+# of the import line (if any) the command was from and the `ClickException`
+# for each failed command.
+class IpaBatchError(Exception):
+
+    def __init__(self, failures):
+        super().__init__(failures)
+        self.failures = failures
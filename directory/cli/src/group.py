@@ -27,6 +27,7 @@
 
 import click
 from collections import OrderedDict
+import functools
 
 import list_command
 from list_command import field_with_same_name
@@ -71,19 +72,29 @@ def add_commands(directory):
         pass
 
     @group.command(help='List all groups')
-    def list():
+    @list_command.refresh_option
+    @list_command.format_option
+    @list_command.fields_option
+    def list(refresh, output_format, fields):
         list_command.do(
             ipa_find_command='group-find',
             all_fields=False,
             field_configs=GROUP_LIST_FIELD_CONFIGS,
             sort_key='Group name',
             blacklist_key='Group name',
-            blacklist_val_array=GROUP_BLACKLIST
+            blacklist_val_array=GROUP_BLACKLIST,
+            cache_kind='group',
+            refresh=refresh,
+            output_format=output_format,
+            fields=fields
         )
 
     @group.command(help='Show detailed information on a group')
     @click.argument('group_name')
-    def show(group_name):
+    @list_command.refresh_option
+    @list_command.format_option
+    @list_command.fields_option
+    def show(group_name, refresh, output_format, fields):
         _validate_blacklist_groups(group_name)
         group_find_args = ['--group-name={}'.format(group_name)]
         try:
@@ -91,7 +102,12 @@ def add_commands(directory):
                 ipa_find_command='group-find',
                 ipa_find_args=group_find_args,
                 field_configs=GROUP_SHOW_FIELD_CONFIGS,
-                display=list_command.list_displayer
+                display=list_command.list_displayer,
+                cache_kind='group',
+                cache_key=group_name,
+                refresh=refresh,
+                output_format=output_format,
+                fields=fields
             )
         except IpaRunError:
             # No matching group found
@@ -113,12 +129,7 @@ def add_commands(directory):
             user_options = ['--users={}'.format(user) for user in users]
             ipa_command = 'group-add-member'
             args = [group_name] + user_options
-            try:
-                ipa_utils.ipa_run(ipa_command, args, error_in_stdout=True)
-                utils.display_success()
-                utils.run_post_command_script('POST_MEMBER_ADD_SCRIPT', builtins.list(users))
-            except IpaRunError:
-                _diagnose_member_command_error(group_name, users, add_command=True)
+            _run_member_command(ipa_command, args, group_name, users, add_command=True)
 
         @member.command(name='remove', help='Remove user(s) from a group')
         @click.argument('group_name')
@@ -128,12 +139,7 @@ def add_commands(directory):
             user_options = ['--users={}'.format(user) for user in users]
             ipa_command = 'group-remove-member'
             args = [group_name] + user_options
-            try:
-                ipa_utils.ipa_run(ipa_command, args, error_in_stdout=True)
-                utils.display_success()
-                utils.run_post_command_script('POST_MEMBER_REMOVE_SCRIPT', builtins.list(users))
-            except IpaRunError:
-                _diagnose_member_command_error(group_name, users, add_command=False)
+            _run_member_command(ipa_command, args, group_name, users, add_command=False)
 
     if not utils.advanced_mode_enabled():
         @click.argument('GID', required=False)
@@ -251,12 +257,7 @@ Leave all fields blank to be prompted for values.""".strip()
             user_options = ['--users={}'.format(user) for user in users]
 
             args = [group] + user_options
-            try:
-                ipa_utils.ipa_run('group-add-member', args, error_in_stdout=True)
-                utils.display_success()
-                utils.run_post_command_script('POST_MEMBER_ADD_SCRIPT', users)
-            except IpaRunError:
-                _diagnose_member_command_error(group, users, add_command=True)
+            _run_member_command('group-add-member', args, group, users, add_command=True)
 
             logger.log_cmd(args)
 
@@ -274,12 +275,7 @@ Leave all fields blank to be prompted for values.""".strip()
             user_options = ['--users={}'.format(user) for user in users]
 
             args = [group] + user_options
-            try:
-                ipa_utils.ipa_run('group-remove-member', args, error_in_stdout=True)
-                utils.display_success()
-                utils.run_post_command_script('POST_MEMBER_REMOVE_SCRIPT', users)
-            except IpaRunError:
-                _diagnose_member_command_error(group, users, add_command=False)
+            _run_member_command('group-remove-member', args, group, users, add_command=False)
 
     advanced_ipa_wrapper_commands = [
         ipa_wrapper_command.create(
@@ -318,6 +314,29 @@ def _validate_blacklist_groups(argument, options={}):
     return options
 
 
+# Run a group member command, then on success run the post command script for
+# the users, or on failure diagnose the error; this may only happen once later
+# commands have been run when batching commands during an import.
+def _run_member_command(ipa_command, args, group_name, users, add_command=False):
+    post_command_script = \
+        'POST_MEMBER_ADD_SCRIPT' if add_command else 'POST_MEMBER_REMOVE_SCRIPT'
+
+    def handle_result(result):
+        utils.display_success()
+        utils.run_post_command_script(post_command_script, builtins.list(users))
+
+    def handle_error(error):
+        _diagnose_member_command_error(group_name, users, add_command=add_command)
+
+    ipa_utils.ipa_run_then(
+        ipa_command,
+        args,
+        on_result=handle_result,
+        on_error=handle_error,
+        error_in_stdout=True
+    )
+
+
 #add-member & remove-member commands were erroring silently so this method was needed
 def _diagnose_member_command_error(group_name, users, add_command=False):
     if add_command:
@@ -336,32 +355,43 @@ def _diagnose_member_command_error(group_name, users, add_command=False):
     # the other errors are non-castrophic, the command still goes through
     error = "Non-fatal " + error.lower()
     # next checking if each user in users exists
-    user_not_found = None
-    for user in users:
-        try:
-            user_find_args = ['--login={}'.format(user)]
-            users_found = ipa_utils.ipa_find('user-find', user_find_args, all_fields=False)
-        except IpaRunError:
-            user_not_found = user
-            break
-    if user_not_found:
-        error = error + '{} - user not found'.format(user_not_found)
-        raise click.ClickException(error)
+    users_found = _finds_succeed([
+        ('user-find', ['--login={}'.format(user)]) for user in users
+    ])
+    for user, user_found in zip(users, users_found):
+        if not user_found:
+            error = error + '{} - user not found'.format(user)
+            raise click.ClickException(error)
 
     #check if the any of the users already are/aren't in the group
-    for user in users:
-        try:
-            group_find_args = ['--group-name={}'.format(group_name), '--users={}'.format(user)]
-            groups_found = ipa_utils.ipa_find('group-find', group_find_args, all_fields=False)
-            #if the user's in the group the cmd's trying to add them to, that's an error
-            if add_command:
-                error = error + "User " + user + " already in the group"
-                raise click.ClickException(error)
-        except IpaRunError:
-            # if the user's not in the group & the cmd's is trying to remove them, that's an error
-            if not add_command:
-                error = error + "User " + user + " not in the group"
-                raise click.ClickException(error)
+    users_in_group = _finds_succeed([
+        ('group-find', ['--group-name={}'.format(group_name), '--users={}'.format(user)])
+        for user in users
+    ])
+    for user, user_in_group in zip(users, users_in_group):
+        #if the user's in the group the cmd's trying to add them to, that's an error
+        if user_in_group and add_command:
+            error = error + "User " + user + " already in the group"
+            raise click.ClickException(error)
+        # if the user's not in the group & the cmd's is trying to remove them, that's an error
+        elif not user_in_group and not add_command:
+            error = error + "User " + user + " not in the group"
+            raise click.ClickException(error)
 
     error = "Unknown error"
     raise click.ClickException(error)
+
+
+# Whether each of the given `ipa_find` queries finds anything; these are run
+# concurrently as they are independent.
+def _finds_succeed(queries):
+    def succeeds(query):
+        try:
+            ipa_utils.ipa_find(*query, all_fields=False)
+            return True
+        except IpaRunError:
+            return False
+
+    return ipa_utils.run_concurrently([
+        functools.partial(succeeds, query) for query in queries
+    ])
@@ -62,18 +62,28 @@ def add_commands(directory):
         pass
 
     @host.command(help='List all hosts')
-    def list():
+    @list_command.refresh_option
+    @list_command.format_option
+    @list_command.fields_option
+    def list(refresh, output_format, fields):
         list_command.do(
             ipa_find_command='host-find',
 	    field_configs=HOST_LIST_FIELD_CONFIGS,
 	    sort_key='Host name',
 	    blacklist_key='serverhostname',
 	    blacklist_val_array=HOST_BLACKLIST,
+	    cache_kind='host',
+	    refresh=refresh,
+	    output_format=output_format,
+	    fields=fields,
 	)
 
     @host.command(help='Show detailed information on a host')
     @click.argument('hostname')
-    def show(hostname):
+    @list_command.refresh_option
+    @list_command.format_option
+    @list_command.fields_option
+    def show(hostname, refresh, output_format, fields):
         _validate_blacklist_hosts(hostname)
         host_find_args = ['--hostname={}'.format(hostname)]
         try:
@@ -81,7 +91,12 @@ def add_commands(directory):
                 ipa_find_command='host-find',
                 ipa_find_args=host_find_args,
                 field_configs=HOST_SHOW_FIELD_CONFIGS,
-                display=list_command.list_displayer
+                display=list_command.list_displayer,
+                cache_kind='host',
+                cache_key=hostname,
+                refresh=refresh,
+                output_format=output_format,
+                fields=fields
             )
         except IpaRunError:
             # No matching host found; for consistency raise error with similar
@@ -59,7 +59,10 @@ def add_commands(directory):
         pass
 
     @hostgroup.command(help='List all host groups')
-    def list():
+    @list_command.refresh_option
+    @list_command.format_option
+    @list_command.fields_option
+    def list(refresh, output_format, fields):
         list_command.do(
             ipa_find_command='hostgroup-find',
             all_fields=False,
@@ -67,11 +70,18 @@ def add_commands(directory):
             sort_key='Host-group',
             blacklist_key='Host-group',
             blacklist_val_array=HOSTGROUP_BLACKLIST,
+            cache_kind='hostgroup',
+            refresh=refresh,
+            output_format=output_format,
+            fields=fields,
         )
 
     @hostgroup.command(help='Show detailed information on one host group')
     @click.argument('hostgroup_name')
-    def show(hostgroup_name):
+    @list_command.refresh_option
+    @list_command.format_option
+    @list_command.fields_option
+    def show(hostgroup_name, refresh, output_format, fields):
         _validate_blacklist_hostgroups(hostgroup_name)
         hostgroup_find_args = ['--hostgroup-name={}'.format(hostgroup_name)]
         try:
@@ -79,7 +89,12 @@ def add_commands(directory):
                 ipa_find_command='hostgroup-find',
                 ipa_find_args=hostgroup_find_args,
                 field_configs=HOSTGROUP_SHOW_FIELD_CONFIGS,
-                display=list_command.list_displayer
+                display=list_command.list_displayer,
+                cache_kind='hostgroup',
+                cache_key=hostgroup_name,
+                refresh=refresh,
+                output_format=output_format,
+                fields=fields
             )
         except IpaRunError:
             #no hostgroup by that name found
@@ -0,0 +1,197 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+from collections import namedtuple
+import hashlib
+import itertools
+import json
+import os
+
+from click import ClickException
+
+import appender
+from config import CONFIG
+
+
+# A journal of the progress of the current import, so an import which fails or
+# is interrupted can be resumed without re-running the lines already run. The
+# first entry identifies the record being imported; each later entry gives the
+# lines which have since been run, the changes to the generated passwords, and
+# the hash of the record lines read so far (which may not yet be all of them,
+# as the record is read as it is imported). This includes passwords, so is
+# only readable by its owner.
+
+Checkpoint = namedtuple(
+    'Checkpoint',
+    ['url', 'source_hash', 'source_lines', 'completed_lines', 'passwords']
+)
+
+_active = False
+
+# The generated passwords as of the last entry written.
+_journalled_passwords = {}
+
+# The hash and number of the record lines read so far; see `tracked`.
+_source_hash = hashlib.sha256()
+_source_lines = 0
+
+
+def read():
+    try:
+        with open(CONFIG.DIRECTORY_IMPORT_CHECKPOINT) as journal:
+            entries = list(_read_entries(journal))
+    except FileNotFoundError:
+        entries = []
+
+    if not entries:
+        raise ClickException('No interrupted import found to resume.')
+
+    header, progress = entries[0], entries[1:]
+    source_hash = hashlib.sha256().hexdigest()
+    source_lines = 0
+    completed_lines = set()
+    passwords = {}
+    for entry in progress:
+        source_hash = entry['source_hash']
+        source_lines = entry['source_lines']
+        completed_lines.update(entry['lines'])
+        for login, password in entry['passwords'].items():
+            if password is None:
+                passwords.pop(login, None)
+            else:
+                passwords[login] = password
+
+    return Checkpoint(
+        url=header['url'],
+        source_hash=source_hash,
+        source_lines=source_lines,
+        completed_lines=completed_lines,
+        passwords=passwords,
+    )
+
+
+# Pass through the given `(line_number, line)` record lines, keeping the hash
+# of those read so far.
+def tracked(lines):
+    global _source_hash, _source_lines
+    _source_hash = hashlib.sha256()
+    _source_lines = 0
+    for line_number, line in lines:
+        _source_hash.update(line.encode() + b'\n')
+        _source_lines += 1
+        yield line_number, line
+
+
+# Check the start of the given tracked lines is the same as the lines which
+# had been read when the checkpoint was written, giving the same lines again.
+def check_source(checkpoint, lines):
+    lines = iter(lines)
+    read_lines = list(itertools.islice(lines, checkpoint.source_lines))
+
+    if len(read_lines) < checkpoint.source_lines or \
+            _source_hash.hexdigest() != checkpoint.source_hash:
+        raise ClickException(
+            'The record at {} has changed since the interrupted import; '
+            'import it again without --resume instead.'.format(checkpoint.url)
+        )
+
+    return itertools.chain(read_lines, lines)
+
+
+# Start journalling the import of the record from `url`, continuing from
+# `checkpoint` if given.
+def start(url, checkpoint=None):
+    global _active, _journalled_passwords
+    if checkpoint is None:
+        journal_fd = os.open(
+            CONFIG.DIRECTORY_IMPORT_CHECKPOINT,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+            0o600
+        )
+        with os.fdopen(journal_fd, 'w') as journal:
+            journal.write(_entry({'url': url}))
+        _journalled_passwords = {}
+    else:
+        _journalled_passwords = dict(checkpoint.passwords)
+    _active = True
+
+
+def active():
+    return _active
+
+
+def complete_lines(line_numbers, passwords):
+    global _journalled_passwords
+    if not active():
+        return
+
+    # Copy first, as commands still running may be changing these.
+    passwords = dict(passwords)
+    changes = {
+        login: password for login, password in passwords.items()
+        if _journalled_passwords.get(login) != password
+    }
+    changes.update({
+        login: None for login in _journalled_passwords
+        if login not in passwords
+    })
+
+    appender.append(CONFIG.DIRECTORY_IMPORT_CHECKPOINT, _entry({
+        'lines': sorted(line_numbers),
+        'passwords': changes,
+        'source_hash': _source_hash.hexdigest(),
+        'source_lines': _source_lines,
+    }), may_buffer=False)
+    _journalled_passwords = passwords
+
+
+# The import completed, so there is nothing to resume.
+def finish():
+    stop()
+    appender.discard(CONFIG.DIRECTORY_IMPORT_CHECKPOINT)
+    try:
+        os.remove(CONFIG.DIRECTORY_IMPORT_CHECKPOINT)
+    except FileNotFoundError:
+        pass
+
+
+def stop():
+    global _active
+    _active = False
+
+
+def _entry(entry):
+    return json.dumps(entry) + '\n'
+
+
+def _read_entries(journal):
+    for line in journal:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # The import was interrupted while writing this entry.
+            return
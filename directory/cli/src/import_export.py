@@ -26,6 +26,11 @@
 #==============================================================================
 
 import click
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import gzip
+import heapq
+import io
 import requests
 from requests_file import FileAdapter
 import shutil
@@ -34,11 +39,25 @@ import operator
 import time
 import math
 import csv
+from urllib.parse import urlparse
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 import utils
+import ipa_utils
+import ipa_rpc
+import import_checkpoint
+import record_check
+import record_commands
+import record_sync
 import appliance_cli
 import appliance_cli.text as text
 from config import CONFIG
+from exceptions import IpaBatchError
 
 
 # Add adapter so we can accept `file://` as well as `http://` URLs.
@@ -55,33 +74,124 @@ def add_commands(directory):
         name='import',
         help='Import a Directory record from a URL'
     )
-    @click.argument('url')
-    def import_(url):
+    @click.argument('url', required=False)
+    @click.option(
+        '--resume',
+        is_flag=True,
+        help='Continue the last import which did not complete, without '
+        're-running the lines it had already run'
+    )
+    @click.option(
+        '--check',
+        is_flag=True,
+        help='Only check the record for problems, without running it'
+    )
+    @click.option(
+        '--no-check',
+        is_flag=True,
+        help='Do not check the whole record first, so lines start running '
+        'while the record is still being fetched'
+    )
+    @click.option(
+        '--sync',
+        is_flag=True,
+        help='Only run the commands whose changes are not already in the '
+        'Directory'
+    )
+    @click.option(
+        '--batch-size',
+        type=click.IntRange(min=1),
+        help='Send commands to IPA in batches of up to this many '
+        '(requires the JSON-RPC IPA backend)'
+    )
+    @click.option(
+        '--jobs',
+        type=click.IntRange(min=1),
+        default=1,
+        help='Run up to this many independent commands at once'
+    )
+    def import_(url, resume, check, no_check, sync, batch_size, jobs):
+        if check and no_check:
+            raise click.ClickException(
+                'The --check and --no-check options cannot be used together.'
+            )
+
+        if batch_size and jobs > 1:
+            raise click.ClickException(
+                'The --batch-size and --jobs options cannot be used together.'
+            )
+
+        if batch_size and not ipa_rpc.enabled():
+            raise click.ClickException(
+                'Batched import requires the JSON-RPC IPA backend; set '
+                "'{}={}' in the user config to use this.".format(
+                    ipa_rpc.BACKEND_CONFIG_KEY, ipa_rpc.JSONRPC_BACKEND
+                )
+            )
+
+        checkpoint = import_checkpoint.read() if resume else None
+        if checkpoint:
+            url = url or checkpoint.url
+        elif not url:
+            raise click.UsageError('Missing argument "URL".')
+
         utils.mark_import_started()
         try:
-            content = SESSION.get(url).text
+            record_lines = import_checkpoint.tracked(_read_record(url))
+
+            completed_lines = set()
+            if checkpoint:
+                record_lines = import_checkpoint.check_source(
+                    checkpoint, record_lines
+                )
+                completed_lines = checkpoint.completed_lines
+                utils.imported_user_passwords().update(checkpoint.passwords)
 
-            content_lines = [
+            content_lines = (
                 (line_number, line)
-                for (line_number, line) in enumerate(content.splitlines())
-                if line.strip() != ''
-            ]
+                for (line_number, line) in record_lines
+                if line.strip() != '' and line_number not in completed_lines
+            )
 
-            with click.progressbar(content_lines) as lines_bar:
-                for line_number, command in lines_bar:
-                    utils.directory_run(directory, command)
+            # Unless told not to, check the whole record first, so no changes
+            # are made when any line would fail to run; otherwise lines are
+            # run as they are read.
+            if not no_check:
+                content_lines = list(content_lines)
+                _check_record(directory, content_lines)
+            if check:
+                click.echo('No problems found in {} record line{}.'.format(
+                    len(content_lines), '' if len(content_lines) == 1 else 's'
+                ))
+                return
 
-        except click.ClickException as ex:
-            error_string = "processing line {} ('{}'):{}"
-            new_ex = error_string.format(line_number, command, ex)
-            raise click.ClickException(new_ex)
+            import_checkpoint.start(url, checkpoint)
+
+            if sync:
+                sync_plan = record_sync.plan(directory, content_lines)
+                _display_sync_plan(sync_plan)
+                content_lines = sync_plan.lines
+
+            if jobs > 1:
+                _run_lines_concurrently(directory, content_lines, jobs)
+            else:
+                _run_lines(directory, content_lines, batch_size)
 
-        except requests.RequestException as ex:
-            raise click.ClickException(ex)
+            import_checkpoint.finish()
+
+        except click.ClickException as ex:
+            if import_checkpoint.active():
+                ex.message += (
+                    "\nRun 'directory import --resume' once this is fixed "
+                    'to continue the import from where it stopped.'
+                )
+            raise
 
         finally:
+            import_checkpoint.stop()
             utils.mark_import_finished()
-            _output_imported_user_passwords()
+            if not check:
+                _output_imported_user_passwords()
 
     @directory.command(help='Export Directory record')
     def export():
@@ -98,6 +208,237 @@ def add_commands(directory):
         click.echo(success_message)
 
 
+# Give each `(line_number, line)` of the record at `url` as it is fetched,
+# decompressing it on the fly if it is a `.gz` or `.zst` file. Only failures
+# fetching or decoding the record are reported as such, not those from running
+# the lines given.
+def _read_record(url):
+    try:
+        response = SESSION.get(url, stream=True)
+        response.raise_for_status()
+
+        with response:
+            stream = response.raw
+            # Undo any compression applied only for the HTTP transfer.
+            if hasattr(stream, 'decode_content'):
+                stream.decode_content = True
+
+            path = urlparse(url).path
+            if path.endswith('.gz'):
+                stream = gzip.GzipFile(fileobj=stream)
+            elif path.endswith('.zst'):
+                if zstandard is None:
+                    raise click.ClickException(
+                        'The zstandard Python package is needed to import '
+                        '.zst records.'
+                    )
+                stream = zstandard.ZstdDecompressor().stream_reader(stream)
+
+            record_text = io.TextIOWrapper(
+                stream, encoding=response.encoding or 'utf-8', newline=None
+            )
+            for line_number, line in enumerate(record_text):
+                yield line_number, line.rstrip('\n')
+    except (requests.RequestException, OSError, EOFError, zlib.error,
+            UnicodeDecodeError) as ex:
+        raise click.ClickException(
+            'Could not read the record from {}: {}'.format(url, ex)
+        )
+
+
+# Run each of the given record lines; when given a batch size, commands are
+# sent to IPA in batches, so the failure of a command may only be found once
+# later lines have been run. In either case stop at the first line to fail,
+# reporting all failures found by then. The lines may be given as they are
+# read from the record, so only those which may still fail are kept.
+def _run_lines(directory, lines, batch_size):
+    failures = []
+    uncheckpointed_lines = []
+    commands_by_line = {}
+
+    ipa_utils.start_batch(batch_size)
+    try:
+        with _progressbar(lines) as lines_bar:
+            for line_number, command in lines:
+                commands_by_line[line_number] = command
+                utils.set_import_line(line_number)
+                try:
+                    utils.directory_run(directory, command)
+                except IpaBatchError as ex:
+                    failures = ex.failures
+                    break
+                except click.ClickException as ex:
+                    failures = [(line_number, ex)]
+                    break
+                uncheckpointed_lines = _checkpoint_completed(
+                    uncheckpointed_lines + [line_number]
+                )
+                commands_by_line = {
+                    line_number: commands_by_line[line_number]
+                    for line_number in uncheckpointed_lines
+                }
+                _advance(lines_bar)
+    finally:
+        # Any commands still waiting to be run are from earlier lines.
+        failures = ipa_utils.finish_batch() + failures
+        _checkpoint_completed(uncheckpointed_lines, failures)
+
+    _raise_failures(commands_by_line, failures)
+
+
+# Checkpoint those of the given lines which have now been run, i.e. which
+# did not fail and have no commands still waiting to be run in a batch,
+# returning the others.
+def _checkpoint_completed(line_numbers, failures=[]):
+    pending_lines = ipa_utils.pending_import_lines()
+    unfinished_lines = pending_lines | {
+        line_number for line_number, _ in failures
+    }
+
+    completed_lines = [
+        line_number for line_number in line_numbers
+        if line_number not in unfinished_lines
+    ]
+    if completed_lines:
+        import_checkpoint.complete_lines(
+            completed_lines, utils.imported_user_passwords()
+        )
+
+    return [
+        line_number for line_number in line_numbers
+        if line_number in pending_lines
+    ]
+
+
+# Run the record lines on up to `jobs` threads, starting each line once all
+# earlier lines it depends on (see `record_commands`) have been run. Once a
+# line fails no more are started, but any already running are waited for, so
+# other failures may also be reported.
+def _run_lines_concurrently(directory, lines, jobs):
+    commands = [
+        record_commands.parse(directory, line_number, command)
+        for line_number, command in lines
+    ]
+    dependencies = record_commands.dependencies(commands)
+
+    dependents = defaultdict(list)
+    for index, command_dependencies in enumerate(dependencies):
+        for dependency in command_dependencies:
+            dependents[dependency].append(index)
+    remaining_dependencies = [len(d) for d in dependencies]
+
+    # Indexes of commands which can be run, earliest in the record first.
+    ready = [
+        index for index, count in enumerate(remaining_dependencies)
+        if count == 0
+    ]
+    running = {}
+    failures = []
+    context = click.get_current_context()
+
+    with _progressbar(commands) as lines_bar, \
+            ThreadPoolExecutor(max_workers=jobs) as executor:
+        while running or (ready and not failures):
+            while ready and not failures and len(running) < jobs:
+                index = heapq.heappop(ready)
+                future = executor.submit(
+                    _run_line, context, directory, commands[index]
+                )
+                running[future] = index
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                try:
+                    future.result()
+                except click.ClickException as ex:
+                    failures.append((commands[index].line_number, ex))
+                    continue
+
+                import_checkpoint.complete_lines(
+                    [commands[index].line_number],
+                    utils.imported_user_passwords()
+                )
+                _advance(lines_bar)
+                for dependent in dependents[index]:
+                    remaining_dependencies[dependent] -= 1
+                    if remaining_dependencies[dependent] == 0:
+                        heapq.heappush(ready, dependent)
+
+    _raise_failures(
+        dict(lines), sorted(failures, key=operator.itemgetter(0))
+    )
+
+
+def _run_line(context, directory, command):
+    with context.scope(cleanup=False), utils.separate_command_meta():
+        utils.set_import_line(command.line_number)
+        utils.directory_run(directory, command.command)
+
+
+# Progress bar for running the given lines; when these are still being read
+# from the record, the number of lines is not known, so no ETA can be shown.
+def _progressbar(lines):
+    return click.progressbar(
+        lines,
+        show_pos=True,
+        item_show_func=lambda throughput: throughput,
+    )
+
+
+# Step the progress bar on, updating the lines run per second shown.
+def _advance(lines_bar):
+    elapsed = time.time() - lines_bar.start
+    if elapsed > 0:
+        lines_bar.current_item = '{:.1f} lines/s'.format(
+            (lines_bar.pos + 1) / elapsed
+        )
+    lines_bar.update(1)
+
+
+def _raise_failures(commands_by_line, failures):
+    if not failures:
+        return
+
+    error_string = "processing line {} ('{}'):{}"
+    raise click.ClickException('\n'.join(
+        error_string.format(line_number, commands_by_line[line_number], ex)
+        for line_number, ex in failures
+    ))
+
+
+def _check_record(directory, lines):
+    problems = record_check.check(directory, lines)
+    if problems:
+        raise click.ClickException('\n'.join(
+            ['Found {} problem{} in the record:'.format(
+                len(problems), '' if len(problems) == 1 else 's'
+            )] + [
+                "line {} ('{}'): {}".format(line_number, command, message)
+                for line_number, command, message in problems
+            ]
+        ))
+
+
+def _display_sync_plan(sync_plan):
+    to_apply = len(sync_plan.lines)
+    conflicting = len(sync_plan.conflicts)
+    click.echo(
+        'Of {} commands: {} already applied, {} to apply, {} conflicting.'
+        .format(
+            sync_plan.skipped + to_apply + conflicting,
+            sync_plan.skipped, to_apply, conflicting
+        )
+    )
+    for line_number, command, reason in sync_plan.conflicts:
+        click.echo(
+            "Not applying line {} ('{}'): {}".format(
+                line_number, command, reason
+            ),
+            err=True
+        )
+
+
 def _output_imported_user_passwords():
     passwords_data = [
         [username, password] for username,
@@ -0,0 +1,599 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+from collections import namedtuple
+import os
+import socket
+import subprocess
+import threading
+from urllib.parse import urljoin
+
+import requests
+
+from config import CONFIG
+import utils
+import appliance_cli.utils
+from exceptions import IpaRpcError
+
+
+# Alternative backend for `ipa_utils.ipa_run`, which rather than running the
+# IPA wrapper script (and so a fresh `ipa` CLI process) for every command keeps
+# one authenticated HTTP session to the IPA JSON-RPC endpoint, and reuses its
+# session cookie for every command run by this process (so for the whole of a
+# sandbox session). Results are rendered in the same format as the `ipa` CLI
+# output and returned as a `CompletedProcess`, so nothing that parses `ipa`
+# output needs to know which backend is in use.
+#
+# Enabled by setting `IPA_BACKEND=jsonrpc` in the user config; `IPA_SERVER` may
+# also be set to the host (or base URL) of the IPA server, otherwise this
+# appliance is assumed to be the server.
+
+BACKEND_CONFIG_KEY = 'IPA_BACKEND'
+SERVER_CONFIG_KEY = 'IPA_SERVER'
+JSONRPC_BACKEND = 'jsonrpc'
+
+ADMIN_PRINCIPAL = 'admin'
+
+# `ipa` CLI option names which differ from the underlying param names; any
+# other option's param name is its CLI name with hyphens replaced.
+OPTION_NAMES = {
+    'a-rec': 'arecord',
+    'desc': 'description',
+    'email': 'mail',
+    'first': 'givenname',
+    'gid': 'gidnumber',
+    'group-name': 'cn',
+    'homedir': 'homedirectory',
+    'hostgroup-name': 'cn',
+    'hostname': 'fqdn',
+    'hosts': 'host',
+    'last': 'sn',
+    'login': 'uid',
+    'password': 'userpassword',
+    'shell': 'loginshell',
+    'sshpubkey': 'ipasshpubkey',
+    'uid': 'uidnumber',
+    'users': 'user',
+}
+
+# Not an `ipa` CLI option, but accepted by this backend for find commands: also
+# give the membership attributes of each entry (e.g. `Member of groups`), which
+# IPA otherwise only gives for finds with `--all`.
+MEMBERS_ARG = '--members'
+
+# `ipa` CLI options passed by this CLI which are flags; every other option takes
+# a value, given either after `=` or as the next arg (even if that starts with
+# `--`).
+FLAG_OPTIONS = {
+    'all',
+    'pkey-only',
+    'private',
+    'random',
+    'updatedns',
+    MEMBERS_ARG[2:],
+}
+
+# Labels for attributes which are not params of their object, e.g. as they are
+# derived from relationships between objects, so have no label in the object
+# metadata.
+ATTRIBUTE_LABELS = {
+    'dn': 'dn',
+    'has_keytab': 'Keytab',
+    'has_password': 'Password',
+    'member_group': 'Member groups',
+    'member_host': 'Member hosts',
+    'member_hostgroup': 'Member host-groups',
+    'member_user': 'Member users',
+    'memberof_group': 'Member of groups',
+    'memberof_hostgroup': 'Member of host-groups',
+    'randompassword': 'Random password',
+}
+
+# Matches the exit codes of the `ipa` CLI.
+_NOT_FOUND_EXIT_CODE = 1
+_ERROR_EXIT_CODE = 2
+
+_session = None
+_labels_by_object = {}
+_metadata_by_object = {}
+_lock = threading.RLock()
+
+
+def enabled():
+    backend = utils.get_user_config(BACKEND_CONFIG_KEY) or ''
+    return backend.lower() == JSONRPC_BACKEND
+
+
+def run(ipa_command, args):
+    positional, options = _parse_cli_args(args)
+
+    if ipa_command == 'user-add':
+        return _run_user_add(positional, options)
+    else:
+        return _run_command(ipa_command, positional, options)
+
+
+def call(method, positional=[], options={}):
+    payload = {'method': method, 'params': [positional, options], 'id': 0}
+
+    response = _post(payload)
+    if response.status_code == 401:
+        # Session cookie has expired; log in again and retry once.
+        response = _post(payload, renew_session=True)
+
+    try:
+        response.raise_for_status()
+        body = response.json()
+    except (requests.RequestException, ValueError) as ex:
+        raise IpaRpcError(ex) from ex
+
+    error = body.get('error')
+    if error:
+        raise IpaRpcError(error.get('message') or error)
+
+    return body['result']
+
+
+# Run each of the given commands (tuples of `ipa` command and CLI args) as
+# `run` would, but using IPA `batch` requests so all are sent at once. Every
+# command is run, in order, whether or not earlier ones fail; a
+# `CompletedProcess` is returned for each.
+def run_batch(commands):
+    plans = [_batch_plan(ipa_command, args) for ipa_command, args in commands]
+    responses = _call_batch([plan.call for plan in plans])
+
+    # Further steps for a command, e.g. setting a new user's password, must
+    # only be run once it is known to have succeeded; all of these are then
+    # sent in a second batch.
+    follow_up_indexes = [
+        index for index, (plan, response) in enumerate(zip(plans, responses))
+        if plan.follow_ups and not _batch_error(response)
+    ]
+    follow_up_responses = iter(_call_batch([
+        follow_up
+        for index in follow_up_indexes
+        for follow_up in plans[index].follow_ups
+    ]))
+
+    results = []
+    for index, (plan, response) in enumerate(zip(plans, responses)):
+        error = _batch_error(response)
+        if error:
+            results.append(_completed(
+                plan.ipa_command, _ERROR_EXIT_CODE, stderr=_error(error)
+            ))
+            continue
+
+        result = _completed_from_response(plan.ipa_command, response)
+        if index in follow_up_indexes:
+            follow_ups = [
+                next(follow_up_responses) for _ in plan.follow_ups
+            ]
+            result = _user_add_batch_result(plan, result, follow_ups)
+        results.append(result)
+
+    return results
+
+
+_BatchPlan = namedtuple(
+    '_BatchPlan', ['ipa_command', 'call', 'follow_ups', 'login', 'password']
+)
+
+
+def _batch_plan(ipa_command, args):
+    positional, options = _parse_cli_args(args)
+
+    follow_ups = []
+    login = password = None
+    if ipa_command == 'user-add':
+        login = positional[0]
+        options, group, password = _user_add_parts(options)
+        if group:
+            follow_ups.append(
+                _batch_call('group_add_member', [group], {'user': login})
+            )
+        if password:
+            follow_ups.append(_batch_call('passwd', [login, password], {}))
+
+    call = _batch_call(_method_name(ipa_command), positional, _params(options))
+    return _BatchPlan(ipa_command, call, follow_ups, login, password)
+
+
+def _batch_call(method, positional, params):
+    return {'method': method, 'params': [positional, params]}
+
+
+def _call_batch(calls):
+    if not calls:
+        return []
+
+    try:
+        response = call('batch', calls, {})
+    except IpaRpcError as ex:
+        # The whole request failed, so every command has.
+        return [{'error': str(ex)}] * len(calls)
+    return response['results']
+
+
+def _batch_error(response):
+    error = response.get('error')
+    if isinstance(error, dict):
+        return error.get('message') or error
+    return error
+
+
+def _user_add_batch_result(plan, result, follow_up_responses):
+    for follow_up, response in zip(plan.follow_ups, follow_up_responses):
+        error = _batch_error(response)
+        if error:
+            return _failed_user_add(
+                plan.login, result, _ERROR_EXIT_CODE, _error(error)
+            )
+
+        if follow_up['method'] == 'group_add_member':
+            add_member = _completed_from_response('group-add-member', response)
+            if add_member.returncode != 0:
+                return _failed_user_add(
+                    plan.login, result, add_member.returncode, add_member.stderr
+                )
+
+    if plan.password:
+        result = _with_random_password(result, plan.password)
+    return result
+
+
+def render(ipa_command, response):
+    lines = []
+
+    summary = response.get('summary')
+    if summary:
+        lines += _boxed(summary)
+
+    labels = _labels(_object_name(ipa_command))
+    result = response.get('result')
+    if isinstance(result, list):
+        for index, entry in enumerate(result):
+            if index > 0:
+                lines.append('')
+            lines += _entry_lines(entry, labels)
+        count = response.get('count', len(result))
+        lines += _boxed('Number of entries returned {}'.format(count))
+    elif isinstance(result, dict):
+        lines += _entry_lines(result, labels)
+
+    failures = _failed_member_lines(response.get('failed'))
+    if failures:
+        lines += ['  Failed members:'] + failures
+
+    if 'completed' in response:
+        action = 'removed' if ipa_command.endswith('remove-member') else 'added'
+        lines += _boxed(
+            'Number of members {}: {}'.format(action, response['completed'])
+        )
+
+    output = ''.join(line + '\n' for line in lines)
+    return output, _exit_code_for(response, failures)
+
+
+def _run_command(ipa_command, positional, options):
+    try:
+        response = call(_method_name(ipa_command), positional, _params(options))
+    except IpaRpcError as ex:
+        return _completed(ipa_command, _ERROR_EXIT_CODE, stderr=_error(ex))
+
+    return _completed_from_response(ipa_command, response)
+
+
+def _params(options):
+    params = {
+        OPTION_NAMES.get(name, name.replace('-', '_')): value
+        for name, value in options.items()
+        if name != MEMBERS_ARG[2:]
+    }
+    if options.get(MEMBERS_ARG[2:]):
+        params['no_members'] = False
+    return params
+
+
+def _completed_from_response(ipa_command, response):
+    output, exit_code = render(ipa_command, response)
+    return _completed(ipa_command, exit_code, stdout=output)
+
+
+# Equivalent of the `user-add` handling in the IPA wrapper script: optionally
+# generate the user's random password using the appliance password generator,
+# and add the user to a group; the user is deleted again if either fails.
+def _run_user_add(positional, options):
+    login = positional[0]
+    options, group, password = _user_add_parts(options)
+
+    result = _run_command('user-add', positional, options)
+    if result.returncode != 0:
+        return result
+
+    if group:
+        add_member = _run_command('group-add-member', [group], {'users': login})
+        if add_member.returncode != 0:
+            return _failed_user_add(login, result, add_member.returncode, add_member.stderr)
+
+    if password:
+        try:
+            call('passwd', [login, password], {})
+        except IpaRpcError as ex:
+            return _failed_user_add(login, result, _ERROR_EXIT_CODE, _error(ex))
+        result = _with_random_password(result, password)
+
+    return result
+
+
+# Split the `user-add` options into those for IPA itself, the group to add the
+# user to, and the password to set for them (if any).
+def _user_add_parts(options):
+    options = dict(options)
+    group = options.pop('group', None)
+
+    password = None
+    if options.get('random') and _password_generator_available():
+        del options['random']
+        password = _generate_password()
+
+    return options, group, password
+
+
+def _failed_user_add(login, result, returncode, stderr):
+    _run_command('user-del', [login], {})
+    return _completed(
+        'user-add', returncode, stdout=result.stdout, stderr=stderr
+    )
+
+
+def _with_random_password(result, password):
+    output = result.stdout.replace('  Password: False', '  Password: True')
+    output += '  Random password: {}\n'.format(password)
+    return _completed('user-add', 0, stdout=output)
+
+
+def _password_generator_available():
+    return os.access(CONFIG.PASSWORD_GENERATOR_PATH, os.X_OK)
+
+
+def _generate_password():
+    result = appliance_cli.utils.run([CONFIG.PASSWORD_GENERATOR_PATH])
+    return result.stdout.strip()
+
+
+def _parse_cli_args(args):
+    positional = []
+    options = {}
+
+    remaining = list(args)
+    while remaining:
+        arg = remaining.pop(0)
+        if not arg.startswith('--'):
+            positional.append(arg)
+            continue
+
+        name, separator, value = arg[2:].partition('=')
+        if not separator:
+            takes_value = name not in FLAG_OPTIONS and remaining
+            value = remaining.pop(0) if takes_value else True
+
+        if name in options:
+            # Options may be repeated to give multiple values.
+            existing = options[name]
+            existing_values = existing if isinstance(existing, list) else [existing]
+            options[name] = existing_values + [value]
+        else:
+            options[name] = value
+
+    return positional, options
+
+
+def _post(payload, renew_session=False):
+    session = _authenticated_session(renew=renew_session)
+    try:
+        return session.post(
+            _url('session/json'),
+            json=payload,
+            headers=_headers(),
+            verify=_verify()
+        )
+    except requests.RequestException as ex:
+        raise IpaRpcError(ex) from ex
+
+
+def _authenticated_session(renew=False):
+    global _session
+
+    with _lock:
+        if _session is None or renew:
+            _session = _login()
+        return _session
+
+
+def _login():
+    session = requests.Session()
+    password = utils.directory_config()[CONFIG.PASSWORD_KEY]
+
+    try:
+        response = session.post(
+            _url('session/login_password'),
+            data={'user': ADMIN_PRINCIPAL, 'password': password},
+            headers={**_headers(), 'Accept': 'text/plain'},
+            verify=_verify()
+        )
+        response.raise_for_status()
+    except requests.RequestException as ex:
+        raise IpaRpcError('Unable to log in to IPA: {}'.format(ex)) from ex
+
+    return session
+
+
+def _url(path):
+    return urljoin(_server_url() + '/ipa/', path)
+
+
+def _server_url():
+    server = utils.get_user_config(SERVER_CONFIG_KEY) or \
+        socket.getfqdn()
+    if '://' not in server:
+        server = 'https://' + server
+    return server.rstrip('/')
+
+
+def _headers():
+    # IPA rejects requests without a referer from the IPA server itself.
+    return {'Referer': _server_url() + '/ipa'}
+
+
+def _verify():
+    if os.path.exists(CONFIG.IPA_CA_CERT):
+        return CONFIG.IPA_CA_CERT
+    return True
+
+
+def _labels(object_name):
+    with _lock:
+        if object_name not in _labels_by_object:
+            _labels_by_object[object_name] = _fetch_labels(object_name)
+        return _labels_by_object[object_name]
+
+
+def _fetch_labels(object_name):
+    if not object_name:
+        return ATTRIBUTE_LABELS
+
+    labels = {
+        param['name']: param['label']
+        for param in _object_metadata(object_name).get('takes_params', [])
+        if param.get('label')
+    }
+    return {**labels, **ATTRIBUTE_LABELS}
+
+
+def _object_metadata(object_name):
+    with _lock:
+        if object_name not in _metadata_by_object:
+            metadata = call('json_metadata', [], {'object': object_name})
+            _metadata_by_object[object_name] = \
+                metadata.get('objects', {}).get(object_name, {})
+        return _metadata_by_object[object_name]
+
+
+# The fields given by the find command without `--all`, and those also given
+# with `MEMBERS_ARG`, as found from the IPA metadata for its object (so these
+# are always those of the IPA version in use); none if this can't be found.
+def find_fields(ipa_find_command):
+    object_name = _object_name(ipa_find_command)
+    try:
+        metadata = _object_metadata(object_name)
+        labels = _labels(object_name)
+    except IpaRpcError:
+        return set(), set()
+
+    # Finds give the object's search display attributes where it has these,
+    # rather than all its default attributes.
+    attributes = metadata.get('search_display_attributes') or \
+        metadata.get('default_attributes', [])
+    default_fields = {
+        labels[attribute] for attribute in attributes if attribute in labels
+    }
+    member_fields = {
+        labels[name]
+        for attribute, member_objects
+        in metadata.get('attribute_members', {}).items()
+        for name in (
+            '{}_{}'.format(attribute, member_object)
+            for member_object in member_objects
+        )
+        if name in labels
+    }
+    return default_fields, member_fields
+
+
+def _entry_lines(entry, labels):
+    # `ipa` displays the DN first when it is shown.
+    names = sorted(entry.keys(), key=lambda name: name != 'dn')
+    return [
+        '  {}: {}'.format(labels.get(name, name), _display_value(entry[name]))
+        for name in names
+    ]
+
+
+def _display_value(value):
+    if isinstance(value, (list, tuple)):
+        return ', '.join(_display_value(item) for item in value)
+    elif isinstance(value, dict):
+        # Binary values are sent base64 encoded, as `{'__base64__': ...}`.
+        return value.get('__base64__', str(value))
+    else:
+        return str(value)
+
+
+def _failed_member_lines(failed):
+    lines = []
+    for relationship, failures_by_type in (failed or {}).items():
+        for member_type, failures in failures_by_type.items():
+            for member, reason in failures:
+                lines.append('    {} {}: {}: {}'.format(
+                    relationship, member_type, member, reason
+                ))
+    return lines
+
+
+def _exit_code_for(response, failures):
+    if failures:
+        return _NOT_FOUND_EXIT_CODE
+    elif 'count' in response and response['count'] == 0:
+        # `ipa` exits unsuccessfully when a find matches nothing.
+        return _NOT_FOUND_EXIT_CODE
+    else:
+        return 0
+
+
+def _boxed(text):
+    border = '-' * len(text)
+    return [border, text, border]
+
+
+def _method_name(ipa_command):
+    return ipa_command.replace('-', '_')
+
+
+def _object_name(ipa_command):
+    object_name, separator, _ = ipa_command.partition('-')
+    return object_name if separator else None
+
+
+def _error(ex):
+    return 'ipa: ERROR: {}\n'.format(ex)
+
+
+def _completed(ipa_command, returncode, stdout='', stderr=''):
+    return subprocess.CompletedProcess(
+        [ipa_command], returncode, stdout=stdout, stderr=stderr
+    )
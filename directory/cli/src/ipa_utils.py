@@ -25,14 +25,22 @@
 # https://github.com/openflighthpc/flight-directory
 #==============================================================================
 
-import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import io
 import subprocess
+import tempfile
 from click import ClickException
 
 from config import CONFIG
 import utils
+import appender
+import ipa_rpc
+import kerberos
+import directory_cache
 import appliance_cli
-from exceptions import IpaRunError
+from exceptions import IpaRunError, IpaBatchError
 
 
 # Field names whose value should not be split into a list of values when
@@ -43,38 +51,88 @@ RAW_FIELD_WHITELIST = ['Random password']
 # Separates key from value in `ipa *-find` output.
 FIND_OUTPUT_DELIMITER = ': '
 
+# Lines starting with this begin or end the header/footer of `ipa` output.
+INFO_SECTION_BOUNDARY = '----'
+
+# Errors from `ipa` when it has no usable Kerberos ticket.
+_KERBEROS_ERRORS = ['Kerberos credentials', 'Ticket expired']
+
+# Commands deferred by `ipa_run_then` while batching, and the number of these
+# to run in each batch (or None when not batching); see `start_batch`.
+_batch = []
+_batch_size = None
+
+_DeferredRun = namedtuple('_DeferredRun', [
+    'ipa_command',
+    'args',
+    'on_result',
+    'on_error',
+    'error_allowed',
+    'error_in_stdout',
+    'original_command',
+    'import_line',
+])
+
+# Commands which can change values found once per import (see
+# `utils.memoized_during_import`), with the memo keys for the values each can
+# change, e.g. the default GID for new users. The UIDs in use are instead kept
+# up to date as users are created, modified and deleted (see `user`).
+_IMPORT_MEMO_INVALIDATING_COMMANDS = {
+    'group-mod': ['clusterusers-gid'],
+    'group-del': ['clusterusers-gid'],
+}
+
+# Maximum number of independent IPA queries to run at once (see
+# `run_concurrently`), configurable in the user config.
+MAX_WORKERS_CONFIG_KEY = 'IPA_MAX_WORKERS'
+DEFAULT_MAX_WORKERS = 4
+
 
 def parse_find_output(output):
-    lines = [line.strip() for line in output.splitlines()]
+    return list(iter_find_output(io.StringIO(output)))
+
 
-    results = [{}]
+# Parse lines of `ipa *-find` (or similar) output, yielding the dict for each
+# section as soon as all of its lines have been read, so callers can process
+# items as they arrive rather than once the whole output has been read.
+def iter_find_output(lines):
+    section = {}
+    continuations = {}  # Parts of values split over multiple lines, by key.
     in_info_section = False  # Whether we're in header/footer.
+    key = None
 
     for line in lines:
-        if _info_section_boundary(line):
+        line = line.strip()
+
+        if line.startswith(INFO_SECTION_BOUNDARY):
             in_info_section = not in_info_section
         elif in_info_section:
             continue
         elif line == '':
-            # We're entering the start of a new section, add a new dict to
-            # build up the info for this section in.
-            results.append({})
+            # We're entering the start of a new section; the previous one is
+            # complete.
+            yield _complete_section(section, continuations)
+            section = {}
+            continuations = {}
+        elif FIND_OUTPUT_DELIMITER in line:
+            key, value = _process_delimited_find_output_line(line)
+            section[key] = value
+            continuations.pop(key, None)
         else:
-            current_section = results[-1]
-            if FIND_OUTPUT_DELIMITER in line:
-                key, value = _process_delimited_find_output_line(line)
-                current_section[key] = value
-            else:
-                # This line is a continuation of the preceding line; append it
-                # to the previous line's value.
-                existing_value = current_section[key][0]
-                current_section[key][0] = existing_value + ' ' + line
+            # This line is a continuation of the preceding line; collect the
+            # parts to join once the section is complete, as repeatedly
+            # concatenating long values (e.g. SSH keys) is slow.
+            if key not in continuations:
+                continuations[key] = [section[key][0]]
+            continuations[key].append(line)
 
-    return results
+    yield _complete_section(section, continuations)
 
 
-def _info_section_boundary(line):
-    return re.match('^----', line)
+def _complete_section(section, continuations):
+    for key, parts in continuations.items():
+        section[key][0] = ' '.join(parts)
+    return section
 
 
 def _process_delimited_find_output_line(line):
@@ -96,32 +154,255 @@ def _strip_all(strings):
 
 
 def ipa_run(ipa_command, args=[], error_allowed=None, error_in_stdout=False, record=True):
-    command = [CONFIG.IPA_WRAPPER_SCRIPT_PATH] + [ipa_command] + args
+    # Any commands deferred while batching must be run first, so everything
+    # still happens in the order it was run.
+    flush_batch()
+    _forget_import_memo_for(ipa_command)
+
+    result = _run_ipa_command(ipa_command, _run_args(ipa_command, args, record))
+    _check_result(result, error_allowed, error_in_stdout)
+
+    if record:
+        _record_result(ipa_command, args, result.stdout)
+
+    return result.stdout
+
+
+# As `ipa_run`, but passing the output to `on_result`, or any `IpaRunError` to
+# `on_error` (which by default raises it), rather than returning it. While
+# batching (see `start_batch`) the command is deferred, to be run along with
+# others in a single IPA `batch` request, and these are only called then.
+def ipa_run_then(
+        ipa_command,
+        args=[],
+        on_result=lambda result: None,
+        on_error=None,
+        error_allowed=None,
+        error_in_stdout=False
+):
+    on_error = on_error or _raise_error
+
+    if not _batch_size:
+        # Pass on only the options given, so this is the same as calling
+        # `ipa_run` directly.
+        run_options = {}
+        if error_allowed is not None:
+            run_options['error_allowed'] = error_allowed
+        if error_in_stdout:
+            run_options['error_in_stdout'] = error_in_stdout
+
+        try:
+            result = ipa_run(ipa_command, args, **run_options)
+        except IpaRunError as ex:
+            on_error(ex)
+        else:
+            on_result(result)
+        return
+
+    _forget_import_memo_for(ipa_command)
+    _batch.append(_DeferredRun(
+        ipa_command=ipa_command,
+        args=args,
+        on_result=on_result,
+        on_error=on_error,
+        error_allowed=error_allowed,
+        error_in_stdout=error_in_stdout,
+        original_command=utils.original_command(),
+        import_line=utils.import_line(),
+    ))
+    if len(_batch) >= _batch_size:
+        flush_batch()
 
+
+# Start deferring commands run with `ipa_run_then`, and running them in IPA
+# `batch` requests of (at most) `batch_size` commands; a falsy `batch_size`
+# leaves batching off. Requires the JSON-RPC backend.
+def start_batch(batch_size):
+    global _batch_size
+    _batch_size = batch_size
+
+
+# The record lines with commands still waiting to be run in a batch.
+def pending_import_lines():
+    return {deferred.import_line for deferred in _batch}
+
+
+# Run any deferred commands and stop batching, returning the failures (as for
+# `IpaBatchError`) from the deferred commands, if any.
+def finish_batch():
+    global _batch_size
+    try:
+        flush_batch()
+    except IpaBatchError as ex:
+        return ex.failures
+    finally:
+        _batch_size = None
+    return []
+
+
+# Run any deferred commands in a single batch, then record and handle the
+# result of each as `ipa_run_then` would have done if they were not deferred;
+# an `IpaBatchError` is raised for any which fail.
+def flush_batch():
+    if not _batch:
+        return
+
+    # Take the pending commands first, as handling their results may run
+    # further commands.
+    pending = list(_batch)
+    del _batch[:]
+
+    results = ipa_rpc.run_batch([
+        (deferred.ipa_command, _run_args(deferred.ipa_command, deferred.args, True))
+        for deferred in pending
+    ])
+
+    failures = []
+    for deferred, result in zip(pending, results):
+        with utils.original_command_as(deferred.original_command):
+            try:
+                _complete_deferred_run(deferred, result)
+            except IpaRunError as ex:
+                failures.append(
+                    (deferred.import_line, ClickException(ex.message))
+                )
+            except ClickException as ex:
+                failures.append((deferred.import_line, ex))
+
+    if failures:
+        raise IpaBatchError(failures)
+
+
+def _complete_deferred_run(deferred, result):
+    try:
+        _check_result(result, deferred.error_allowed, deferred.error_in_stdout)
+    except IpaRunError as ex:
+        deferred.on_error(ex)
+        return
+
+    _record_result(deferred.ipa_command, deferred.args, result.stdout)
+    deferred.on_result(result.stdout)
+
+
+def _raise_error(error):
+    raise error
+
+
+def _forget_import_memo_for(ipa_command):
+    if ipa_command in _IMPORT_MEMO_INVALIDATING_COMMANDS:
+        utils.forget_import_memo(*_IMPORT_MEMO_INVALIDATING_COMMANDS[ipa_command])
+
+
+def _run_args(ipa_command, args, record):
+    if not record:
+        return args
+
+    # Ensure mutating commands output what is needed to update the directory
+    # snapshot; inserted after the argument as the IPA wrapper script expects
+    # this to come first.
+    return args[:1] + directory_cache.result_args(ipa_command) + args[1:]
+
+
+def _check_result(result, error_allowed, error_in_stdout):
     try:
-        result = appliance_cli.utils.run(command)
         if (error_allowed == None or not error_allowed in result.stdout):
             result.check_returncode()
     except subprocess.CalledProcessError as ex:
         error = result.stdout if error_in_stdout else result.stderr
         raise IpaRunError(error) from ex
 
-    if record:
-        _record_command()
 
-    return result.stdout
+def _record_result(ipa_command, args, output):
+    _record_command()
+    directory_cache.apply_result(ipa_command, args, output)
+
+
+# Run the command using the configured backend; both give a `CompletedProcess`
+# with the `ipa` CLI output.
+def _run_ipa_command(ipa_command, args):
+    if ipa_rpc.enabled():
+        return ipa_rpc.run(ipa_command, args)
+    else:
+        command = [CONFIG.IPA_WRAPPER_SCRIPT_PATH] + [ipa_command] + args
+        kerberos.ensure_ticket()
+        result = appliance_cli.utils.run(command)
+        if result.returncode != 0 and any(
+                error in (result.stderr or '') for error in _KERBEROS_ERRORS
+        ):
+            # The ticket was reused but is no longer usable (e.g. it was
+            # destroyed outside of this CLI), so get a new one and retry.
+            kerberos.forget_ticket()
+            kerberos.ensure_ticket()
+            result = appliance_cli.utils.run(command)
+        return result
 
 
 def _record_command():
-    with open(CONFIG.DIRECTORY_RECORD, 'a') as record:
-        record_string = utils.original_command() + '\n'
-        record.write(record_string)
+    record_string = utils.original_command() + '\n'
+    appender.append(CONFIG.DIRECTORY_RECORD, record_string, may_buffer=False)
 
 
 # Wrapper around `ipa_run` for find commands, to always get all fields and
 # records, not record when we run the find command, and return the parsed
 # result.
 def ipa_find(ipa_find_command, additional_args=[], error_allowed=None, all_fields=True):
+    args = additional_args + _find_standard_args(all_fields)
+
+    ipa_result = ipa_run(ipa_find_command, args, error_allowed, record=False)
+    return parse_find_output(ipa_result)
+
+
+# As `ipa_find`, but yield each parsed item as `ipa` outputs it rather than
+# once the command has completed, so the first items can be displayed while
+# the rest are still being fetched.
+def ipa_find_iter(ipa_find_command, additional_args=[], error_allowed=None, all_fields=True):
+    args = additional_args + _find_standard_args(all_fields)
+
+    if ipa_rpc.enabled():
+        # JSON-RPC responses are only usable once complete, so there is
+        # nothing to gain from streaming these.
+        ipa_result = ipa_run(ipa_find_command, args, error_allowed, record=False)
+        yield from iter_find_output(io.StringIO(ipa_result))
+        return
+
+    command = [CONFIG.IPA_WRAPPER_SCRIPT_PATH] + [ipa_find_command] + args
+    error_allowed_seen = False
+    kerberos.ensure_ticket()
+
+    def output_lines(stdout):
+        nonlocal error_allowed_seen
+        for line in stdout:
+            if error_allowed and error_allowed in line:
+                error_allowed_seen = True
+            yield line
+
+    # Spool stderr to a file rather than a pipe, so `ipa` can never block on
+    # writing this while we are reading stdout.
+    with tempfile.TemporaryFile('w+') as stderr, subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+        universal_newlines=True
+    ) as process:
+        # Hold back each item until the next is complete, so that when the
+        # command fails (including when nothing matches, as the only item is
+        # then empty) the error is raised before anything is yielded.
+        previous_item = None
+        for item in iter_find_output(output_lines(process.stdout)):
+            if previous_item is not None:
+                yield previous_item
+            previous_item = item
+
+        process.wait()
+        if process.returncode != 0 and not error_allowed_seen:
+            stderr.seek(0)
+            raise IpaRunError(stderr.read())
+
+    if previous_item is not None:
+        yield previous_item
+
+
+def _find_standard_args(all_fields):
     standard_args = [
         # Effectively make find command show all data.
         '--sizelimit', '0'
@@ -130,7 +411,37 @@ def ipa_find(ipa_find_command, additional_args=[], error_allowed=None, all_field
     if all_fields:
         standard_args = ['--all'] + standard_args
 
-    args = additional_args + standard_args
+    return standard_args
 
-    ipa_result = ipa_run(ipa_find_command, args, error_allowed, record=False)
-    return parse_find_output(ipa_result)
+
+# Run `ipa_find` for each of the given queries (tuples of positional args for
+# `ipa_find`, which are all also passed the given keyword args) concurrently,
+# and return the results in the same order.
+def ipa_find_concurrently(queries, **kwargs):
+    return run_concurrently([
+        functools.partial(ipa_find, *query, **kwargs) for query in queries
+    ])
+
+
+# Call each of the given functions, which should be independent of each other
+# (e.g. separate IPA queries), concurrently in a bounded pool of threads, and
+# return their results in the same order. If any raise, the first exception
+# (in the given order) is raised once all have completed.
+def run_concurrently(functions):
+    max_workers = _max_workers()
+    if len(functions) <= 1 or max_workers <= 1:
+        return [function() for function in functions]
+
+    with ThreadPoolExecutor(
+            max_workers=min(max_workers, len(functions))
+    ) as executor:
+        futures = [executor.submit(function) for function in functions]
+    return [future.result() for future in futures]
+
+
+def _max_workers():
+    try:
+        value = utils.get_user_config(MAX_WORKERS_CONFIG_KEY)
+        return DEFAULT_MAX_WORKERS if value is None else int(value)
+    except ValueError:
+        return DEFAULT_MAX_WORKERS
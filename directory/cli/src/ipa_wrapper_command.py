@@ -37,6 +37,9 @@ def _default_transform_options_callback(argument, options):
 def _default_handle_result_callback(argument, options, result):
     return None
 
+def _default_handle_error_callback(argument, options, error):
+    return None
+
 # TODO: consider using new wrapper_command stuff for this has been written; is
 # more flexible.
 def create(
@@ -46,7 +49,8 @@ def create(
         help='',
         options={},
         transform_options_callback=_default_transform_options_callback,
-        handle_result_callback=_default_handle_result_callback
+        handle_result_callback=_default_handle_result_callback,
+        handle_error_callback=_default_handle_error_callback
 ):
 
     if not all([ipa_command, argument_name]):
@@ -63,7 +67,8 @@ def create(
         ipa_command,
         argument_name=argument_name,
         transform_options_callback=transform_options_callback,
-        handle_result_callback=handle_result_callback
+        handle_result_callback=handle_result_callback,
+        handle_error_callback=handle_error_callback
     )
 
     return click.Command(
@@ -78,7 +83,8 @@ def create_ipa_wrapper(
         ipa_command,
         argument_name=None,
         transform_options_callback=_default_transform_options_callback,
-        handle_result_callback=_default_handle_result_callback
+        handle_result_callback=_default_handle_result_callback,
+        handle_error_callback=_default_handle_error_callback
 ):
     def ipa_wrapper(**validated_params):
         # This method is called by both Click as a callback and manually for the simple commands.
@@ -114,13 +120,26 @@ def create_ipa_wrapper(
                 and (not utils.detect_user_config \
                 or not os.access(utils.get_user_config('POST_CREATE_SCRIPT'), os.X_OK))\
             ):
-                raise click.ClickException(
+                error = click.ClickException(
                     "User create script unavailable - you need permissions to execute '{}' or alter your user config."
                     .format(utils.get_user_config('POST_CREATE_SCRIPT')
                 ))
-            result = ipa_utils.ipa_run(ipa_command, args)
-            utils.display_success()
-            handle_result_callback(argument, options, result)
+                handle_error_callback(argument, options, error)
+                raise error
+            def handle_result(result):
+                utils.display_success()
+                handle_result_callback(argument, options, result)
+
+            def handle_error(error):
+                handle_error_callback(argument, options, error)
+                raise error
+
+            # Result is handled once the command has run, which may be later
+            # when batching commands during an import.
+            ipa_utils.ipa_run_then(
+                ipa_command, args,
+                on_result=handle_result, on_error=handle_error
+            )
 
     return ipa_wrapper
 
@@ -0,0 +1,196 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import datetime
+import hashlib
+import os
+import re
+import threading
+
+from config import CONFIG
+import appliance_cli
+import appender
+import utils
+
+
+# Obtaining a Kerberos ticket for running `ipa` commands. Any ticket already in
+# the credential cache is reused until it is close to expiring, so `kinit` is
+# only run when needed, and this is only checked before running `ipa` (so
+# commands which don't use IPA never wait on the KDC).
+#
+# By default the ticket is for the admin principal, obtained with the IPA
+# password, and kept in the default credential cache; concurrent sessions
+# (and anything else using that cache) may still each run `kinit` into it. If a
+# keytab is given in the user config the ticket is instead obtained from this
+# (for the principal also given there, e.g. the `umanager` keytab created
+# during setup), and kept in a private credential cache for that keytab and
+# principal; so no password is used, only one session renews the ticket at a
+# time, and it is reused by later commands.
+
+KEYTAB_CONFIG_KEY = 'KRB5_KEYTAB'
+PRINCIPAL_CONFIG_KEY = 'KRB5_PRINCIPAL'
+
+ADMIN_PRINCIPAL = 'admin'
+
+# Get a new ticket once the current one has less than this long left, so it
+# can't expire part way through a command.
+RENEW_MARGIN = datetime.timedelta(minutes=5)
+
+# How long to rely on a ticket whose expiry `klist` doesn't show in a format
+# understood here, before checking the cache again.
+UNKNOWN_EXPIRY_RECHECK = datetime.timedelta(minutes=10)
+
+# Formats `klist` may show times in (with the C locale).
+_KLIST_TIME_FORMATS = [
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%y %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%b %d %H:%M:%S %Y',
+    '%a %b %d %H:%M:%S %Y',
+]
+
+# Until when the ticket is known to be usable, so the credential cache is only
+# checked once in this time however many `ipa` commands are run (e.g. by an
+# import, or in the sandbox).
+_usable_until = None
+_lock = threading.Lock()
+
+
+def ensure_ticket():
+    global _usable_until
+
+    with _lock:
+        now = datetime.datetime.now()
+        if _usable_until and now < _usable_until:
+            return
+
+        keytab = utils.get_user_config(KEYTAB_CONFIG_KEY)
+        principal = utils.get_user_config(PRINCIPAL_CONFIG_KEY) or \
+            ADMIN_PRINCIPAL
+        if keytab:
+            # Other sessions using the keytab share its cache, so only one
+            # renews the ticket at a time, and the others then reuse it.
+            with appender.locked(_use_private_ccache(keytab, principal)):
+                expires = _usable_ticket_expiry(principal, keytab, now)
+        else:
+            expires = _usable_ticket_expiry(principal, None, now)
+
+        if expires is None:
+            _usable_until = now + UNKNOWN_EXPIRY_RECHECK
+        else:
+            _usable_until = expires - RENEW_MARGIN
+
+
+# When the principal's ticket expires, first getting a new one if needed.
+def _usable_ticket_expiry(principal, keytab, now):
+    expires = _ticket_expiry(principal)
+    if expires is None or expires - now < RENEW_MARGIN:
+        _kinit(principal, keytab)
+        if keytab:
+            _restrict_private_ccache()
+        expires = _ticket_expiry(principal)
+    return expires
+
+
+# Forget the ticket is usable, e.g. as IPA has rejected it.
+def forget_ticket():
+    global _usable_until
+    with _lock:
+        _usable_until = None
+
+
+# When the principal's ticket in the credential cache expires; None if there is
+# no usable ticket, or its expiry isn't shown in a known format.
+def _ticket_expiry(principal):
+    result = appliance_cli.utils.run(
+        ['klist'], env={**os.environ, 'LC_ALL': 'C'}
+    )
+    if result.returncode != 0:
+        return None
+
+    cached_principal = re.search(
+        r'^Default principal: (\S+)', result.stdout, re.M
+    )
+    if not cached_principal or \
+            not _same_principal(cached_principal.group(1), principal):
+        return None
+
+    for line in result.stdout.splitlines():
+        columns = re.split(r'\s{2,}', line.strip())
+        if len(columns) >= 3 and columns[2].startswith('krbtgt/'):
+            return _parse_klist_time(columns[1])
+    return None
+
+
+def _parse_klist_time(value):
+    for time_format in _KLIST_TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+    return None
+
+
+# Principals are compared without their realm, unless both give one.
+def _same_principal(cached_principal, principal):
+    if '@' not in principal:
+        cached_principal = cached_principal.split('@')[0]
+    return cached_principal == principal
+
+
+def _kinit(principal, keytab=None):
+    # As before, a failure here is reported by the `ipa` command then run.
+    if keytab:
+        appliance_cli.utils.run(['kinit', '-k', '-t', keytab, principal])
+    else:
+        password = utils.directory_config()[CONFIG.PASSWORD_KEY]
+        appliance_cli.utils.run(['kinit', principal], input=password + '\n')
+
+
+# Keep tickets in a credential cache used only for this keytab and principal,
+# which persists between commands so its ticket can be reused (and the `ipa`
+# commands run use it too). Gives the path of the file to lock while renewing
+# its ticket.
+def _use_private_ccache(keytab, principal):
+    os.makedirs(CONFIG.DIRECTORY_KRB5_CCACHE_DIR, mode=0o700, exist_ok=True)
+    ccache_path = _private_ccache_path(keytab, principal)
+    os.environ['KRB5CCNAME'] = 'FILE:' + ccache_path
+    return ccache_path + '.lock'
+
+
+def _private_ccache_path(keytab, principal):
+    key = hashlib.sha256('{}\0{}'.format(keytab, principal).encode())
+    return os.path.join(
+        CONFIG.DIRECTORY_KRB5_CCACHE_DIR, 'ccache-' + key.hexdigest()[:16]
+    )
+
+
+# Only this user may read the ticket, however `kinit` created the cache.
+def _restrict_private_ccache():
+    path = os.environ['KRB5CCNAME'][len('FILE:'):]
+    if os.path.exists(path):
+        os.chmod(path, 0o600)
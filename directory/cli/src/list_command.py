@@ -26,23 +26,41 @@
 #==============================================================================
 
 import click
+from collections import OrderedDict
+import csv
+import itertools
+import json
 from operator import itemgetter
 import re
 import socket
 
+import ipa_rpc
 import ipa_utils
+import directory_cache
 import appliance_cli.text as text
 
 # Data displayers - take some headers and some data (`ipa_find` output) and
-# display in some way.
+# display in some way; each row of the data is a list of the values for each
+# field, where each value is a list of strings.
 
-table_displayer = text.display_table
+def table_displayer(headers, data):
+    text.display_table(headers, (_joined_row(row) for row in data))
 
 
+# The primary key field of the items output by each find command; IPA orders
+# the output by this, so items do not need sorting again when this is the
+# sort wanted, and this is all that is output when using `--pkey-only`.
+IPA_PRIMARY_KEYS = {
+    'user-find': 'User login',
+    'group-find': 'Group name',
+    'host-find': 'Host name',
+    'hostgroup-find': 'Host-group',
+}
+
 def list_displayer(headers, data):
     # There should only be exactly one item in the data, and we only want to
     # display that.
-    single_item = data[0]
+    single_item = next(iter(data))
 
     longest_header_length = len(max(headers, key=len))
 
@@ -72,7 +90,7 @@ def list_displayer(headers, data):
         return text.join_lines(*padded_value_lines)
 
     lines = []
-    for header, value in zip(headers, single_item):
+    for header, value in zip(headers, _joined_row(single_item)):
         line = text.bold(header) + ':' + pad_value(header, value)
         lines.append(line)
 
@@ -80,6 +98,80 @@ def list_displayer(headers, data):
     click.echo(display)
 
 
+# Structured displayers - for use by scripts; these do not page or lay out the
+# data, and output each row as soon as it is available.
+
+def json_displayer(headers, data):
+    separator = '[\n'
+    for row in data:
+        click.echo(separator + json.dumps(_row_dict(headers, row)), nl=False)
+        separator = ',\n'
+    click.echo('[]' if separator == '[\n' else '\n]')
+
+
+def jsonl_displayer(headers, data):
+    for row in data:
+        click.echo(json.dumps(_row_dict(headers, row)))
+
+
+def csv_displayer(headers, data, delimiter=','):
+    writer = csv.writer(
+        click.get_text_stream('stdout'),
+        delimiter=delimiter,
+        lineterminator='\n'
+    )
+    writer.writerow(headers)
+    for row in data:
+        # Give multiple values in the same form IPA does.
+        writer.writerow([', '.join(value) for value in row])
+
+
+def tsv_displayer(headers, data):
+    csv_displayer(headers, data, delimiter='\t')
+
+
+STRUCTURED_DISPLAYERS = OrderedDict([
+    ('json', json_displayer),
+    ('jsonl', jsonl_displayer),
+    ('csv', csv_displayer),
+    ('tsv', tsv_displayer),
+])
+
+
+def _row_dict(headers, row):
+    return OrderedDict(zip(headers, row))
+
+
+def _joined_row(row):
+    return ['\n'.join(value) for value in row]
+
+
+# Option for list and show commands to output in a structured format rather
+# than using the command's usual display.
+format_option = click.option(
+    '--format',
+    'output_format',
+    type=click.Choice(STRUCTURED_DISPLAYERS.keys()),
+    help='Output in this machine-readable format'
+)
+
+
+# Option for list and show commands to refresh the directory snapshot (see
+# `directory_cache`) rather than potentially displaying cached data.
+refresh_option = click.option(
+    '--refresh',
+    is_flag=True,
+    help='Refresh cached directory data before displaying'
+)
+
+
+# Option for list and show commands to display only some fields.
+fields_option = click.option(
+    '--fields',
+    help='Comma-separated names of the fields to display'
+)
+
+
 # Note: `field_configs` takes an OrderedDict with a mapping from field names
 # (to be used as the headers in the display function) to the function to
 # generate that field for each row; these functions have a signature like those
@@ -93,68 +185,187 @@ def do(
         generate_additional_data=lambda item_dict=None: {},
         display=table_displayer,
         blacklist_key=None,
-        blacklist_val_array=[]
+        blacklist_val_array=[],
+        cache_kind=None,
+        cache_key=None,
+        refresh=False,
+        output_format=None,
+        fields=None
 ):
     if not all([ipa_find_command, field_configs]):
         raise TypeError
 
-    item_dicts = ipa_utils.ipa_find(ipa_find_command, ipa_find_args, all_fields=all_fields)
+    if output_format:
+        display = STRUCTURED_DISPLAYERS[output_format]
+
+    if fields:
+        field_configs = _selected_field_configs(field_configs, fields)
+
+    if refresh:
+        directory_cache.invalidate()
+
+    if cache_kind and directory_cache.enabled():
+        # Answer from the directory snapshot; `cache_key` selects a single
+        # item in place of `ipa_find_args`.
+        if cache_key:
+            item_dicts = directory_cache.find(cache_kind, cache_key)
+        else:
+            item_dicts = directory_cache.entries(cache_kind)
+    else:
+        # Stream items from IPA, only fetching the attributes needed; these
+        # already arrive ordered by primary key so only need sorting if this
+        # is not what was asked for.
+        needed_fields = _required_fields(field_configs, generate_additional_data)
+        needed_fields.update(filter(None, [sort_key, blacklist_key]))
+        projection_args, all_fields = _projection(
+            ipa_find_command, needed_fields, all_fields
+        )
+        item_dicts = ipa_utils.ipa_find_iter(
+            ipa_find_command,
+            ipa_find_args + projection_args,
+            all_fields=all_fields
+        )
+        if sort_key == IPA_PRIMARY_KEYS.get(ipa_find_command):
+            sort_key = None
 
     # Remove blacklisted items
     if blacklist_key:
-        item_dicts = [item_dict for item_dict in item_dicts if item_dict[blacklist_key][0] not in blacklist_val_array]
+        item_dicts = (item_dict for item_dict in item_dicts if item_dict[blacklist_key][0] not in blacklist_val_array)
 
     if sort_key:
-        item_dicts.sort(key=itemgetter(sort_key))
+        item_dicts = sorted(item_dicts, key=itemgetter(sort_key))
 
     headers = field_configs.keys()
 
     # this condition ensures that ipa_find isn't run against no entries, which it reports as an error
     # more specifically, when `user list` is called `generate_additional_data` involves calling `ipa group-find --private`
     #   which, as there are only private groups created for each user, if there are no users queries against an empty list and returns an error
-    if not item_dicts == []:
+    item_dicts = iter(item_dicts)
+    first_item_dict = next(item_dicts, None)
+    if first_item_dict is not None:
         results_data = _create_data(
-            item_dicts,
+            itertools.chain([first_item_dict], item_dicts),
             field_configs,
-            generate_additional_data(item_dict=item_dicts[0])
+            generate_additional_data(item_dict=first_item_dict)
         )
         display(headers, results_data)
     else:
         display(headers, [])
 
 
+def _selected_field_configs(field_configs, fields):
+    configs_by_name = {name.lower(): name for name in field_configs}
+    selected_names = []
+    for field in fields.split(','):
+        try:
+            selected_names.append(configs_by_name[field.strip().lower()])
+        except KeyError:
+            raise click.BadParameter(
+                'unknown field {!r}; available fields are: {}'.format(
+                    field.strip(), ', '.join(field_configs)
+                ),
+                param_hint='--fields'
+            )
+    return OrderedDict(
+        (name, field_configs[name]) for name in selected_names
+    )
+
+
+# The fields of each item needed by the field generators (see
+# `field_requires`) and the additional data function.
+def _required_fields(field_configs, generate_additional_data):
+    required_fields = set(
+        getattr(generate_additional_data, 'required_fields', [])
+    )
+    for name, generator in field_configs.items():
+        # Generators without a declaration just use the field they are for.
+        required_fields.update(
+            getattr(generator, 'required_fields', [name])
+        )
+    return required_fields
+
+
+# Get the arguments to make the find command output the needed fields, and
+# whether `--all` is needed for this. IPA has no way to select individual
+# attributes to output, but with the JSON-RPC backend the fields output without
+# `--all` are known from IPA's metadata, and membership fields can be asked for
+# without the rest.
+def _projection(ipa_find_command, needed_fields, all_fields):
+    if needed_fields <= {IPA_PRIMARY_KEYS.get(ipa_find_command)}:
+        return ['--pkey-only'], False
+
+    if ipa_rpc.enabled():
+        default_fields, member_fields = ipa_rpc.find_fields(ipa_find_command)
+        if needed_fields <= default_fields | member_fields:
+            members_args = \
+                [ipa_rpc.MEMBERS_ARG] if needed_fields & member_fields else []
+            return members_args, False
+
+    return [], all_fields
+
+
+# Rows are created lazily, so that displayers can start displaying these
+# before all items have been fetched.
 def _create_data(item_dicts, field_configs, additional_data):
-    return [
+    return (
         _create_row(item_dict, field_configs, additional_data)
         for item_dict in item_dicts
-    ]
+    )
 
 
 def _create_row(item_dict, field_configs, additional_data):
     return [
-        _display_value_for(item_dict, field_config, additional_data)
+        _values_for(item_dict, field_config, additional_data)
         for field_config in field_configs.items()
     ]
 
 
-def _display_value_for(item_dict, field_config, additional_data):
+def _values_for(item_dict, field_config, additional_data):
     name, generator = field_config
     value = generator(name, item_dict, additional_data)
-    return '\n'.join(value)
+    if not value:
+        return []
+    elif isinstance(value, str):
+        return [value]
+    else:
+        return [part for part in value if part is not None]
 
 
 # Field generators.
 
+# Declare the fields of each item that a field generator or additional data
+# function uses, other than the field it is generating (which is assumed if
+# nothing is declared).
+def field_requires(*fields):
+    def decorator(function):
+        function.required_fields = fields
+        return function
+    return decorator
+
+
 def field_with_same_name(field_name, item_dict, additional_data):
     return item_dict.get(field_name, '')
 
 
 def field_with_name(name):
+    @field_requires(name)
     def generator(field_name, item_dict, additional_data):
         return item_dict.get(name, '')
     return generator
 
 
+# IPA only outputs users' full names for finds with `--all`, so otherwise these
+# are made from their first and last names, which is how this CLI sets them.
+@field_requires('First name', 'Last name')
+def full_name(field_name, item_dict, additional_data):
+    if field_name in item_dict:
+        return item_dict[field_name]
+    return ' '.join(
+        item_dict.get('First name', []) + item_dict.get('Last name', [])
+    )
+
+
+@field_requires('GID')
 def group_with_users_gid(field_name, item_dict, additional_data):
     group_name = ""
     #the user's primary group is found by getting their GID from the dict for that user
@@ -170,6 +381,8 @@ def group_with_users_gid(field_name, item_dict, additional_data):
         pass
     return group_name
 
+
+@field_requires('Host name')
 def host_with_ip(field_name, item_dict, additional_data):
     try:
         return [socket.gethostbyname(item_dict['Host name'][0])]
@@ -0,0 +1,288 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+from contextlib import closing
+import csv
+import glob
+import gzip
+import json
+import os
+import re
+import sqlite3
+
+import appender
+from config import CONFIG
+import record_commands
+
+
+# Index of the entries in the command log, so entries for an entity, time or
+# outcome can be found without reading the whole log. The index is brought up
+# to date before each search by reading only what has been appended to each log
+# since (and the remainder of any logs rotated away in the meantime), from the
+# byte offset already indexed to.
+
+_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS entries ('
+    '  id INTEGER PRIMARY KEY, timestamp TEXT, command TEXT, outcome TEXT,'
+    '  error TEXT)',
+    'CREATE INDEX IF NOT EXISTS entries_by_timestamp ON entries (timestamp)',
+    'CREATE TABLE IF NOT EXISTS entities (entity TEXT, entry_id INTEGER)',
+    'CREATE INDEX IF NOT EXISTS entities_by_entity'
+    '  ON entities (entity, entry_id)',
+    # How far each log has been indexed: the inode of the file indexed, the
+    # offset indexed to, and the latest rotated log indexed.
+    'CREATE TABLE IF NOT EXISTS progress ('
+    '  log TEXT PRIMARY KEY, inode INTEGER, offset INTEGER, rotated TEXT)',
+]
+
+_OUTCOMES = ['Success', 'Failure']
+
+# Rotated logs are named after the log and the time they were rotated, and are
+# compressed soon after.
+_ROTATED_LOG_PATTERN = r'\.(\d{20})(\.gz)?'
+
+
+# The log entries matching all the given conditions, oldest first, as tuples
+# of their time, outcome, command and any error. `since` and `until` are
+# timestamps as logged, e.g. `2019-01-01 12:00:00`; `until` is exclusive.
+def search(directory, entity=None, since=None, until=None, outcome=None):
+    with closing(_connect()) as connection:
+        update(connection, directory)
+
+        conditions = []
+        values = []
+        if entity:
+            conditions.append(
+                'id IN (SELECT entry_id FROM entities WHERE entity = ?)'
+            )
+            values.append(entity.lower())
+        if since:
+            conditions.append('timestamp >= ?')
+            values.append(since)
+        if until:
+            conditions.append('timestamp < ?')
+            values.append(until)
+        if outcome:
+            conditions.append('lower(outcome) = ?')
+            values.append(outcome.lower())
+
+        query = 'SELECT timestamp, outcome, command, error FROM entries'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY timestamp, id'
+        return connection.execute(query, values).fetchall()
+
+
+def update(connection, directory):
+    # Only one process indexes at a time, and it must see how far any other
+    # got first.
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        for path, json_format in [
+                (CONFIG.DIRECTORY_LOG, False),
+                (CONFIG.DIRECTORY_JSON_LOG, True),
+        ]:
+            _update_for_log(connection, directory, path, json_format)
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+
+def _update_for_log(connection, directory, path, json_format):
+    progress = connection.execute(
+        'SELECT inode, offset, rotated FROM progress WHERE log = ?', (path,)
+    ).fetchone()
+    inode, offset, last_rotated = progress or (None, 0, None)
+
+    # Logs are only rotated while locked, so the log and rotated logs found
+    # while locked are consistent with each other.
+    log_file = None
+    if os.path.exists(path):
+        with appender.locked(path):
+            log_file = open(path, 'rb')
+            all_rotated_logs = _rotated_logs(path)
+    else:
+        all_rotated_logs = _rotated_logs(path)
+
+    try:
+        log_stat = os.fstat(log_file.fileno()) if log_file else None
+        rotated_logs = [
+            (rotated, rotated_path)
+            for rotated, rotated_path in all_rotated_logs
+            if last_rotated is None or rotated > last_rotated
+        ]
+
+        def index(indexed_file, offset):
+            return _index(
+                connection, directory, indexed_file, offset, json_format
+            )
+
+        log_replaced = log_stat is None or log_stat.st_ino != inode or \
+            log_stat.st_size < offset
+        if progress and log_replaced and rotated_logs:
+            # The log indexed so far has been rotated, so is the first log
+            # rotated since; index the rest of it, then any rotated after it.
+            (_, first_path), rotated_logs = rotated_logs[0], rotated_logs[1:]
+            with _open_log(first_path) as rotated_file:
+                index(rotated_file, offset)
+        if progress is None or log_replaced:
+            offset = 0
+
+        for _, rotated_path in rotated_logs:
+            with _open_log(rotated_path) as rotated_file:
+                index(rotated_file, 0)
+
+        if log_file:
+            offset = index(log_file, offset)
+    finally:
+        if log_file:
+            log_file.close()
+
+    connection.execute(
+        'INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?)', (
+            path,
+            log_stat.st_ino if log_stat else None,
+            offset,
+            all_rotated_logs[-1][0] if all_rotated_logs else last_rotated,
+        )
+    )
+
+
+# Index the complete lines of the log from the given offset, giving the offset
+# indexed to; a line still being written is left until it is complete.
+def _index(connection, directory, log_file, offset, json_format):
+    log_file.seek(offset)
+    for line in log_file:
+        if not line.endswith(b'\n'):
+            break
+        offset += len(line)
+
+        entry = _parse_entry(line.decode(errors='replace'), json_format)
+        if entry is None:
+            continue
+        timestamp, command, outcome, error, details = entry
+
+        entry_id = connection.execute(
+            'INSERT INTO entries (timestamp, command, outcome, error) '
+            'VALUES (?, ?, ?, ?)',
+            (timestamp, command, outcome, error)
+        ).lastrowid
+        connection.executemany(
+            'INSERT INTO entities VALUES (?, ?)', [
+                (entity, entry_id)
+                for entity in _entities(directory, command, details)
+            ]
+        )
+
+    return offset
+
+
+# Give the timestamp, command, outcome, error and details of a log line, or
+# None if it can't be understood (e.g. rows interleaved by concurrent writes,
+# before these were locked).
+def _parse_entry(line, json_format):
+    if json_format:
+        try:
+            entry = json.loads(line)
+            return (
+                entry['timestamp'].replace('T', ' '),
+                entry['command'],
+                entry['outcome'],
+                entry.get('error'),
+                entry.get('details'),
+            )
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+    try:
+        [row] = csv.reader([line])
+        timestamp, _, command, *args = row
+    except (csv.Error, ValueError):
+        return None
+
+    outcome, error, details = 'Success', None, args
+    if args:
+        result = args[0].split(': ', 1)
+        if result[0] in _OUTCOMES:
+            outcome, details = result[0], args[1:]
+            error = result[1] if len(result) > 1 else None
+    details = dict(
+        detail.split(': ', 1) for detail in details if ': ' in detail
+    )
+    return timestamp, command, outcome, error, details
+
+
+# The users, groups, hosts and host groups a logged command changed.
+def _entities(directory, command, details):
+    record_command = record_commands.parse(directory, None, command)
+    entities = set()
+    for key in record_command.writes:
+        if key[0] in ['user', 'group', 'host', 'hostgroup']:
+            entities.add(key[1])
+        elif key[0].endswith('-member'):
+            entities.update(key[1:])
+
+    # Commands prompting for their values log these as details instead.
+    if isinstance(details, dict):
+        entity = record_commands.entity_name(details)
+        if isinstance(entity, str):
+            entities.add(entity)
+
+    return {entity.lower() for entity in entities}
+
+
+# The logs rotated away from the given log, oldest first, as tuples of the
+# time each was rotated and its path (the compressed one, once it exists).
+def _rotated_logs(path):
+    rotated_logs = {}
+    # Compressed logs sort after any uncompressed log they replace.
+    for rotated_path in sorted(glob.glob(glob.escape(path) + '.*')):
+        match = re.fullmatch(_ROTATED_LOG_PATTERN, rotated_path[len(path):])
+        if match:
+            rotated_logs[match.group(1)] = rotated_path
+    return sorted(rotated_logs.items())
+
+
+def _open_log(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def _connect():
+    new_index = not os.path.exists(CONFIG.DIRECTORY_LOG_INDEX)
+
+    connection = sqlite3.connect(
+        CONFIG.DIRECTORY_LOG_INDEX, timeout=30, isolation_level=None
+    )
+    for statement in _SCHEMA:
+        connection.execute(statement)
+
+    if new_index:
+        # Holds every logged command; keep it as private as the log.
+        os.chmod(CONFIG.DIRECTORY_LOG_INDEX, 0o600)
+
+    return connection
@@ -0,0 +1,104 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import click
+import datetime
+
+import appliance_cli.text as text
+import appliance_cli.utils
+import log_index
+
+
+_TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d']
+
+
+def add_commands(directory):
+
+    if appliance_cli.utils.in_sandbox():
+        return
+
+    @directory.group(help='Query the log of commands run')
+    def log():
+        pass
+
+    @log.command(
+        help='Find the logged commands matching all the given conditions'
+    )
+    @click.option(
+        '--entity',
+        help='Only commands changing this user, group, host or host group'
+    )
+    @click.option(
+        '--since',
+        callback=lambda _ctx, _param, value: _parse_time(value),
+        help='Only commands run at or after this time (YYYY-MM-DD '
+        '[HH:MM[:SS]])'
+    )
+    @click.option(
+        '--until',
+        callback=lambda _ctx, _param, value: _parse_time(value, until=True),
+        help='Only commands run before this time, or on or before this day '
+        '(YYYY-MM-DD [HH:MM[:SS]])'
+    )
+    @click.option(
+        '--outcome',
+        type=click.Choice(['success', 'failure']),
+        help='Only commands with this outcome'
+    )
+    def search(entity, since, until, outcome):
+        entries = log_index.search(
+            directory, entity=entity, since=since, until=until,
+            outcome=outcome
+        )
+        if not entries:
+            click.echo('No matching commands found in the log.')
+            return
+
+        text.display_table(
+            ['Time', 'Outcome', 'Command', 'Error'],
+            [[cell or '' for cell in entry] for entry in entries]
+        )
+
+
+# Give the time in the format logged; a day alone given as `until` includes
+# the whole day.
+def _parse_time(value, until=False):
+    if value is None:
+        return None
+
+    for time_format in _TIME_FORMATS:
+        try:
+            time = datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+        if until and time_format == '%Y-%m-%d':
+            time += datetime.timedelta(days=1)
+        return str(time)
+
+    raise click.BadParameter(
+        "'{}' is not a time of the form YYYY-MM-DD [HH:MM[:SS]]".format(value)
+    )
@@ -24,15 +24,45 @@
 # For more information on Flight Directory, please visit:
 # https://github.com/openflighthpc/flight-directory
 #==============================================================================
+import click
 import datetime
+import glob
+import gzip
+import json
 import os
 import csv
+import io
 import re
+import shutil
 
 import utils
+import appender
 from config import CONFIG
 
-def log_cmd(args, error=None):
+# The command log is written as CSV rows to `log.csv` by default; with this
+# user config set to `jsonl` it is instead written as JSON objects with typed
+# fields, one per line, to `log.jsonl`.
+FORMAT_CONFIG_KEY = 'LOG_FORMAT'
+CSV = 'csv'
+JSONL = 'jsonl'
+
+# Once the log reaches this many bytes (10 MiB unless set; 0 never rotates it)
+# it is moved aside and compressed, and a new log started; at most this many
+# compressed logs are kept (all are kept if unset, as `directory log` searches
+# them).
+MAX_BYTES_CONFIG_KEY = 'LOG_MAX_BYTES'
+BACKUP_COUNT_CONFIG_KEY = 'LOG_BACKUP_COUNT'
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+
+_OUTCOMES = ['Success', 'Failure']
+
+# The `FC_*` environment variables logged with each command; these can't
+# change while running, so are only found once.
+_env_vars = None
+
+
+def log_cmd(args, error=None, duration=None):
+    outcome, details = _split_outcome(args)
     if not error==None:
         # some click exceptions (e.g. MissingParameter) don't have human readable standard
         #   output so this is neccessary to log them fully
@@ -51,6 +81,8 @@ def log_cmd(args, error=None):
             #   replacing consecutive quotes with single quotes
             error_str = re.sub(r'""','"',error_str)
             args[0] = args[0] + ": " + error_str
+    else:
+        error_str = None
 
     cmd = utils.original_command()
     # regex for replacing any passwords in the logs with asterisks
@@ -61,7 +93,14 @@ def log_cmd(args, error=None):
             cmd = re.sub(r'(?<= --password( |=)).*(?=$)', '********', cmd)
 
     row = [cmd] + args
-    write_to_log(row)
+    write_to_log(row, entry={
+        'command': cmd,
+        'outcome': outcome,
+        'error_class': error.__class__.__name__ if error is not None else None,
+        'error': error_str or None,
+        'duration': round(duration, 3) if duration is not None else None,
+        'details': details,
+    })
 
 def log_simple_cmd(params):
     cmd = utils.original_command()
@@ -71,18 +110,117 @@ def log_simple_cmd(params):
         string = '{0}: {1}'.format(key, value)
         row.append(string)
 
-    write_to_log(row)
+    write_to_log(row, entry={
+        'command': cmd, 'outcome': 'Success', 'details': dict(params)
+    })
 
-def write_to_log(row):
-    time = str(datetime.datetime.now().replace(microsecond=0))
+# Log any time spent waiting for other processes to finish appending to the
+# record, log and checkpoint, to show whether contention is slowing commands.
+def log_lock_waits():
+    lock_waits = appender.take_lock_waits()
+    if not lock_waits:
+        return
 
-    env_vars = {}
-    for var in os.environ:
-        if var.startswith("FC_"):
-            env_vars[var]=os.getenv(var)
+    row = [utils.original_command(), 'lock-wait']
+    waits_by_file = {}
+    for path, (waits, total, longest) in sorted(lock_waits.items()):
+        row.append('{0}: {1} waits, {2:.3f}s total, {3:.3f}s longest'.format(
+            os.path.basename(path), waits, total, longest
+        ))
+        waits_by_file[os.path.basename(path)] = {
+            'waits': waits,
+            'total': round(total, 3),
+            'longest': round(longest, 3),
+        }
+    write_to_log(row, entry={
+        'command': utils.original_command(),
+        'outcome': 'lock-wait',
+        'details': waits_by_file,
+    })
 
-    row = [time, env_vars] + row
+# Write the given CSV row, or fields of a JSON log entry (which by default are
+# taken from the row), to the log.
+def write_to_log(row, entry=None):
+    time = datetime.datetime.now().replace(microsecond=0)
+    log_format, max_bytes, backup_count = _settings()
 
-    with open(CONFIG.DIRECTORY_LOG, mode='a', newline='') as csvfile:
-        logwriter = csv.writer(csvfile, delimiter = ',', quotechar = '"', quoting = csv.QUOTE_MINIMAL)
+    if log_format == JSONL:
+        if entry is None:
+            entry = {'command': row[0]}
+            entry['outcome'], entry['details'] = _split_outcome(row[1:])
+        entry = {'timestamp': time.isoformat(), **entry, 'env': _fc_env_vars()}
+        text = json.dumps(entry) + '\n'
+        path = CONFIG.DIRECTORY_JSON_LOG
+    else:
+        row = [str(time), _fc_env_vars()] + row
+        csv_row = io.StringIO(newline='')
+        logwriter = csv.writer(csv_row, delimiter = ',', quotechar = '"', quoting = csv.QUOTE_MINIMAL)
         logwriter.writerow(row)
+        text = csv_row.getvalue()
+        path = CONFIG.DIRECTORY_LOG
+
+    rotate = None
+    if max_bytes:
+        rotate = (max_bytes, lambda rotated: _compress(rotated, backup_count))
+    appender.append(path, text, rotate=rotate)
+
+# The compressed logs moved aside from the given log, oldest first.
+def rotated_logs(path):
+    return sorted(glob.glob(glob.escape(path) + '.*.gz'))
+
+def _split_outcome(args):
+    if args and args[0] in _OUTCOMES:
+        return args[0], list(args[1:])
+    return 'Success', list(args)
+
+def _fc_env_vars():
+    global _env_vars
+    if _env_vars is None:
+        _env_vars = {
+            var: value for var, value in os.environ.items()
+            if var.startswith("FC_")
+        }
+    return _env_vars
+
+def _settings():
+    # Only read once for an import, rather than for every line.
+    if click.get_current_context(silent=True) is None:
+        return _configured_settings()
+    return utils.memoized_during_import('log-settings', _configured_settings)
+
+def _configured_settings():
+    log_format = JSONL if utils.get_user_config(FORMAT_CONFIG_KEY) == JSONL \
+        else CSV
+    return (
+        log_format,
+        _configured_number(MAX_BYTES_CONFIG_KEY, DEFAULT_MAX_BYTES),
+        _configured_number(BACKUP_COUNT_CONFIG_KEY),
+    )
+
+def _configured_number(key, default=None):
+    value = utils.get_user_config(key)
+    try:
+        return int(value) if value else default
+    except ValueError:
+        return default
+
+def _compress(rotated_path, backup_count):
+    # Compressed under a temporary name first, so the compressed log (which the
+    # log index prefers to the rotated one) only appears once complete.
+    compressed_path = rotated_path + '.gz'
+    temporary_path = compressed_path + '.tmp'
+    try:
+        with open(rotated_path, 'rb') as rotated_file, \
+                gzip.open(temporary_path, 'wb') as compressed_file:
+            shutil.copyfileobj(rotated_file, compressed_file)
+    except Exception:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    os.replace(temporary_path, compressed_path)
+    os.remove(rotated_path)
+
+    if backup_count is not None:
+        log_path = rotated_path.rsplit('.', 1)[0]
+        for old_log in rotated_logs(log_path)[:-backup_count or None]:
+            os.remove(old_log)
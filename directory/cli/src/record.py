@@ -0,0 +1,337 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import click
+from collections import defaultdict
+import datetime
+import os
+import shutil
+
+import appender
+import appliance_cli
+import record_commands
+import utils
+from config import CONFIG
+
+
+# Options of modify commands which do something each time they are run, rather
+# than set an attribute, so are kept rather than folded into other commands.
+_ACTION_PARAMS = ['new_password', 'remove_password', 'remove_key']
+
+# For each kind of group, the parameter giving its members, and the commands
+# to add and remove these.
+_MEMBERSHIP_COMMANDS = {
+    'group': (
+        'users', ['group', 'member', 'add'], ['group', 'member', 'remove']
+    ),
+    'hostgroup': (
+        'hosts', ['hostgroup', 'add-member'], ['hostgroup', 'remove-member']
+    ),
+}
+
+_MEMBER_KINDS = {'group': 'user', 'hostgroup': 'host'}
+
+
+def add_commands(directory):
+
+    if appliance_cli.utils.in_sandbox():
+        return
+
+    @directory.group(help='Manage the Directory record')
+    def record():
+        pass
+
+    @record.command(
+        help='Rewrite the Directory record as the fewest commands giving the '
+        'same result, keeping a backup of the original'
+    )
+    def compact():
+        if not os.path.exists(CONFIG.DIRECTORY_RECORD):
+            raise click.ClickException(
+                'No Directory record found; nothing to compact.'
+            )
+
+        # Hold the record lock throughout, so no commands recorded meanwhile
+        # by other processes are lost.
+        with appender.locked(CONFIG.DIRECTORY_RECORD):
+            lines, compacted_lines, backup_path = _compact_record(directory)
+
+        click.echo(
+            'Compacted the Directory record from {} to {} commands; the '
+            'original record is backed up at {}.'.format(
+                len(lines), len(compacted_lines), backup_path
+            )
+        )
+
+
+def _compact_record(directory):
+    with open(CONFIG.DIRECTORY_RECORD) as record_file:
+        lines = [
+            line.rstrip('\n') for line in record_file if line.strip() != ''
+        ]
+
+    compacted_lines = compact_lines(directory, lines)
+
+    backup_path = '{}.{}.bak'.format(
+        CONFIG.DIRECTORY_RECORD,
+        datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    )
+    shutil.copy2(CONFIG.DIRECTORY_RECORD, backup_path)
+
+    # Replace the record all at once, so it is never left part written.
+    compacting_path = CONFIG.DIRECTORY_RECORD + '.compacting'
+    with open(compacting_path, 'w') as record_file:
+        record_file.writelines(line + '\n' for line in compacted_lines)
+    shutil.copymode(backup_path, compacting_path)
+    os.replace(compacting_path, CONFIG.DIRECTORY_RECORD)
+
+    return lines, compacted_lines, backup_path
+
+
+# Give the fewest record lines which have the same result as the given lines:
+# entities created and later deleted are dropped, with all commands for them;
+# modifications are folded into the create (or into one modify, for entities
+# not created in the record); only the last enable or disable is kept; and
+# membership changes are netted out, with those left merged into one line per
+# group. Each line left is placed where the last line it replaces was, so runs
+# after anything it needs. Lines which can't be understood are kept as they
+# are.
+def compact_lines(directory, lines):
+    entities = {}
+    memberships = defaultdict(list)
+    kept_lines = []
+
+    for index, line in enumerate(lines):
+        try:
+            path, params = record_commands.resolve(directory, line)
+        except (click.ClickException, ValueError):
+            kept_lines.append((index, line))
+            continue
+
+        kind, action = path[0], path[-1]
+        name = record_commands.entity_name(params)
+        if kind not in ['user', 'group', 'host', 'hostgroup'] or not name:
+            kept_lines.append((index, line))
+            continue
+
+        if kind in _MEMBERSHIP_COMMANDS and \
+                _MEMBERSHIP_COMMANDS[kind][0] in params:
+            members = params[_MEMBERSHIP_COMMANDS[kind][0]] or ()
+            adding = action in ['add', 'add-member']
+            for member in members:
+                memberships[(kind, name, member)].append((index, adding))
+
+        elif action == 'create':
+            entities[(kind, name)] = _Entity(index, path, params, line)
+            if kind == 'user' and params.get('group'):
+                # Added to the group by the create itself.
+                memberships[('group', params['group'], name)].append(
+                    (index, True)
+                )
+
+        elif action == 'delete':
+            entity = entities.pop((kind, name), None)
+            if entity is None or not entity.created:
+                kept_lines.append((index, line))
+            _forget_memberships(entities, memberships, kind, name)
+
+        else:
+            entity = entities.setdefault((kind, name), _Entity())
+            entity.apply(directory, index, path, params, line)
+
+    kept_lines.extend(_membership_lines(directory, entities, memberships))
+    for entity in entities.values():
+        kept_lines.extend(entity.lines(directory))
+
+    return [line for _, line in sorted(kept_lines, key=lambda kept: kept[0])]
+
+
+# An entity's commands since it was created in the record, or since the start
+# of the record if it was not created in it.
+class _Entity:
+
+    def __init__(self, create_index=None, path=None, params=None, line=None):
+        self.created = create_index is not None
+        self.create_index = create_index
+        self.create_path = path
+        self.create_params = dict(params or {})
+        self.create_line = line
+        self.create_changed = False
+
+        self.modify_index = None
+        self.modify_path = None
+        self.modify_params = {}
+
+        self.action_lines = []
+        self.enable_line = None
+
+    def apply(self, directory, index, path, params, line):
+        action = path[-1]
+        if action in ['enable', 'disable']:
+            self.enable_line = (index, action, line)
+        elif action == 'modify':
+            self._modify(directory, index, path, params)
+        else:
+            self.action_lines.append((index, line))
+
+    def _modify(self, directory, index, path, params):
+        name_param = record_commands.entity_param(params)
+        changes = {
+            param: value for param, value in params.items()
+            if value is not None and param not in _ACTION_PARAMS
+            and param != name_param
+            # In simple mode every field is given, as '' when unchanged.
+            and not (value == '' and not utils.advanced_mode_enabled())
+        }
+        actions = [param for param in _ACTION_PARAMS if params.get(param)]
+
+        if self.created:
+            # Changes the create can't make (e.g. setting a key, in simple
+            # mode) are kept as a modify.
+            create_params = record_commands.param_names(
+                directory, self.create_path
+            )
+            create_changes = {
+                param: value for param, value in changes.items()
+                if param in create_params
+            }
+            changes = {
+                param: value for param, value in changes.items()
+                if param not in create_params
+            }
+            self.create_params.update(create_changes)
+            if create_changes:
+                self.create_changed = True
+            if 'remove_key' in actions and 'key' in create_params:
+                # Simply create the user without the key.
+                self.create_params['key'] = None
+                actions.remove('remove_key')
+                self.create_changed = True
+
+        if changes:
+            self.modify_params.update(changes)
+            self.modify_params[name_param] = params[name_param]
+            self.modify_index = index
+            self.modify_path = path
+        if 'remove_key' in actions:
+            self.modify_params.pop('key', None)
+
+        if actions:
+            action_params = {param: True for param in actions}
+            action_params[name_param] = params[name_param]
+            self.action_lines.append((index, (path, action_params)))
+
+    def remove_from_group(self):
+        self.create_params['group'] = None
+        self.create_changed = True
+
+    def lines(self, directory):
+        lines = []
+        if self.created:
+            create_line = self.create_line
+            if self.create_changed:
+                create_line = record_commands.command_string(
+                    directory, self.create_path, self.create_params
+                )
+            lines.append((self.create_index, create_line))
+
+        if len(self.modify_params) > 1:
+            modify_params = self.modify_params
+            if not utils.advanced_mode_enabled():
+                # Simple mode modifies take every field, as '' if unchanged.
+                modify_params = {
+                    param: '' for param in
+                    record_commands.param_names(directory, self.modify_path)
+                }
+                modify_params.update(self.modify_params)
+            lines.append((self.modify_index, record_commands.command_string(
+                directory, self.modify_path, modify_params
+            )))
+
+        for index, line in self.action_lines:
+            if isinstance(line, tuple):
+                line = record_commands.command_string(directory, *line)
+            lines.append((index, line))
+
+        if self.enable_line:
+            index, action, line = self.enable_line
+            # Entities are enabled when created.
+            if not (self.created and action == 'enable'):
+                lines.append((index, line))
+
+        return lines
+
+
+# Forget the membership changes made before an entity is deleted, as deleting
+# it also removes it from its groups or removes the group's members.
+def _forget_memberships(entities, memberships, kind, name):
+    for key in list(memberships):
+        group_kind, group_name, member = key
+        if (group_kind, group_name) == (kind, name) or \
+                (_MEMBER_KINDS[group_kind], member) == (kind, name):
+            del memberships[key]
+            user = entities.get(('user', member))
+            if group_kind == 'group' and user and \
+                    user.create_params.get('group') == group_name:
+                user.remove_from_group()
+
+
+# Net out the changes to each membership, giving lines for the changes left.
+# As the record only has commands which succeeded, the first change shows
+# whether the member was in the group at the start of the record.
+def _membership_lines(directory, entities, memberships):
+    merged_changes = defaultdict(list)
+    for (group_kind, group_name, member), changes in memberships.items():
+        was_member = not changes[0][1]
+        index, is_member = changes[-1]
+
+        user = entities.get(('user', member))
+        added_on_create = group_kind == 'group' and user and user.created \
+            and user.create_index == changes[0][0]
+        if added_on_create and not is_member:
+            user.remove_from_group()
+        if was_member == is_member or added_on_create:
+            continue
+
+        merged_changes[(group_kind, group_name, is_member)].append(
+            (index, member)
+        )
+
+    lines = []
+    for (group_kind, group_name, adding), changes in merged_changes.items():
+        members_param, add_path, remove_path = \
+            _MEMBERSHIP_COMMANDS[group_kind]
+        path = add_path if adding else remove_path
+        params = {
+            group_kind + '_name': group_name,
+            members_param: [member for _, member in sorted(changes)],
+        }
+        lines.append((
+            max(changes)[0],
+            record_commands.command_string(directory, path, params)
+        ))
+    return lines
@@ -0,0 +1,154 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import click
+
+import group
+import host
+import hostgroup
+import ipa_utils
+import record_commands
+import user
+
+
+# Check the lines of a record before any of them are run, so problems anywhere
+# in the record are all found at once, before the Directory is changed: each
+# line is parsed with the Directory CLI commands without running them, the
+# names used are checked against the blacklists, and the UIDs and GIDs given
+# are checked against those already used (found once, in bulk).
+
+_BLACKLIST_VALIDATORS = {
+    'user': user._validate_blacklist_users,
+    'group': group._validate_blacklist_groups,
+    'host': host._validate_blacklist_hosts,
+    'hostgroup': hostgroup._validate_blacklist_hostgroups,
+}
+
+# For each kind with IDs: the option giving the ID, the find command and the
+# fields it gives for the ID and name, and what the find gives if none match.
+_ID_INDEXES = {
+    'user': ('uid', 'user-find', 'UID', 'User login', '0 users matched'),
+    'group': ('gid', 'group-find', 'GID', 'Group name', '0 groups matched'),
+}
+
+
+# Give `(line_number, command, message)` for each problem found in the given
+# `(line_number, command)` lines.
+def check(directory, lines):
+    problems = []
+    parsed_lines = []
+    for line_number, command in lines:
+        try:
+            path, params = record_commands.resolve(
+                directory, command, strict=True
+            )
+            _check_blacklists(path, params)
+        except click.ClickException as ex:
+            problems.append((line_number, command, ex.format_message()))
+            continue
+        except ValueError as ex:
+            problems.append((line_number, command, str(ex)))
+            continue
+        parsed_lines.append((line_number, command, path, params))
+
+    problems.extend(_check_ids(parsed_lines))
+    return sorted(problems)
+
+
+def _check_blacklists(path, params):
+    validate = _BLACKLIST_VALIDATORS.get(path[0])
+    name = record_commands.entity_name(params)
+    if validate and name:
+        validate(name)
+
+
+# Check IDs given to new or modified users and groups are not already used by
+# another user or group, whether already in the Directory or given by an
+# earlier line.
+def _check_ids(parsed_lines):
+    id_lines = [
+        (line_number, command, path, params)
+        for line_number, command, path, params in parsed_lines
+        if path[0] in _ID_INDEXES
+    ]
+    kinds = sorted({
+        path[0] for _, _, path, params in id_lines
+        if params.get(_ID_INDEXES[path[0]][0])
+    })
+    if not kinds:
+        return []
+
+    indexes = dict(zip(kinds, _find_id_indexes(kinds)))
+
+    problems = []
+    for line_number, command, path, params in id_lines:
+        kind, action = path[0], path[-1]
+        if kind not in indexes:
+            continue
+
+        owners = indexes[kind]
+        name = record_commands.entity_name(params)
+        if action == 'delete':
+            for id_number, owner in list(owners.items()):
+                if owner == name:
+                    del owners[id_number]
+            continue
+
+        id_param = _ID_INDEXES[kind][0]
+        id_number = params.get(id_param)
+        if action not in ['create', 'modify'] or not id_number:
+            continue
+
+        owner = owners.get(id_number)
+        if owner not in [None, name]:
+            problems.append((
+                line_number, command,
+                '{} {} is already used by {} {}'.format(
+                    id_param.upper(), id_number, kind, owner
+                )
+            ))
+            continue
+        owners[id_number] = name
+
+    return problems
+
+
+# The name owning each ID, for each of the given kinds.
+def _find_id_indexes(kinds):
+    results = ipa_utils.ipa_find_concurrently([
+        (_ID_INDEXES[kind][1], [], _ID_INDEXES[kind][4]) for kind in kinds
+    ], all_fields=False)
+
+    indexes = []
+    for kind, entries in zip(kinds, results):
+        _, _, id_field, name_field, _ = _ID_INDEXES[kind]
+        indexes.append({
+            entry[id_field][0]: entry[name_field][0]
+            for entry in entries
+            if id_field in entry and name_field in entry
+        })
+    return indexes
@@ -0,0 +1,205 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+from collections import defaultdict, namedtuple
+import shlex
+
+import click
+
+
+# The parts of the Directory which a record line's command reads and writes,
+# used to find which lines of a record may be run concurrently during an
+# import while still ending with the same state as running them in order.
+RecordCommand = namedtuple(
+    'RecordCommand', ['line_number', 'command', 'reads', 'writes']
+)
+
+# Every command reads this, so a command we cannot say what it accesses
+# (which writes this) is run only once all earlier lines have been, and
+# before any later line.
+_EVERYTHING = ('everything',)
+
+# IPA assigns user and group IDs in the order entries are created, so creates
+# which leave this to IPA are run in record order.
+_ID_ASSIGNMENT = ('id-assignment',)
+
+_ENTITY_PARAMS = ['login', 'name', 'group_name', 'hostname', 'hostgroup_name']
+
+_MEMBER_PARAMS = {'users': 'user', 'hosts': 'host'}
+
+_ID_PARAMS = {'user': 'uid', 'group': 'gid'}
+
+
+def parse(directory, line_number, command):
+    try:
+        path, params = resolve(directory, command)
+        reads, writes = _accesses(path, params)
+    except (click.ClickException, ValueError):
+        reads, writes = set(), {_EVERYTHING}
+
+    return RecordCommand(
+        line_number=line_number,
+        command=command,
+        reads=reads | {_EVERYTHING},
+        writes=writes,
+    )
+
+
+# Give, for each command, the indexes of the earlier commands which must have
+# been run before it: the last to write anything it reads or writes, and
+# anything reading what it writes since that was last written.
+def dependencies(commands):
+    last_writer = {}
+    readers = defaultdict(list)
+    all_dependencies = []
+
+    for index, command in enumerate(commands):
+        command_dependencies = set()
+        for key in command.reads | command.writes:
+            if key in last_writer:
+                command_dependencies.add(last_writer[key])
+        for key in command.writes:
+            command_dependencies.update(readers.pop(key, []))
+
+        for key in command.reads:
+            readers[key].append(index)
+        for key in command.writes:
+            last_writer[key] = index
+
+        command_dependencies.discard(index)
+        all_dependencies.append(command_dependencies)
+
+    return all_dependencies
+
+
+# Find the path of command names and the parsed parameters for the given
+# record line, without running anything; unless `strict`, invalid parameters
+# are ignored rather than raising a `click.UsageError`.
+def resolve(directory, command_string, strict=False):
+    arguments = shlex.split(command_string)
+    command = directory
+    path = []
+    while isinstance(command, click.MultiCommand):
+        if not arguments:
+            raise ValueError('Incomplete command')
+        name, arguments = arguments[0], arguments[1:]
+        command = command.get_command(None, name)
+        if command is None:
+            raise ValueError("No such command '{}'".format(name))
+        path.append(name)
+
+    context = command.make_context(
+        path[-1], arguments, resilient_parsing=not strict
+    )
+    return path, context.params
+
+
+# The record line which would run the command at `path` with the given
+# parameters; the reverse of `resolve`.
+def command_string(directory, path, params):
+    command = _command(directory, path)
+
+    arguments = list(path)
+    options = []
+    for param in command.params:
+        value = params.get(param.name)
+        if isinstance(param, click.Argument):
+            if param.nargs == 1:
+                value = [value] if value is not None else []
+            arguments.extend(value or [])
+        elif param.is_flag:
+            if value:
+                options.append(param.opts[0])
+        elif value is not None:
+            options.extend([param.opts[0], value])
+
+    return ' '.join(shlex.quote(argument) for argument in arguments + options)
+
+
+# The names of the parameters the command at `path` takes.
+def param_names(directory, path):
+    return [param.name for param in _command(directory, path).params]
+
+
+def _command(directory, path):
+    command = directory
+    for name in path:
+        command = command.get_command(None, name)
+    return command
+
+
+# The name of the user, group, host or host group a command is for.
+def entity_name(params):
+    param = entity_param(params)
+    return params[param] if param else None
+
+
+# The parameter giving `entity_name`.
+def entity_param(params):
+    return next(
+        (param for param in _ENTITY_PARAMS if params.get(param)), None
+    )
+
+
+def _accesses(path, params):
+    kind = path[0]
+    entity = entity_name(params)
+    if kind not in ['user', 'group', 'host', 'hostgroup'] or not entity:
+        raise ValueError('Unknown record command')
+
+    for members_param, member_kind in _MEMBER_PARAMS.items():
+        if members_param in params:
+            # Adding or removing members only needs the entities to exist.
+            members = params[members_param] or ()
+            reads = {(kind, entity)} | {
+                (member_kind, member) for member in members
+            }
+            writes = {
+                (kind + '-member', entity, member) for member in members
+            }
+            return reads, writes
+
+    reads = set()
+    writes = {(kind, entity)}
+
+    if kind == 'user':
+        # IPA may also give each user a group of the same name.
+        writes.add(('group', entity))
+
+        group = params.get('group')
+        if group:
+            reads.add(('group', group))
+            writes.add(('group-member', group, entity))
+
+    if path[-1] == 'create' and kind in _ID_PARAMS:
+        id_param = _ID_PARAMS[kind]
+        if params.get(id_param):
+            writes.add((id_param, params[id_param]))
+        else:
+            writes.add(_ID_ASSIGNMENT)
+
+    return reads, writes
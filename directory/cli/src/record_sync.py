@@ -0,0 +1,272 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+from collections import namedtuple
+import shlex
+
+import click
+
+import ipa_utils
+import record_commands
+
+
+# Compare the lines of a record with the current Directory, so an import need
+# only run the commands which are not already satisfied: creates of entities
+# which already exist as given, deletes of entities which don't exist,
+# modifications which change nothing, and membership changes already made.
+#
+# The Directory is found once, in bulk, and then updated as each line would
+# change it, so later lines are compared with the Directory as the earlier
+# lines will leave it.
+
+SyncPlan = namedtuple('SyncPlan', ['lines', 'skipped', 'conflicts'])
+
+_FIND_COMMANDS = {
+    'user': ('user-find', 'User login', '0 users matched'),
+    'group': ('group-find', 'Group name', '0 groups matched'),
+    'host': ('host-find', 'Host name', '0 hosts matched'),
+    'hostgroup': ('hostgroup-find', 'Host-group', '0 hostgroups matched'),
+}
+
+_MEMBER_FIELDS = {'group': 'Member users', 'hostgroup': 'Member hosts'}
+
+_MEMBER_PARAMS = {'group': 'users', 'hostgroup': 'hosts'}
+
+# The fields of each kind of entity we can compare with the options given.
+_COMPARED_FIELDS = {
+    'user': {
+        'first': 'First name',
+        'last': 'Last name',
+        'shell': 'Login shell',
+        'email': 'Email address',
+        'uid': 'UID',
+        'homedir': 'Home directory',
+        'gecos': 'GECOS',
+    },
+    'group': {'desc': 'Description', 'gid': 'GID'},
+    'host': {},
+    'hostgroup': {'desc': 'Description'},
+}
+
+# Options whose effect we cannot compare, so commands given these always run.
+_UNCOMPARED_PARAMS = {
+    'key', 'new_password', 'remove_password', 'remove_key', 'password',
+    'ip_address',
+}
+
+
+# Give the `SyncPlan` for the given `(line_number, command)` lines: the lines
+# still to run (possibly changed to only make the changes still needed), the
+# number skipped as already satisfied, and `(line_number, command, reason)`
+# for those which conflict with the Directory, which are also not run.
+def plan(directory, lines):
+    resolved_lines = [
+        (line_number, command, _resolve(directory, command))
+        for line_number, command in lines
+    ]
+    kinds = {
+        resolved[0][0] for _, _, resolved in resolved_lines
+        if resolved and resolved[0][0] in _FIND_COMMANDS
+    }
+    snapshot = _snapshot(kinds)
+
+    run_lines = []
+    skipped = 0
+    conflicts = []
+    for line_number, command, resolved in resolved_lines:
+        if resolved is None:
+            run_lines.append((line_number, command))
+            continue
+
+        path, params = resolved
+        outcome, detail = _compare(snapshot, path, params, command)
+        if outcome == 'skip':
+            skipped += 1
+        elif outcome == 'conflict':
+            conflicts.append((line_number, command, detail))
+        else:
+            run_lines.append((line_number, detail))
+
+    return SyncPlan(lines=run_lines, skipped=skipped, conflicts=conflicts)
+
+
+def _resolve(directory, command):
+    try:
+        path, params = record_commands.resolve(directory, command)
+    except (click.ClickException, ValueError):
+        return None
+
+    if path[0] not in _FIND_COMMANDS:
+        return None
+    if not record_commands.entity_name(params):
+        return None
+    return path, params
+
+
+# The current entries of each of the given kinds, by name, found all at once.
+def _snapshot(kinds):
+    kinds = sorted(kinds)
+    results = ipa_utils.ipa_find_concurrently([
+        (_FIND_COMMANDS[kind][0], [], _FIND_COMMANDS[kind][2])
+        for kind in kinds
+    ])
+
+    snapshot = {kind: {} for kind in _FIND_COMMANDS}
+    for kind, entries in zip(kinds, results):
+        key_field = _FIND_COMMANDS[kind][1]
+        for entry in entries:
+            if key_field not in entry:
+                continue
+            entry = dict(entry)
+            if kind in _MEMBER_FIELDS:
+                entry[_MEMBER_FIELDS[kind]] = set(
+                    entry.get(_MEMBER_FIELDS[kind], [])
+                )
+            snapshot[kind][entry[key_field][0]] = entry
+    return snapshot
+
+
+# Compare a command with the snapshot, updating the snapshot as running the
+# command would; gives `('skip', None)`, `('conflict', reason)` or
+# `('run', command)`.
+def _compare(snapshot, path, params, command):
+    kind, action = path[0], path[-1]
+    name = record_commands.entity_name(params)
+    entities = snapshot[kind]
+    entity = entities.get(name)
+
+    if _MEMBER_PARAMS.get(kind) in params:
+        return _compare_members(snapshot, path, params, entity, command)
+
+    if action == 'create':
+        if entity is None:
+            entities[name] = _new_entity(kind, params)
+            return _run_with_group(snapshot, params, name, command)
+        differences = _differences(kind, params, entity)
+        if differences:
+            return 'conflict', '{} {} already exists with a different {}'\
+                .format(kind, name, ', '.join(differences))
+        return _run_with_group(snapshot, params, name, None)
+
+    if entity is None:
+        if action == 'delete':
+            return 'skip', None
+        # Let the command report the entity not being found.
+        return 'run', command
+
+    if action == 'delete':
+        del entities[name]
+        if kind in ['user', 'host']:
+            for group in snapshot[_member_group_kind(kind)].values():
+                group[_MEMBER_FIELDS[_member_group_kind(kind)]].discard(name)
+        return 'run', command
+
+    if action in ['enable', 'disable']:
+        disabled = 'True' if action == 'disable' else 'False'
+        if entity.get('Account disabled') == [disabled]:
+            return 'skip', None
+        entity['Account disabled'] = [disabled]
+        return 'run', command
+
+    if action == 'modify' and not _uncompared_options(params):
+        if not _differences(kind, params, entity):
+            return 'skip', None
+        entity.update(_new_entity(kind, params))
+        return 'run', command
+
+    return 'run', command
+
+
+def _compare_members(snapshot, path, params, group, command):
+    kind = path[0]
+    members = params[_MEMBER_PARAMS[kind]] or ()
+    if group is None:
+        return 'run', command
+
+    current = group[_MEMBER_FIELDS[kind]]
+    adding = path[-1] in ['add', 'add-member']
+    changes = [member for member in members if (member in current) != adding]
+    if not changes:
+        return 'skip', None
+
+    if adding:
+        current.update(changes)
+    else:
+        current.difference_update(changes)
+
+    if len(changes) == len(members):
+        return 'run', command
+    return 'run', _command_string(path, params, changes)
+
+
+# Run the create command, if given, or just add the user to the group given
+# with `--group` if it is not already a member.
+def _run_with_group(snapshot, params, login, command):
+    group_name = params.get('group')
+    group = snapshot['group'].get(group_name) if group_name else None
+    if group is not None:
+        members = group[_MEMBER_FIELDS['group']]
+        if command is None and login not in members:
+            command = _command_string(
+                ['group', 'member', 'add'], {'group_name': group_name},
+                [login]
+            )
+        members.add(login)
+
+    return ('run', command) if command else ('skip', None)
+
+
+def _new_entity(kind, params):
+    entity = {
+        field: [params[param]]
+        for param, field in _COMPARED_FIELDS[kind].items()
+        if params.get(param)
+    }
+    if kind in _MEMBER_FIELDS:
+        entity[_MEMBER_FIELDS[kind]] = set()
+    return entity
+
+
+def _differences(kind, params, entity):
+    return [
+        field for param, field in _COMPARED_FIELDS[kind].items()
+        if params.get(param) and entity.get(field) != [params[param]]
+    ]
+
+
+def _uncompared_options(params):
+    return [param for param in _UNCOMPARED_PARAMS if params.get(param)]
+
+
+def _member_group_kind(kind):
+    return 'group' if kind == 'user' else 'hostgroup'
+
+
+def _command_string(path, params, members):
+    arguments = list(path) + [record_commands.entity_name(params)] + \
+        list(members)
+    return ' '.join(shlex.quote(argument) for argument in arguments)
@@ -0,0 +1,159 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import fcntl
+import glob
+import os
+import threading
+import time
+
+import pytest
+
+import appender
+import directory
+import test_utils
+from appliance_cli.testing_utils import click_run
+from config import CONFIG
+
+
+def setUpModule():
+    test_utils.reload_in_advanced_mode()
+
+
+@pytest.fixture
+def buffered(tmpdir):
+    with open(CONFIG.DIRECTORY_USER_CONFIG, 'w') as user_config:
+        user_config.write('RECORD_DURABILITY=buffered\n')
+    yield
+    appender.flush()
+
+
+def _read(path):
+    with open(path) as appended_file:
+        return appended_file.read()
+
+
+def test_appends_are_written_immediately_by_default(tmpdir):
+    path = tmpdir.join('appended').strpath
+
+    appender.append(path, 'first\n')
+
+    assert _read(path) == 'first\n'
+
+
+def _append_while_locked(path, while_locked=None):
+    with open(path, 'a') as held_file:
+        fcntl.flock(held_file, fcntl.LOCK_EX)
+        appending = threading.Thread(
+            target=appender.append, args=(path, 'appended\n')
+        )
+        appending.start()
+        time.sleep(0.1)
+        if while_locked:
+            while_locked()
+    appending.join()
+
+
+def test_append_waits_for_lock_and_counts_wait(tmpdir):
+    path = tmpdir.join('appended').strpath
+    appender.take_lock_waits()
+
+    _append_while_locked(path)
+
+    assert _read(path) == 'appended\n'
+    waits, total, longest = appender.take_lock_waits()[path]
+    assert waits == 1
+    assert total >= 0.1
+    assert appender.take_lock_waits() == {}
+
+
+def test_append_to_file_replaced_while_waiting_goes_to_new_file(tmpdir):
+    path = tmpdir.join('appended').strpath
+
+    def replace():
+        with open(path + '.new', 'w') as new_file:
+            new_file.write('replaced\n')
+        os.replace(path + '.new', path)
+
+    _append_while_locked(path, while_locked=replace)
+
+    assert _read(path) == 'replaced\nappended\n'
+
+
+def test_buffered_appends_are_written_together_on_flush(tmpdir, buffered):
+    path = tmpdir.join('appended').strpath
+
+    appender.append(path, 'first\n')
+    appender.append(path, 'second\n')
+
+    assert not os.path.exists(path)
+    assert glob.glob(path + '.*.pending')
+
+    appender.flush()
+
+    assert _read(path) == 'first\nsecond\n'
+    assert not glob.glob(path + '.*.pending')
+
+
+def test_buffered_appends_left_by_dead_process_are_reported(
+        tmpdir, buffered, capsys
+):
+    path = tmpdir.join('appended').strpath
+    # No process has this PID, as it is over the Linux maximum.
+    with open(path + '.4194305.pending', 'w') as marker:
+        marker.write('Appends buffered since earlier\n')
+
+    appender.append(path, 'first\n')
+
+    assert 'may be missing entries' in capsys.readouterr().err
+    assert not os.path.exists(path + '.4194305.pending')
+
+
+def test_import_writes_record_straight_away_but_buffers_log(
+        tmpdir, buffered, mocker
+):
+    write = mocker.spy(appender, '_write')
+    test_utils.mock_ipa_find_output(mocker)
+    mocker.patch('ipa_utils._run_ipa_command', return_value=mocker.Mock(
+        returncode=0, stdout='', stderr=''
+    ))
+    test_record = tmpdir.join('import').strpath
+    with open(test_record, 'w') as record_file:
+        record_file.writelines(
+            'group create group{}\n'.format(number) for number in range(20)
+        )
+
+    click_run(directory.directory, ['import', 'file://' + test_record])
+
+    def writes_to(path):
+        return [call for call in write.call_args_list if call[0][0] == path]
+
+    # Record lines for changes made in IPA are never left only in memory...
+    assert len(writes_to(CONFIG.DIRECTORY_RECORD)) == 20
+    assert len(_read(CONFIG.DIRECTORY_RECORD).splitlines()) == 20
+    # ...but the log is still written together once the import has finished.
+    assert len(writes_to(CONFIG.DIRECTORY_LOG)) < 20
@@ -0,0 +1,269 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+# Benchmarks of how long the CLI takes to start and to run commands, beyond the
+# time spent waiting on IPA. These are slow, and their timings depend on the
+# machine, so are only run when `RUN_BENCHMARKS=true` (see `make benchmark`).
+#
+# Commands are run in new processes, as they would be by the host join
+# triggers and scripts, with the IPA wrapper replaced by a stand-in script
+# which gives fixed output after a simulated delay. Each benchmark fails if
+# its median time exceeds the threshold, in milliseconds, given by the
+# `BENCHMARK_MAX_*` environment variable (or the default here). A report of
+# all timings, and the slowest imports at startup, is written to
+# `BENCHMARK_REPORT` if given.
+
+import json
+import os
+import re
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+
+pytestmark = pytest.mark.skipif(
+    os.getenv('RUN_BENCHMARKS', '').lower() != 'true',
+    reason='benchmarks are only run with RUN_BENCHMARKS=true'
+)
+
+RUNS = int(os.getenv('BENCHMARK_RUNS', 10))
+
+THRESHOLDS_MS = {
+    'import': 250,
+    'help': 1000,
+    'user_list_overhead': 750,
+}
+
+# Simulated time taken by each `ipa` command.
+FAKE_IPA_LATENCY = 0.05
+
+FAKE_USERS = 200
+
+_SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# All tests have `subprocess.run` replaced (see `shared_fixtures`), but these
+# need to really run commands.
+_run = subprocess.run
+
+# Run the CLI with the given config overridden, and without obtaining a
+# Kerberos ticket (which the stand-in IPA wrapper doesn't need).
+_RUN_CLI = textwrap.dedent('''
+    import datetime, json, sys
+    from config import CONFIG
+    import kerberos
+    for key, value in json.loads(sys.argv[1]).items():
+        setattr(CONFIG, key, value)
+    kerberos._usable_until = datetime.datetime.max
+    sys.argv = ['directory'] + sys.argv[2:]
+    from directory import directory
+    directory()
+''')
+
+_FAKE_IPA_WRAPPER = textwrap.dedent('''
+    #!{python}
+    import os, sys, time
+
+    time.sleep({latency})
+    with open({calls!r}, 'a') as calls:
+        calls.write(' '.join(sys.argv[1:]) + '\\n')
+
+    command = sys.argv[1]
+    if command == 'user-find':
+        entries = [
+            [('User login', 'user{{}}'), ('First name', 'First'),
+             ('Last name', 'Last'), ('UID', str(10000 + number)),
+             ('GID', str(10000 + number)),
+             ('Email address', 'user{{}}@example.com')]
+            for number in range({users})
+        ]
+        entries = [
+            [(field, value.format(number)) for field, value in entry]
+            for number, entry in enumerate(entries)
+        ]
+    elif command == 'group-find':
+        entries = [
+            [('Group name', 'user{{}}'.format(number)),
+             ('GID', str(10000 + number))]
+            for number in range({users})
+        ]
+    else:
+        entries = []
+
+    print('-' * 15)
+    print('{{}} entries matched'.format(len(entries)))
+    print('-' * 15)
+    for number, entry in enumerate(entries):
+        # Entries are separated by blank lines, as `ipa` outputs them.
+        if number:
+            print()
+        for field, value in entry:
+            print('  {{}}: {{}}'.format(field, value))
+    print('-' * 30)
+    print('Number of entries returned {{}}'.format(len(entries)))
+    print('-' * 30)
+''').lstrip()
+
+
+@pytest.fixture(scope='module')
+def report():
+    timings = {}
+    yield timings
+
+    report_path = os.getenv('BENCHMARK_REPORT')
+    if report_path:
+        with open(report_path, 'w') as report_file:
+            json.dump(timings, report_file, indent=2)
+
+
+@pytest.fixture
+def fake_ipa(tmpdir):
+    calls = tmpdir.join('ipa-calls').strpath
+    wrapper = tmpdir.join('fake-ipa-wrapper')
+    wrapper.write(_FAKE_IPA_WRAPPER.format(
+        python=sys.executable,
+        latency=FAKE_IPA_LATENCY,
+        calls=calls,
+        users=FAKE_USERS,
+    ))
+    wrapper.chmod(0o755)
+
+    config = {
+        'IPA_WRAPPER_SCRIPT_PATH': wrapper.strpath,
+        'DIRECTORY_RECORD': tmpdir.join('record').strpath,
+        'DIRECTORY_LOG': tmpdir.join('log.csv').strpath,
+        'DIRECTORY_JSON_LOG': tmpdir.join('log.jsonl').strpath,
+        'DIRECTORY_USER_CONFIG': tmpdir.join('user_config').strpath,
+        'DIRECTORY_CACHE': tmpdir.join('cache.sqlite').strpath,
+    }
+    return config, calls
+
+
+def test_import_time(report):
+    timings = _time_runs(
+        [sys.executable, '-c', 'import directory'], cwd=_SRC_DIR
+    )
+
+    importtime = _run(
+        [sys.executable, '-X', 'importtime', '-c', 'import directory'],
+        cwd=_SRC_DIR,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True
+    ).stderr
+    report['import'] = {
+        **_percentiles(timings),
+        'slowest_imports': _slowest_imports(importtime),
+    }
+
+    _assert_within_threshold('import', timings)
+
+
+def test_help_time(report, fake_ipa):
+    config, _ = fake_ipa
+
+    timings = _time_runs(_cli_command(config, '--help'), cwd=_SRC_DIR)
+
+    report['help'] = _percentiles(timings)
+    _assert_within_threshold('help', timings)
+
+
+def test_user_list_overhead(report, fake_ipa):
+    config, calls = fake_ipa
+
+    timings = _time_runs(_cli_command(config, 'user', 'list'), cwd=_SRC_DIR)
+
+    with open(calls) as calls_file:
+        ipa_calls_per_run = len(calls_file.readlines()) / RUNS
+    assert ipa_calls_per_run > 0
+    overheads = [
+        timing - ipa_calls_per_run * FAKE_IPA_LATENCY for timing in timings
+    ]
+    report['user_list_overhead'] = {
+        **_percentiles(overheads),
+        'ipa_calls': ipa_calls_per_run,
+    }
+    _assert_within_threshold('user_list_overhead', overheads)
+
+
+def _cli_command(config, *args):
+    return [sys.executable, '-c', _RUN_CLI, json.dumps(config)] + list(args)
+
+
+def _time_runs(command, cwd):
+    timings = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        result = _run(
+            command,
+            cwd=cwd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        timings.append(time.perf_counter() - started)
+        assert result.returncode == 0, result.stderr
+    return timings
+
+
+def _percentiles(timings):
+    ordered = sorted(timings)
+    return {
+        'p{}'.format(percent): round(
+            ordered[min(len(ordered) - 1, len(ordered) * percent // 100)]
+            * 1000, 1
+        )
+        for percent in [50, 90, 99]
+    }
+
+
+# The modules with the longest cumulative import time (in milliseconds), from
+# `-X importtime` output.
+def _slowest_imports(importtime, count=15):
+    imports = []
+    for line in importtime.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (.*)', line)
+        if match:
+            imports.append((int(match.group(1)) / 1000, match.group(2)))
+    imports.sort(reverse=True)
+    return [
+        {'module': module.strip(), 'cumulative_ms': cumulative}
+        for cumulative, module in imports[:count]
+    ]
+
+
+def _assert_within_threshold(name, timings):
+    threshold = float(os.getenv(
+        'BENCHMARK_MAX_{}_MS'.format(name.upper()), THRESHOLDS_MS[name]
+    ))
+    median = _percentiles(timings)['p50']
+    assert median <= threshold, \
+        '{} took {}ms (median), over the {}ms threshold'.format(
+            name, median, threshold
+        )
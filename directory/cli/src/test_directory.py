@@ -0,0 +1,57 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import importlib
+import os
+
+import directory
+import test_utils
+from appliance_cli.testing_utils import click_run
+from config import CONFIG
+
+
+def test_access_logged_when_run_rather_than_imported():
+    importlib.reload(directory)
+    assert not os.path.exists(CONFIG.DIRECTORY_LOG)
+
+    click_run(directory.directory, ['log', 'search'])
+
+    with open(CONFIG.DIRECTORY_LOG) as log_file:
+        assert 'access,Success' in log_file.readline()
+
+
+def test_command_module_added_only_when_command_needed(mocker):
+    test_utils.reload_in_simple_mode()
+    import_module = mocker.spy(importlib, 'import_module')
+
+    assert 'user' not in directory.directory.commands
+    assert 'host' not in directory.directory.list_commands(None)
+
+    directory.directory.get_command(None, 'user')
+
+    import_module.assert_called_once_with('user')
+    assert 'user' in directory.directory.commands
@@ -0,0 +1,233 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import pytest
+
+import directory_cache
+import user
+from config import CONFIG
+from exceptions import IpaRunError
+
+
+USERS = [
+    {'User login': ['fred'], 'UID': ['1001'], 'GID': ['1001']},
+    {'User login': ['barney'], 'UID': ['1002'], 'GID': ['1002']},
+]
+
+
+@pytest.fixture
+def cache_enabled():
+    with open(CONFIG.DIRECTORY_USER_CONFIG, 'w') as user_config:
+        user_config.write('CACHE_TTL=300\n')
+
+
+@pytest.fixture
+def mock_ipa_find(mocker):
+    def ipa_find(ipa_command, ipa_args, *args, **kwargs):
+        if ipa_command == 'user-find':
+            return USERS
+        return [{}]
+
+    return mocker.patch('ipa_utils.ipa_find', side_effect=ipa_find)
+
+
+def test_cache_is_disabled_by_default():
+    assert not directory_cache.enabled()
+
+
+def test_entries_are_fetched_once_within_ttl(cache_enabled, mock_ipa_find):
+    assert directory_cache.entries('user') == USERS
+    assert directory_cache.entries('user') == USERS
+
+    assert mock_ipa_find.call_count == 1
+
+
+def test_find_matches_key_case_insensitively(cache_enabled, mock_ipa_find):
+    assert directory_cache.find('user', 'Barney') == [USERS[1]]
+
+
+def test_find_raises_ipa_run_error_when_not_found(
+        cache_enabled, mock_ipa_find):
+    with pytest.raises(IpaRunError):
+        directory_cache.find('user', 'wilma')
+
+
+def test_empty_snapshot_has_no_entries(cache_enabled, mock_ipa_find):
+    assert directory_cache.entries('hostgroup') == []
+
+
+def test_invalidated_entries_are_fetched_again(cache_enabled, mock_ipa_find):
+    directory_cache.entries('user')
+    directory_cache.invalidate('user')
+    directory_cache.entries('user')
+
+    assert mock_ipa_find.call_count == 2
+
+
+USER_ADD_OUTPUT = """-------------------
+Added user "wilma"
+-------------------
+  User login: wilma
+  UID: 1003
+  GID: 1003
+  Random password: s3cret
+"""
+
+
+def test_result_args_only_request_all_fields_when_enabled(cache_enabled):
+    assert directory_cache.result_args('user-add') == ['--all']
+    assert directory_cache.result_args('user-del') == []
+
+
+def test_result_args_are_empty_when_disabled():
+    assert directory_cache.result_args('user-add') == []
+
+
+def test_added_entries_are_stored_without_temporary_password(
+        cache_enabled, mock_ipa_find):
+    directory_cache.entries('user')
+
+    directory_cache.apply_result('user-add', ['wilma'], USER_ADD_OUTPUT)
+
+    assert directory_cache.find('user', 'wilma') == [{
+        'User login': ['wilma'], 'UID': ['1003'], 'GID': ['1003']
+    }]
+    assert mock_ipa_find.call_count == 1
+
+
+def test_deleted_entries_are_removed(cache_enabled, mock_ipa_find):
+    directory_cache.entries('user')
+
+    directory_cache.apply_result('user-del', ['fred'], '')
+
+    assert directory_cache.entries('user') == [USERS[1]]
+
+
+def test_enabling_and_disabling_updates_account_disabled(
+        cache_enabled, mock_ipa_find):
+    directory_cache.entries('user')
+
+    directory_cache.apply_result('user-disable', ['fred'], '')
+
+    fred = directory_cache.find('user', 'fred')[0]
+    assert fred['Account disabled'] == ['True']
+
+
+def test_membership_changes_mark_other_side_stale(
+        cache_enabled, mock_ipa_find):
+    directory_cache.entries('user')
+
+    directory_cache.apply_result('group-add-member', ['quarry'], '')
+    directory_cache.entries('user')
+
+    assert mock_ipa_find.call_count == 2
+
+
+GROUPS = [
+    {'Group name': ['ipausers']},
+    {'Group name': ['flintstones'], 'GID': ['1000']},
+    {'Group name': ['rubbles'], 'GID': ['1002']},
+]
+
+PRIVATE_GROUPS = [
+    {'Group name': ['fred'], 'GID': ['1001']},
+    {'Group name': ['barney'], 'GID': ['1002']},
+]
+
+
+@pytest.fixture
+def gid_index_enabled():
+    with open(CONFIG.DIRECTORY_USER_CONFIG, 'w') as user_config:
+        user_config.write('GID_INDEX_TTL=300\n')
+
+
+@pytest.fixture
+def mock_group_find(mocker):
+    def ipa_find(ipa_command, ipa_args, *args, **kwargs):
+        return PRIVATE_GROUPS if '--private' in ipa_args else GROUPS
+
+    return mocker.patch('ipa_utils.ipa_find', side_effect=ipa_find)
+
+
+def test_gid_index_maps_gids_to_group_names(mock_group_find):
+    assert directory_cache.group_names_by_gid() == {
+        '1000': 'flintstones',
+        '1001': 'fred',
+        # Private group takes precedence.
+        '1002': 'barney',
+    }
+
+
+def test_gid_index_is_fetched_once_within_ttl(
+        gid_index_enabled, mock_group_find):
+    directory_cache.group_names_by_gid()
+    directory_cache.group_names_by_gid()
+
+    # Once each for public and private groups.
+    assert mock_group_find.call_count == 2
+
+
+def test_gid_index_is_fetched_again_after_group_changes(
+        gid_index_enabled, mock_group_find):
+    directory_cache.group_names_by_gid()
+    directory_cache.apply_result('group-add', ['slates'], '')
+    directory_cache.group_names_by_gid()
+
+    assert mock_group_find.call_count == 4
+
+
+def test_gid_index_is_disabled_by_default(mock_group_find):
+    directory_cache.group_names_by_gid()
+    directory_cache.group_names_by_gid()
+
+    assert mock_group_find.call_count == 4
+
+
+def test_gid_index_is_built_from_snapshot_when_enabled(
+        cache_enabled, mock_group_find):
+    directory_cache.group_names_by_gid()
+    directory_cache.entries('group')
+    directory_cache.entries('private-group')
+
+    assert mock_group_find.call_count == 2
+
+
+def test_gid_missing_from_index_is_fetched_again(
+        gid_index_enabled, mock_group_find):
+    groups_by_gid = user._groups_by_gid()
+
+    # A group added outside this CLI since the index was built.
+    GROUPS.append({'Group name': ['slates'], 'GID': ['1003']})
+    try:
+        assert groups_by_gid['1003'] == {'Group name': ['slates']}
+        with pytest.raises(KeyError):
+            groups_by_gid['1004']
+    finally:
+        GROUPS.pop()
+
+    # Fetched once when built and once more for the missing GID only.
+    assert mock_group_find.call_count == 4
@@ -25,13 +25,20 @@
 # https://github.com/openflighthpc/flight-directory
 #==============================================================================
 
+import pytest
 import unittest
 from unittest import mock
+import gzip
+import os
 import re
+import subprocess
 
 import directory
 import utils
 import ipa_utils
+import ipa_rpc
+import user
+from config import CONFIG
 import test_utils
 from appliance_cli.testing_utils import click_run
 
@@ -162,6 +169,379 @@ def test_import_stops_on_error_and_reports_it(
         "Error: processing line 0 ('group create mygroup'):" in result.output
 
 
+def _write_record(tmpdir, lines):
+    test_record = tmpdir.mkdir('somedir').join('record').strpath
+    with open(test_record, 'w') as record_file:
+        record_file.writelines(lines)
+    return 'file://' + test_record
+
+
+def _mock_run_batch(mocker, failing_logins=()):
+    def mock_run_batch(commands):
+        results = []
+        for ipa_command, ipa_args in commands:
+            login = ipa_args[0]
+            if login in failing_logins:
+                results.append(subprocess.CompletedProcess(
+                    ipa_command, 1, stdout='',
+                    stderr='ipa: ERROR: {} failed'.format(login)
+                ))
+                continue
+            stdout = 'User login: {}'.format(login)
+            if '--random' in ipa_args:
+                stdout += '\nRandom password: {}_password'.format(login)
+            results.append(
+                subprocess.CompletedProcess(ipa_command, 0, stdout=stdout)
+            )
+        return results
+
+    mocker.patch.object(ipa_rpc, 'enabled', return_value=True)
+    return mocker.patch.object(
+        ipa_rpc, 'run_batch', side_effect=mock_run_batch
+    )
+
+
+def test_batched_import_sends_commands_together(tmpdir, mocker):
+    run_batch = _mock_run_batch(mocker)
+    test_utils.mock_ipa_find_output(mocker)
+    record_url = _write_record(tmpdir, [
+        'user create first --first a --last user\n',
+        'user create second --first a --last user\n',
+        'user create third --first a --last user\n',
+    ])
+
+    result = click_run(
+        directory.directory, ['import', record_url, '--batch-size', '2']
+    )
+
+    assert [
+        [ipa_args[0] for _, ipa_args in call[0][0]]
+        for call in run_batch.call_args_list
+    ] == [['first', 'second'], ['third']]
+
+    # Passwords are still gathered from the batched results.
+    assert re.search('second.*second_password', result.output)
+
+
+def test_batched_import_reports_line_of_failed_command(tmpdir, mocker):
+    _mock_run_batch(mocker, failing_logins=['second'])
+    test_utils.mock_ipa_find_output(mocker)
+    record_url = _write_record(tmpdir, [
+        'user create first --first a --last user\n',
+        'user create second --first a --last user\n',
+        'user create third --first a --last user\n',
+    ])
+
+    result = click_run(
+        directory.directory, ['import', record_url, '--batch-size', '5']
+    )
+
+    assert "Error: processing line 1 ('user create second" in result.output
+    assert 'second failed' in result.output
+    assert 'line 0' not in result.output
+
+
+def test_batched_import_requires_jsonrpc_backend(tmpdir, mocker):
+    mocker.patch.object(ipa_rpc, 'enabled', return_value=False)
+    mocker.spy(utils, 'directory_run')
+    record_url = _write_record(tmpdir, ['group create mygroup\n'])
+
+    result = click_run(
+        directory.directory, ['import', record_url, '--batch-size', '5']
+    )
+
+    assert 'requires the JSON-RPC IPA backend' in result.output
+    assert utils.directory_run.call_count == 0
+
+
+def _mock_run_ipa_command(mocker, failing_command=None):
+    run_commands = []
+
+    def run_ipa_command(ipa_command, ipa_args):
+        run_commands.append((ipa_command, ipa_args[0]))
+        returncode = 1 if (ipa_command, ipa_args[0]) == failing_command else 0
+        stdout = ''
+        if '--random' in ipa_args:
+            stdout = 'Random password: {}_password'.format(ipa_args[0])
+        return subprocess.CompletedProcess(
+            ipa_command, returncode, stdout=stdout, stderr='ipa: ERROR: failed'
+        )
+
+    mocker.patch.object(
+        ipa_utils, '_run_ipa_command', side_effect=run_ipa_command
+    )
+    return run_commands
+
+
+def test_import_finds_used_uids_once_and_keeps_them_up_to_date(
+        tmpdir,
+        mocker
+):
+    run_commands = _mock_run_ipa_command(mocker)
+
+    def mock_ipa_find(ipa_command, ipa_args=[], *args, **kwargs):
+        if ipa_command == 'user-find':
+            return [{'User login': ['existing'], 'UID': ['1000']}]
+        return [{'GID': ['5000']}]
+
+    mocker.patch.object(ipa_utils, 'ipa_find', side_effect=mock_ipa_find)
+    record_url = _write_record(tmpdir, [
+        'user create first --first a --last user --uid 2001\n',
+        'user modify first --shell /bin/sh\n',
+        'user delete first\n',
+        'user create second --first a --last user --uid 2001\n',
+    ])
+
+    find_used_uids = mocker.spy(user._UsedUids, 'find')
+
+    result = click_run(directory.directory, ['import', record_url])
+
+    # The UIDs are found once, despite users being modified and deleted.
+    assert find_used_uids.call_count == 1
+
+    # The deleted user's UID can then be reused.
+    assert result.exit_code == 0
+    assert ('user-add', 'second') in run_commands
+
+
+CONCURRENT_RECORD_LINES = [
+    'user create first --first a --last user --no-password\n',
+    'user create second --first a --last user --no-password\n',
+    'group create mygroup\n',
+    'group member add mygroup first second\n',
+    'user modify first --shell /bin/sh\n',
+]
+
+
+def test_concurrent_import_runs_lines_after_those_they_depend_on(
+        tmpdir,
+        mocker
+):
+    run_commands = _mock_run_ipa_command(mocker)
+    test_utils.mock_ipa_find_output(mocker)
+    record_url = _write_record(tmpdir, CONCURRENT_RECORD_LINES)
+
+    result = click_run(
+        directory.directory, ['import', record_url, '--jobs', '3']
+    )
+
+    assert result.exit_code == 0
+    member_add = run_commands.index(('group-add-member', 'mygroup'))
+    assert member_add > run_commands.index(('user-add', 'first'))
+    assert member_add > run_commands.index(('user-add', 'second'))
+    assert member_add > run_commands.index(('group-add', 'mygroup'))
+    assert run_commands.index(('user-mod', 'first')) > \
+        run_commands.index(('user-add', 'first'))
+
+    # Each line is recorded as itself, whichever thread ran it.
+    with open(CONFIG.DIRECTORY_RECORD) as record:
+        assert sorted(record.readlines()) == sorted(CONCURRENT_RECORD_LINES)
+
+
+def test_concurrent_import_does_not_run_lines_depending_on_failed_line(
+        tmpdir,
+        mocker
+):
+    run_commands = _mock_run_ipa_command(
+        mocker, failing_command=('group-add', 'mygroup')
+    )
+    test_utils.mock_ipa_find_output(mocker)
+    record_url = _write_record(tmpdir, CONCURRENT_RECORD_LINES)
+
+    result = click_run(
+        directory.directory, ['import', record_url, '--jobs', '3']
+    )
+
+    assert "Error: processing line 2 ('group create mygroup'):" \
+        in result.output
+    assert ('group-add-member', 'mygroup') not in run_commands
+
+
+def test_import_does_not_allow_both_batches_and_jobs(tmpdir, mocker):
+    mocker.spy(utils, 'directory_run')
+    record_url = _write_record(tmpdir, ['group create mygroup\n'])
+
+    result = click_run(
+        directory.directory,
+        ['import', record_url, '--batch-size', '5', '--jobs', '2']
+    )
+
+    assert 'cannot be used together' in result.output
+    assert utils.directory_run.call_count == 0
+
+
+RESUMABLE_RECORD_LINES = [
+    'user create first --first a --last user\n',
+    'user create second --first a --last user\n',
+    'group create mygroup\n',
+]
+
+
+def test_import_resumes_from_line_which_failed(tmpdir, mocker):
+    test_utils.mock_ipa_find_output(mocker)
+    record_url = _write_record(tmpdir, RESUMABLE_RECORD_LINES)
+
+    _mock_run_ipa_command(mocker, failing_command=('user-add', 'second'))
+    result = click_run(directory.directory, ['import', record_url])
+    assert "Error: processing line 1 ('user create second" in result.output
+    assert "Run 'directory import --resume'" in result.output
+    assert os.stat(CONFIG.DIRECTORY_IMPORT_CHECKPOINT).st_mode & 0o777 == \
+        0o600
+
+    run_commands = _mock_run_ipa_command(mocker)
+    result = click_run(directory.directory, ['import', '--resume'])
+
+    assert result.exit_code == 0
+    assert run_commands == [('user-add', 'second'), ('group-add', 'mygroup')]
+    # Passwords generated before the import was interrupted are still given.
+    assert re.search('first.*first_password', result.output)
+    assert re.search('second.*second_password', result.output)
+    assert not os.path.exists(CONFIG.DIRECTORY_IMPORT_CHECKPOINT)
+
+
+def test_import_does_not_resume_if_record_has_changed(tmpdir, mocker):
+    test_utils.mock_ipa_find_output(mocker)
+    record_url = _write_record(tmpdir, RESUMABLE_RECORD_LINES)
+
+    _mock_run_ipa_command(mocker, failing_command=('user-add', 'second'))
+    click_run(directory.directory, ['import', record_url])
+
+    with open(record_url.replace('file://', ''), 'w') as record_file:
+        record_file.writelines(
+            ['user create other --first a --last user\n'] +
+            RESUMABLE_RECORD_LINES[1:]
+        )
+    run_commands = _mock_run_ipa_command(mocker)
+    result = click_run(directory.directory, ['import', '--resume'])
+
+    assert 'has changed since the interrupted import' in result.output
+    assert run_commands == []
+
+
+def test_import_resume_requires_interrupted_import(mocker):
+    mocker.spy(utils, 'directory_run')
+
+    result = click_run(directory.directory, ['import', '--resume'])
+
+    assert 'No interrupted import found to resume' in result.output
+    assert utils.directory_run.call_count == 0
+
+
+def test_sync_import_only_runs_commands_not_already_applied(tmpdir, mocker):
+    def ipa_find(ipa_command, *args, **kwargs):
+        if ipa_command == 'group-find':
+            return [{'Group name': ['mygroup'], 'Member users': ['first']}]
+        return []
+
+    mocker.patch.object(ipa_utils, 'ipa_find', side_effect=ipa_find)
+    run_commands = _mock_run_ipa_command(mocker)
+    record_url = _write_record(tmpdir, [
+        'group create mygroup\n',
+        'group member add mygroup first second\n',
+        'group create othergroup\n',
+    ])
+
+    result = click_run(directory.directory, ['import', record_url, '--sync'])
+
+    assert 'Of 3 commands: 1 already applied, 2 to apply, 0 conflicting.' \
+        in result.output
+    assert run_commands == [
+        ('group-add-member', 'mygroup'), ('group-add', 'othergroup')
+    ]
+    with open(CONFIG.DIRECTORY_RECORD) as record:
+        assert record.readlines() == [
+            'group member add mygroup second\n', 'group create othergroup\n'
+        ]
+
+
+def test_import_reports_all_problems_before_running_any_line(tmpdir, mocker):
+    run_commands = _mock_run_ipa_command(mocker)
+    record_url = _write_record(tmpdir, [
+        'group create mygroup\n',
+        'group craete othergroup\n',
+        'group create admins\n',
+    ])
+
+    result = click_run(directory.directory, ['import', record_url])
+
+    assert 'Found 2 problems in the record:' in result.output
+    assert "line 1 ('group craete othergroup')" in result.output
+    assert "line 2 ('group create admins')" in result.output
+    assert run_commands == []
+
+
+def test_import_check_only_checks_record(tmpdir, mocker):
+    run_commands = _mock_run_ipa_command(mocker)
+    record_url = _write_record(tmpdir, ['group create mygroup\n'])
+
+    result = click_run(directory.directory, ['import', record_url, '--check'])
+
+    assert 'No problems found in 1 record line.' in result.output
+    assert run_commands == []
+
+
+def test_import_decompresses_gzipped_record(tmpdir, mocker):
+    run_commands = _mock_run_ipa_command(mocker)
+    test_record = tmpdir.join('record.gz').strpath
+    with gzip.open(test_record, 'wt') as record_file:
+        record_file.writelines(['group create mygroup\r\n', '\n'] * 3)
+
+    result = click_run(directory.directory, ['import', 'file://' + test_record])
+
+    assert result.exit_code == 0
+    assert run_commands == [('group-add', 'mygroup')] * 3
+
+
+def test_import_decompresses_zstandard_record(tmpdir, mocker):
+    zstandard = pytest.importorskip('zstandard')
+    run_commands = _mock_run_ipa_command(mocker)
+    test_record = tmpdir.join('record.zst').strpath
+    with open(test_record, 'wb') as record_file:
+        record_file.write(
+            zstandard.ZstdCompressor().compress(b'group create mygroup\n')
+        )
+
+    click_run(directory.directory, ['import', 'file://' + test_record])
+
+    assert run_commands == [('group-add', 'mygroup')]
+
+
+def test_import_without_check_runs_lines_as_they_are_read(tmpdir, mocker):
+    run_commands = _mock_run_ipa_command(mocker)
+    record_url = _write_record(tmpdir, [
+        'group create mygroup\n',
+        'group craete othergroup\n',
+    ])
+
+    result = click_run(
+        directory.directory, ['import', record_url, '--no-check']
+    )
+
+    assert "processing line 1 ('group craete othergroup')" in result.output
+    assert run_commands == [('group-add', 'mygroup')]
+
+
+def test_import_reports_record_which_cannot_be_fetched(tmpdir):
+    result = click_run(directory.directory, [
+        'import', 'file://' + tmpdir.join('missing').strpath
+    ])
+
+    assert 'Could not read the record from' in result.output
+
+
+def test_import_does_not_report_errors_running_lines_as_read_errors(
+        tmpdir,
+        mocker
+):
+    mocker.patch.object(
+        utils, 'directory_run', side_effect=OSError('No space left on device')
+    )
+    record_url = _write_record(tmpdir, ['group create mygroup\n'])
+
+    with pytest.raises(OSError, match='No space left on device'):
+        click_run(directory.directory, ['import', record_url])
+
+
 @unittest.skip('Should look into whether or not we even need this test any more')
 def test_import_reports_requests_error_if_occurs(
         tmpdir,
@@ -0,0 +1,352 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+import directory
+import ipa_rpc
+import ipa_utils
+import user
+import utils
+from appliance_cli.testing_utils import click_run
+from config import CONFIG
+from exceptions import IpaRunError
+
+
+SESSION_COOKIE = 'ipa_session=MagBearerToken=stand-in'
+
+USERS = {
+    'fred': {
+        'dn': 'uid=fred,cn=users,cn=accounts,dc=example,dc=com',
+        'uid': ['fred'],
+        'givenname': ['Fred'],
+        'sn': ['Flintstone'],
+        'uidnumber': ['1001'],
+        'gidnumber': ['1001'],
+        'memberof_group': ['clusterusers', 'quarry'],
+        'nsaccountlock': False,
+    },
+}
+
+USER_PARAMS = [
+    {'name': 'uid', 'label': 'User login'},
+    {'name': 'givenname', 'label': 'First name'},
+    {'name': 'sn', 'label': 'Last name'},
+    {'name': 'uidnumber', 'label': 'UID'},
+    {'name': 'nsaccountlock', 'label': 'Account disabled'},
+    {'name': 'gidnumber', 'label': 'GID'},
+    {'name': 'cn', 'label': 'Full name'},
+]
+
+USER_METADATA = {
+    'takes_params': USER_PARAMS,
+    'default_attributes': ['uid', 'givenname', 'sn', 'cn', 'memberof'],
+    'search_display_attributes': [
+        'uid', 'givenname', 'sn', 'uidnumber', 'gidnumber', 'nsaccountlock',
+    ],
+    'attribute_members': {'memberof': ['group', 'role']},
+}
+
+
+# Minimal stand-in for the IPA server's session login and JSON-RPC endpoints.
+class StandInIpaHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+
+        if self.path == '/ipa/session/login_password':
+            self.server.logins += 1
+            form = parse_qs(body.decode())
+            if form['password'] != ['secret']:
+                return self._respond(401, b'')
+            self.send_response(200)
+            self.send_header('Set-Cookie', SESSION_COOKIE + '; path=/ipa')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        elif self.path == '/ipa/session/json':
+            if SESSION_COOKIE not in self.headers.get('Cookie', ''):
+                return self._respond(401, b'')
+            request = json.loads(body.decode())
+            self.server.calls.append(request)
+            response = self._dispatch(request['method'], *request['params'])
+            self._respond(200, json.dumps(response).encode())
+
+    def _dispatch(self, method, args, options):
+        if method == 'json_metadata':
+            return self._result(
+                {'objects': {'user': USER_METADATA}}
+            )
+        elif method == 'user_find':
+            matching = [
+                user for login, user in sorted(USERS.items())
+                if options.get('uid') in (None, login)
+            ]
+            return self._result({
+                'result': matching,
+                'count': len(matching),
+                'truncated': False,
+                'summary': '{} users matched'.format(len(matching)),
+            })
+        elif method == 'user_show':
+            return self._error('{}: user not found'.format(args[0]))
+        elif method == 'user_add':
+            if args[0] in USERS:
+                return self._error(
+                    'user with name "{}" already exists'.format(args[0])
+                )
+            return self._result({
+                'result': {'uid': [args[0]]},
+                'value': args[0],
+                'summary': 'Added user "{}"'.format(args[0]),
+            })
+        elif method == 'group_add_member':
+            failed = [
+                (user, 'no such entry') for user in [options['user']]
+                if user not in USERS and user != 'barney'
+            ]
+            return self._result({
+                'result': {'cn': [args[0]]},
+                'failed': {'member': {'user': failed}},
+                'completed': 1 - len(failed),
+            })
+        elif method == 'user_mod':
+            return self._result({
+                'result': USERS[args[0]],
+                'value': args[0],
+                'summary': 'Modified user "{}"'.format(args[0]),
+            })
+        elif method == 'user_del':
+            return self._result({'result': {'failed': []}})
+        elif method == 'batch':
+            results = []
+            for batch_call in args:
+                response = self._dispatch(
+                    batch_call['method'], *batch_call['params']
+                )
+                if response['error']:
+                    results.append({'error': response['error']['message']})
+                else:
+                    results.append(dict(response['result'], error=None))
+            return self._result({'count': len(results), 'results': results})
+
+    def _error(self, message):
+        return {
+            'result': None,
+            'error': {'code': 4001, 'name': 'NotFound', 'message': message},
+            'id': 0,
+        }
+
+    def _result(self, result):
+        return {'result': result, 'error': None, 'id': 0}
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in_ipa(monkeypatch):
+    server = HTTPServer(('127.0.0.1', 0), StandInIpaHandler)
+    server.logins = 0
+    server.calls = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    with open(CONFIG.DIRECTORY_USER_CONFIG, 'w') as user_config:
+        user_config.write(
+            'IPA_BACKEND=jsonrpc\n'
+            'IPA_SERVER=http://127.0.0.1:{}\n'.format(server.server_address[1])
+        )
+    monkeypatch.setattr(
+        utils, 'directory_config', lambda: {CONFIG.PASSWORD_KEY: 'secret'}
+    )
+    monkeypatch.setattr(ipa_rpc, '_session', None)
+    monkeypatch.setattr(ipa_rpc, '_labels_by_object', {})
+    monkeypatch.setattr(ipa_rpc, '_metadata_by_object', {})
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_backend_is_only_enabled_by_user_config(stand_in_ipa, monkeypatch):
+    assert ipa_rpc.enabled()
+
+    monkeypatch.setattr(CONFIG, 'DIRECTORY_USER_CONFIG', '/does/not/exist')
+    assert not ipa_rpc.enabled()
+
+
+def test_ipa_find_output_is_parsed_as_for_the_cli(stand_in_ipa):
+    result = ipa_utils.ipa_find('user-find', ['--login=fred'])
+
+    assert len(result) == 1
+    fred = result[0]
+    assert fred['User login'] == ['fred']
+    assert fred['Last name'] == ['Flintstone']
+    assert fred['Member of groups'] == ['clusterusers', 'quarry']
+    assert fred['Account disabled'] == ['False']
+
+    find_call = stand_in_ipa.calls[0]
+    assert find_call['method'] == 'user_find'
+    assert find_call['params'] == \
+        [[], {'uid': 'fred', 'all': True, 'sizelimit': '0'}]
+
+
+def test_session_is_reused_between_commands(stand_in_ipa):
+    ipa_utils.ipa_find('user-find')
+    ipa_utils.ipa_find('user-find', ['--login=fred'])
+
+    assert stand_in_ipa.logins == 1
+
+
+def test_find_matching_nothing_fails_unless_allowed(stand_in_ipa):
+    with pytest.raises(IpaRunError):
+        ipa_utils.ipa_find('user-find', ['--login=barney'])
+
+    result = ipa_utils.ipa_find(
+        'user-find', ['--login=barney'], error_allowed='0 users matched'
+    )
+    assert result == [{}]
+
+
+def test_errors_are_reported_as_ipa_run_errors(stand_in_ipa):
+    with pytest.raises(IpaRunError) as ex:
+        ipa_utils.ipa_run('user-show', ['barney'], record=False)
+
+    assert 'ipa: ERROR: barney: user not found' in str(ex.value)
+
+
+def test_ssh_key_options_are_sent_as_ipa_params(stand_in_ipa):
+    ipa_rpc.run(
+        'user-mod', ['fred', '--sshpubkey=ssh-rsa AAAAB3Nza fred@host']
+    )
+    ipa_rpc.run('user-mod', ['fred', '--sshpubkey='])
+
+    user_mod_options = [
+        call['params'][1] for call in stand_in_ipa.calls
+        if call['method'] == 'user_mod'
+    ]
+    assert [options['ipasshpubkey'] for options in user_mod_options] == \
+        ['ssh-rsa AAAAB3Nza fred@host', '']
+    assert not any('sshpubkey' in options for options in user_mod_options)
+
+
+def test_cli_args_take_values_unless_flags():
+    assert ipa_rpc._parse_cli_args([
+        'fred', '--random', '--gecos', '--not an option', '--all',
+        '--sizelimit', '0',
+    ]) == (
+        ['fred'],
+        {'random': True, 'gecos': '--not an option', 'all': True,
+         'sizelimit': '0'},
+    )
+
+
+def test_find_fields_are_found_from_metadata(stand_in_ipa):
+    assert ipa_rpc.find_fields('user-find') == (
+        {'User login', 'First name', 'Last name', 'UID', 'GID',
+         'Account disabled'},
+        {'Member of groups'},
+    )
+
+
+def test_user_list_does_not_fetch_all_fields(stand_in_ipa, mocker):
+    mocker.patch.object(user, '_groups_by_gid', return_value={})
+
+    result = click_run(
+        directory.directory, ['user', 'list', '--format', 'jsonl']
+    )
+
+    [user_find] = [
+        call for call in stand_in_ipa.calls if call['method'] == 'user_find'
+    ]
+    options = user_find['params'][1]
+    assert 'all' not in options
+    assert options['no_members'] is False
+    assert json.loads(result.output) == {
+        'User login': ['fred'],
+        'Full name': ['Fred Flintstone'],
+        'UID': ['1001'],
+        'GID': ['1001'],
+        'Primary group': [],
+        'Secondary groups': ['clusterusers', 'quarry'],
+    }
+
+
+def test_batch_runs_commands_in_single_request(stand_in_ipa):
+    results = ipa_rpc.run_batch([
+        ('user-add', ['barney', '--first', 'Barney', '--last', 'Rubble']),
+        ('user-add', ['fred', '--first', 'Fred', '--last', 'Flintstone']),
+    ])
+
+    assert [result.returncode for result in results] == [0, 2]
+    assert 'User login: barney' in results[0].stdout
+    assert 'already exists' in results[1].stderr
+
+    batch_calls = [
+        call for call in stand_in_ipa.calls if call['method'] == 'batch'
+    ]
+    assert len(batch_calls) == 1
+    assert [call['method'] for call in batch_calls[0]['params'][0]] == \
+        ['user_add', 'user_add']
+
+
+def test_batch_only_runs_further_user_add_steps_for_added_users(
+        stand_in_ipa):
+    results = ipa_rpc.run_batch([
+        ('user-add',
+         ['barney', '--first', 'B', '--last', 'R', '--group', 'quarry']),
+        ('user-add',
+         ['fred', '--first', 'F', '--last', 'F', '--group', 'quarry']),
+        ('user-add',
+         ['wilma', '--first', 'W', '--last', 'F', '--group', 'quarry']),
+    ])
+
+    # Wilma is added, but is then deleted again as adding to the group fails.
+    assert [result.returncode for result in results] == [0, 2, 1]
+
+    methods = [call['method'] for call in stand_in_ipa.calls]
+    follow_up_batch = [
+        call for call in stand_in_ipa.calls if call['method'] == 'batch'
+    ][1]
+    assert [
+        (call['method'], call['params'][1]['user'])
+        for call in follow_up_batch['params'][0]
+    ] == [('group_add_member', 'barney'), ('group_add_member', 'wilma')]
+    assert methods[-1] == 'user_del'
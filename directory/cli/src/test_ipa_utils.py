@@ -26,6 +26,7 @@
 #==============================================================================
 
 import pytest
+import threading
 
 import ipa_utils
 from config import CONFIG
@@ -117,6 +118,30 @@ def test_parse_find_output_reads_random_password_as_single_value():
     ]
 
 
+def test_parse_find_output_returns_single_empty_dict_for_empty_output():
+    assert ipa_utils.parse_find_output('') == [{}]
+
+
+def test_iter_find_output_yields_items_before_reading_all_lines():
+    lines = iter(ipa_output.splitlines(keepends=True))
+    items = ipa_utils.iter_find_output(lines)
+
+    first = next(items)
+
+    assert first['Full name'] == ['Administrator']
+    # The remaining item has not been read yet.
+    assert any('Alces Flight' in line for line in lines)
+
+
+def test_parse_find_output_joins_many_continuation_lines():
+    parts = ['part{}'.format(i) for i in range(1000)]
+    output = 'SSH public key: ' + '\n'.join(parts) + '\n'
+
+    result = ipa_utils.parse_find_output(output)
+
+    assert result[0]['SSH public key'] == [' '.join(parts)]
+
+
 def test_ipa_run_logs_commands_by_default(monkeypatch):
     mock_original_command(monkeypatch, 'command 1')
     ipa_utils.ipa_run('group-add', ['flintstones'])
@@ -165,6 +190,117 @@ def test_ipa_run_does_not_record_erroring_commands(
             assert lines.strip() == ''
 
 
+def test_ipa_find_iter_yields_item_for_each_streamed_entry(
+        monkeypatch, tmpdir):
+    mock_wrapper_script(monkeypatch, tmpdir, ipa_output)
+
+    items = ipa_utils.ipa_find_iter('user-find')
+
+    assert [item['User login'] for item in items] == [
+        ['admin'], ['flightuser']
+    ]
+
+
+def test_ipa_find_iter_raises_before_yielding_for_failed_command(
+        monkeypatch, tmpdir):
+    mock_wrapper_script(
+        monkeypatch, tmpdir, nothing_found_output,
+        stderr='ipa: ERROR: no matches', exit_code=1
+    )
+
+    with pytest.raises(IpaRunError) as error:
+        next(ipa_utils.ipa_find_iter('user-find', ['--login=fred']))
+
+    assert 'no matches' in str(error.value)
+
+
+def test_ipa_find_iter_allows_given_error(monkeypatch, tmpdir):
+    mock_wrapper_script(
+        monkeypatch, tmpdir, nothing_found_output, exit_code=1
+    )
+
+    items = ipa_utils.ipa_find_iter(
+        'user-find', ['--login=fred'], error_allowed='0 users matched'
+    )
+
+    assert list(items) == [{}]
+
+
+def test_run_concurrently_runs_functions_at_once():
+    # Each function can only complete once both are running.
+    barrier = threading.Barrier(2, timeout=5)
+
+    results = ipa_utils.run_concurrently([
+        lambda: barrier.wait() is not None and 'first',
+        lambda: barrier.wait() is not None and 'second',
+    ])
+
+    assert results == ['first', 'second']
+
+
+def test_run_concurrently_raises_first_error_in_order():
+    def fail(message):
+        raise IpaRunError(message)
+
+    with pytest.raises(IpaRunError) as error:
+        ipa_utils.run_concurrently([
+            lambda: 'ok',
+            lambda: fail('first'),
+            lambda: fail('second'),
+        ])
+
+    assert str(error.value).strip() == 'first'
+
+
+def test_run_concurrently_can_be_limited_to_one_at_a_time():
+    with open(CONFIG.DIRECTORY_USER_CONFIG, 'w') as user_config:
+        user_config.write('IPA_MAX_WORKERS=1\n')
+
+    threads = ipa_utils.run_concurrently([
+        threading.current_thread, threading.current_thread
+    ])
+
+    assert threads == [threading.main_thread()] * 2
+
+
+def test_ipa_find_concurrently_returns_results_in_order(mocker):
+    mocker.patch(
+        'ipa_utils.ipa_find',
+        side_effect=lambda command, args, **kwargs: [{'args': args}]
+    )
+
+    results = ipa_utils.ipa_find_concurrently(
+        [('group-find', ['--private']), ('group-find', [])],
+        all_fields=False
+    )
+
+    assert results == [[{'args': ['--private']}], [{'args': []}]]
+
+
+nothing_found_output = """---------------
+0 users matched
+---------------
+----------------------------
+Number of entries returned 0
+----------------------------
+"""
+
+
+# Replace the IPA wrapper script with one giving the passed output.
+def mock_wrapper_script(
+        monkeypatch, tmpdir, stdout, stderr='', exit_code=0):
+    tmpdir.join('stdout').write(stdout)
+    tmpdir.join('stderr').write(stderr)
+    script = tmpdir.join('ipa_wrapper')
+    script.write(
+        '#!/bin/sh\ncat "{}"\ncat "{}" >&2\nexit {}\n'.format(
+            tmpdir.join('stdout'), tmpdir.join('stderr'), exit_code
+        )
+    )
+    script.chmod(0o755)
+    monkeypatch.setattr(CONFIG, 'IPA_WRAPPER_SCRIPT_PATH', script.strpath)
+
+
 def mock_original_command(monkeypatch, original_command):
     def mock_result():
         return original_command
@@ -0,0 +1,188 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import datetime
+import os
+import subprocess
+
+import pytest
+
+import appender
+import kerberos
+import utils
+from config import CONFIG
+
+
+def _klist_output(expires, principal='admin@EXAMPLE.COM'):
+    return '\n'.join([
+        'Ticket cache: KEYRING:persistent:0:0',
+        'Default principal: {}'.format(principal),
+        '',
+        'Valid starting       Expires              Service principal',
+        '01/01/2019 10:00:00  {}  krbtgt/EXAMPLE.COM@EXAMPLE.COM'.format(
+            expires.strftime('%m/%d/%Y %H:%M:%S')
+        ),
+    ]) + '\n'
+
+
+@pytest.fixture
+def mock_kerberos(monkeypatch, mocker):
+    monkeypatch.setattr(kerberos, '_usable_until', None)
+    monkeypatch.setenv('KRB5CCNAME', 'FILE:/tmp/krb5cc_default')
+    mocker.patch.object(
+        utils, 'directory_config', return_value={'IPAPASSWORD': 'secret'}
+    )
+    commands = []
+    tickets = []
+    kinits = []
+
+    def run(command, **kwargs):
+        commands.append(command[0])
+        if command[0] == 'kinit':
+            kinits.append((command, os.environ.get('KRB5CCNAME')))
+            tickets.append(_klist_output(
+                datetime.datetime.now() + datetime.timedelta(hours=24),
+                principal=command[-1] + '@EXAMPLE.COM'
+            ))
+        stdout = tickets[-1] if tickets else ''
+        return subprocess.CompletedProcess(command, 0 if stdout else 1, stdout)
+
+    monkeypatch.setattr(subprocess, 'run', run)
+    return commands, tickets, kinits
+
+
+def test_existing_ticket_is_reused(mock_kerberos):
+    commands, tickets, _ = mock_kerberos
+    tickets.append(_klist_output(
+        datetime.datetime.now() + datetime.timedelta(hours=1)
+    ))
+
+    kerberos.ensure_ticket()
+    kerberos.ensure_ticket()
+
+    assert commands == ['klist']
+
+
+def test_ticket_obtained_when_none_in_cache(mock_kerberos):
+    commands, _, _ = mock_kerberos
+
+    kerberos.ensure_ticket()
+    kerberos.ensure_ticket()
+
+    assert commands == ['klist', 'kinit', 'klist']
+
+
+def test_ticket_renewed_when_nearly_expired(mock_kerberos):
+    commands, tickets, _ = mock_kerberos
+    tickets.append(_klist_output(
+        datetime.datetime.now() + datetime.timedelta(minutes=1)
+    ))
+
+    kerberos.ensure_ticket()
+
+    assert commands == ['klist', 'kinit', 'klist']
+
+
+def test_ticket_for_other_principal_is_not_used(mock_kerberos):
+    commands, tickets, _ = mock_kerberos
+    tickets.append(_klist_output(
+        datetime.datetime.now() + datetime.timedelta(hours=1),
+        principal='fred@EXAMPLE.COM'
+    ))
+
+    kerberos.ensure_ticket()
+
+    assert commands == ['klist', 'kinit', 'klist']
+
+
+def test_ticket_obtained_from_keytab_into_private_ccache(mock_kerberos):
+    _, _, kinits = mock_kerberos
+    with open(CONFIG.DIRECTORY_USER_CONFIG, 'w') as user_config:
+        user_config.write(
+            'KRB5_KEYTAB=/opt/directory/etc/umanager.keytab\n'
+            'KRB5_PRINCIPAL=umanager\n'
+        )
+
+    kerberos.ensure_ticket()
+
+    [(kinit_command, ccache)] = kinits
+    assert kinit_command == [
+        'kinit', '-k', '-t', '/opt/directory/etc/umanager.keytab', 'umanager'
+    ]
+    assert ccache.startswith('FILE:' + CONFIG.DIRECTORY_KRB5_CCACHE_DIR)
+
+
+def test_private_ccache_persists_for_keytab_and_principal(mock_kerberos):
+    path = kerberos._private_ccache_path('/etc/umanager.keytab', 'umanager')
+
+    # The same cache is used by later commands, so its ticket is reused...
+    assert kerberos._private_ccache_path(
+        '/etc/umanager.keytab', 'umanager'
+    ) == path
+    # ...but not for another principal or keytab.
+    assert kerberos._private_ccache_path(
+        '/etc/umanager.keytab', 'admin'
+    ) != path
+    assert kerberos._private_ccache_path(
+        '/etc/other.keytab', 'umanager'
+    ) != path
+
+
+def test_private_ccache_is_only_readable_by_owner(mock_kerberos, mocker):
+    with open(CONFIG.DIRECTORY_USER_CONFIG, 'w') as user_config:
+        user_config.write(
+            'KRB5_KEYTAB=/opt/directory/etc/umanager.keytab\n'
+            'KRB5_PRINCIPAL=umanager\n'
+        )
+
+    def kinit(principal, keytab=None):
+        ccache_path = os.environ['KRB5CCNAME'][len('FILE:'):]
+        with open(ccache_path, 'w') as ccache:
+            ccache.write('ticket')
+        os.chmod(ccache_path, 0o644)
+    mocker.patch.object(kerberos, '_kinit', side_effect=kinit)
+
+    kerberos.ensure_ticket()
+
+    ccache_path = os.environ['KRB5CCNAME'][len('FILE:'):]
+    assert os.stat(ccache_path).st_mode & 0o777 == 0o600
+    assert os.stat(CONFIG.DIRECTORY_KRB5_CCACHE_DIR).st_mode & 0o777 == 0o700
+
+
+def test_private_ccache_is_locked_while_renewing(mock_kerberos, mocker):
+    with open(CONFIG.DIRECTORY_USER_CONFIG, 'w') as user_config:
+        user_config.write(
+            'KRB5_KEYTAB=/opt/directory/etc/umanager.keytab\n'
+            'KRB5_PRINCIPAL=umanager\n'
+        )
+    locked = mocker.spy(appender, 'locked')
+
+    kerberos.ensure_ticket()
+
+    ccache_path = os.environ['KRB5CCNAME'][len('FILE:'):]
+    locked.assert_called_once_with(ccache_path + '.lock')
+
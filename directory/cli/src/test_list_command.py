@@ -0,0 +1,184 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import click
+from collections import OrderedDict
+import json
+import pytest
+
+import list_command
+from list_command import field_with_same_name, field_with_name
+
+
+FIELD_CONFIGS = OrderedDict([
+    ('Group name', field_with_same_name),
+    ('GID', field_with_same_name),
+    ('Member users', field_with_name('Member users')),
+])
+
+ITEM_DICTS = [
+    {'Group name': ['flintstones'], 'GID': ['1000'],
+     'Member users': ['fred', 'wilma']},
+    {'Group name': ['rubbles'], 'GID': ['1001']},
+]
+
+
+def do_with_format(mocker, output_format):
+    mocker.patch(
+        'ipa_utils.ipa_find_iter', return_value=iter(ITEM_DICTS)
+    )
+    list_command.do(
+        ipa_find_command='group-find',
+        field_configs=FIELD_CONFIGS,
+        output_format=output_format
+    )
+
+
+def test_do_outputs_json(mocker, capsys):
+    do_with_format(mocker, 'json')
+
+    assert json.loads(capsys.readouterr().out) == [
+        {'Group name': ['flintstones'], 'GID': ['1000'],
+         'Member users': ['fred', 'wilma']},
+        {'Group name': ['rubbles'], 'GID': ['1001'], 'Member users': []},
+    ]
+
+
+def test_do_outputs_json_for_no_items(mocker, capsys):
+    mocker.patch('ipa_utils.ipa_find_iter', return_value=iter([]))
+    list_command.do(
+        ipa_find_command='group-find',
+        field_configs=FIELD_CONFIGS,
+        output_format='json'
+    )
+
+    assert json.loads(capsys.readouterr().out) == []
+
+
+def test_do_outputs_jsonl_line_for_each_item(mocker, capsys):
+    do_with_format(mocker, 'jsonl')
+
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(line)['Group name'] for line in lines] == [
+        ['flintstones'], ['rubbles']
+    ]
+
+
+def test_do_outputs_csv(mocker, capsys):
+    do_with_format(mocker, 'csv')
+
+    assert capsys.readouterr().out == (
+        'Group name,GID,Member users\n'
+        'flintstones,1000,"fred, wilma"\n'
+        'rubbles,1001,\n'
+    )
+
+
+def test_do_outputs_tsv(mocker, capsys):
+    do_with_format(mocker, 'tsv')
+
+    assert capsys.readouterr().out.splitlines()[1] == \
+        'flintstones\t1000\tfred, wilma'
+
+
+def find_iter_call_for(mocker, **kwargs):
+    mock_find_iter = mocker.patch(
+        'ipa_utils.ipa_find_iter', return_value=iter(ITEM_DICTS)
+    )
+    list_command.do(
+        ipa_find_command='group-find',
+        output_format='jsonl',
+        **kwargs
+    )
+    return mock_find_iter.call_args
+
+
+@pytest.fixture
+def jsonrpc_find_fields(mocker):
+    mocker.patch('ipa_rpc.enabled', return_value=True)
+    mocker.patch('ipa_rpc.find_fields', return_value=(
+        {'Group name', 'Description', 'GID'}, {'Member users'}
+    ))
+
+
+def test_do_does_not_fetch_all_fields_when_defaults_are_enough(
+        mocker, jsonrpc_find_fields):
+    call = find_iter_call_for(
+        mocker, field_configs=FIELD_CONFIGS, fields='Group name,GID'
+    )
+
+    assert call == mocker.call('group-find', [], all_fields=False)
+
+
+def test_do_fetches_only_members_when_these_also_needed(
+        mocker, jsonrpc_find_fields):
+    call = find_iter_call_for(mocker, field_configs=FIELD_CONFIGS)
+
+    assert call == mocker.call('group-find', ['--members'], all_fields=False)
+
+
+def test_do_fetches_only_primary_keys_when_only_these_needed(mocker):
+    call = find_iter_call_for(
+        mocker, field_configs=FIELD_CONFIGS, fields='group name'
+    )
+
+    assert call == mocker.call('group-find', ['--pkey-only'], all_fields=False)
+
+
+def test_do_fetches_all_fields_when_non_default_field_needed(mocker):
+    call = find_iter_call_for(mocker, field_configs=FIELD_CONFIGS)
+
+    assert call == mocker.call('group-find', [], all_fields=True)
+
+
+def test_do_fetches_fields_required_by_generators(mocker):
+    field_configs = OrderedDict([
+        ('Group name', field_with_same_name),
+        ('Users', field_with_name('Member users')),
+    ])
+
+    call = find_iter_call_for(mocker, field_configs=field_configs)
+
+    assert call == mocker.call('group-find', [], all_fields=True)
+
+
+def test_do_displays_only_selected_fields(mocker, capsys):
+    find_iter_call_for(
+        mocker, field_configs=FIELD_CONFIGS, fields='GID, Group name'
+    )
+
+    lines = capsys.readouterr().out.splitlines()
+    assert list(json.loads(lines[0], object_pairs_hook=OrderedDict)) == [
+        'GID', 'Group name'
+    ]
+
+
+def test_do_rejects_unknown_fields(mocker):
+    with pytest.raises(click.BadParameter):
+        find_iter_call_for(
+            mocker, field_configs=FIELD_CONFIGS, fields='Group name,Colour'
+        )
@@ -0,0 +1,144 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import click
+import csv
+import gzip
+import os
+import sys
+
+import directory
+import log_index
+import log_search
+import test_utils
+from appliance_cli.testing_utils import click_run
+from config import CONFIG
+
+
+def setUpModule():
+    test_utils.reload_in_advanced_mode()
+
+
+def _log(*rows):
+    with open(CONFIG.DIRECTORY_LOG, 'a', newline='') as log_file:
+        csv.writer(log_file).writerows(rows)
+
+
+def _commands(**conditions):
+    return [
+        command for _, _, command, _ in
+        log_index.search(directory.directory, **conditions)
+    ]
+
+
+def test_search_finds_commands_changing_entity():
+    _log(
+        ['2019-01-01 10:00:00', '{}', 'user create fred Fred Flintstone',
+         'Success'],
+        ['2019-01-01 11:00:00', '{}', 'group create flintstones', 'Success'],
+        ['2019-01-01 12:00:00', '{}', 'group member add flintstones fred',
+         'Success'],
+        ['2019-01-01 13:00:00', '{}', 'user create', 'login: Fred',
+         'first: Fred'],
+    )
+
+    assert _commands(entity='fred') == [
+        'user create fred Fred Flintstone',
+        'group member add flintstones fred',
+        'user create',
+    ]
+
+
+def test_search_filters_by_time_and_outcome():
+    _log(
+        ['2019-01-01 10:00:00', '{}', 'user delete fred', 'Success'],
+        ['2019-01-02 10:00:00', '{}', 'user delete barney',
+         'Failure: ClickException: barney: user not found'],
+        ['2019-01-03 10:00:00', '{}', 'user delete wilma', 'Success'],
+    )
+
+    assert _commands(since='2019-01-02 00:00:00') == [
+        'user delete barney', 'user delete wilma'
+    ]
+    assert _commands(until='2019-01-02 00:00:00') == ['user delete fred']
+    assert log_index.search(directory.directory, outcome='failure') == [(
+        '2019-01-02 10:00:00', 'Failure', 'user delete barney',
+        'ClickException: barney: user not found'
+    )]
+
+
+def test_index_only_reads_appended_and_rotated_log(mocker):
+    _log(['2019-01-01 10:00:00', '{}', 'user delete fred', 'Success'])
+    assert _commands(entity='fred') == ['user delete fred']
+
+    # Rotate the log, after more has been appended to it.
+    _log(['2019-01-02 10:00:00', '{}', 'user delete fred', 'Failure'])
+    rotated_path = CONFIG.DIRECTORY_LOG + '.20190103000000000000'
+    os.rename(CONFIG.DIRECTORY_LOG, rotated_path)
+    _log(['2019-01-03 10:00:00', '{}', 'user delete fred', 'Success'])
+    with open(rotated_path, 'rb') as rotated_file, \
+            gzip.open(rotated_path + '.gz', 'wb') as compressed_file:
+        compressed_file.write(rotated_file.read())
+    os.remove(rotated_path)
+
+    parse_entry = mocker.spy(log_index, '_parse_entry')
+    outcomes = [
+        outcome for _, outcome, _, _ in
+        log_index.search(directory.directory, entity='fred')
+    ]
+
+    assert outcomes == ['Success', 'Failure', 'Success']
+    assert parse_entry.call_count == 2
+
+
+def test_log_search_command_displays_matching_commands():
+    _log(['2019-01-01 10:00:00', '{}', 'user delete fred', 'Success'])
+
+    result = click_run(
+        directory.directory, ['log', 'search', '--until', '2019-01-01']
+    )
+
+    assert 'user delete fred' in result.output
+
+
+def test_log_search_command_rejects_invalid_time():
+    result = click_run(
+        directory.directory, ['log', 'search', '--since', 'yesterday']
+    )
+
+    assert result.exit_code != 0
+    assert 'YYYY-MM-DD' in result.output
+
+
+def test_log_commands_are_not_available_in_sandbox(monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['directory', 'sandbox'])
+    group = click.Group()
+
+    log_search.add_commands(group)
+
+    assert 'log' not in group.commands
+
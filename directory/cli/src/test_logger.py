@@ -0,0 +1,114 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import gzip
+import json
+import os
+import shutil
+
+import pytest
+
+import directory
+import logger
+import test_utils
+from appliance_cli.testing_utils import click_run
+from config import CONFIG
+
+
+def setUpModule():
+    test_utils.reload_in_advanced_mode()
+
+
+def _write_user_config(*lines):
+    with open(CONFIG.DIRECTORY_USER_CONFIG, 'w') as user_config:
+        user_config.writelines(line + '\n' for line in lines)
+
+
+def _json_log_entries():
+    with open(CONFIG.DIRECTORY_JSON_LOG) as log_file:
+        return [json.loads(line) for line in log_file]
+
+
+def test_commands_logged_as_csv_by_default():
+    click_run(directory.directory, ['record', 'compact'])
+
+    with open(CONFIG.DIRECTORY_LOG) as log_file:
+        assert 'record compact' in log_file.read()
+
+
+def test_commands_logged_with_typed_fields_as_jsonl(monkeypatch):
+    monkeypatch.setattr(logger, '_env_vars', {'FC_TEST': 'value'})
+    _write_user_config('LOG_FORMAT=jsonl')
+
+    click_run(directory.directory, ['record', 'compact'])
+
+    access, entry = _json_log_entries()
+    assert access['command'] == 'access'
+    assert entry['command'] == 'record compact'
+    assert entry['outcome'] == 'Failure'
+    assert entry['error_class'] == 'ClickException'
+    assert entry['error'] == 'No Directory record found; nothing to compact.'
+    assert isinstance(entry['duration'], float)
+    assert entry['env'] == {'FC_TEST': 'value'}
+
+
+def test_log_rotated_and_compressed_once_large_enough():
+    _write_user_config(
+        'LOG_FORMAT=jsonl', 'LOG_MAX_BYTES=1', 'LOG_BACKUP_COUNT=2'
+    )
+
+    for _ in range(3):
+        logger.write_to_log(['access', 'Success'])
+
+    rotated_logs = logger.rotated_logs(CONFIG.DIRECTORY_JSON_LOG)
+    assert len(rotated_logs) == 2
+    with gzip.open(rotated_logs[-1], 'rt') as rotated_log:
+        assert json.loads(rotated_log.read())['command'] == 'access'
+
+
+def test_log_rotated_at_default_size_unless_configured():
+    assert logger._configured_settings() == (
+        logger.CSV, logger.DEFAULT_MAX_BYTES, None
+    )
+
+    _write_user_config('LOG_MAX_BYTES=0')
+    assert logger._configured_settings() == (logger.CSV, 0, None)
+
+
+def test_compressed_log_only_appears_once_complete(tmpdir, mocker):
+    log_dir = tmpdir.mkdir('logs')
+    rotated_path = log_dir.join('log.jsonl.00000000000000000001').strpath
+    with open(rotated_path, 'w') as rotated_file:
+        rotated_file.write('{"command": "access"}\n')
+    mocker.patch.object(shutil, 'copyfileobj', side_effect=OSError)
+
+    with pytest.raises(OSError):
+        logger._compress(rotated_path, None)
+
+    # The rotated log is kept, with no partly written compressed log.
+    assert os.listdir(log_dir.strpath) == ['log.jsonl.00000000000000000001']
+
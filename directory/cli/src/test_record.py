@@ -0,0 +1,138 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import glob
+
+import pytest
+
+import directory
+import record
+import test_utils
+from appliance_cli.testing_utils import click_run
+from config import CONFIG
+
+
+def setUpModule():
+    test_utils.reload_in_advanced_mode()
+
+
+@pytest.fixture
+def simple_mode():
+    test_utils.reload_in_simple_mode()
+    yield
+    test_utils.reload_in_advanced_mode()
+
+
+def _compact(*lines):
+    return record.compact_lines(directory.directory, list(lines))
+
+
+def test_entities_created_then_deleted_are_dropped():
+    assert _compact(
+        'user create temp --first a --last user',
+        'group create mygroup',
+        'group member add mygroup temp someone',
+        'user modify temp --shell /bin/sh',
+        'user delete temp',
+        'user delete olduser',
+    ) == [
+        'group create mygroup',
+        'group member add mygroup someone',
+        'user delete olduser',
+    ]
+
+
+def test_modifications_are_folded_together():
+    assert _compact(
+        'user create someone --first a --last user',
+        'user modify someone --shell /bin/sh',
+        'user modify someone --first b --new-password',
+        'user modify existing --shell /bin/sh',
+        'user modify existing --email someone@example.com',
+        'user disable existing',
+        'user enable existing',
+    ) == [
+        'user create someone --first b --last user --shell /bin/sh',
+        'user modify someone --new-password',
+        'user modify existing --shell /bin/sh --email someone@example.com',
+        'user enable existing',
+    ]
+
+
+def test_unchanged_fields_are_kept_in_simple_mode(simple_mode):
+    assert _compact(
+        'user create bob Bob Smith bob@example.com',
+        "user modify bob '' '' new@example.com ''",
+        "user modify bob '' '' '' 'ssh-rsa AAAAB3Nza bob@host'",
+    ) == [
+        'user create bob Bob Smith new@example.com',
+        "user modify bob '' '' '' 'ssh-rsa AAAAB3Nza bob@host'",
+    ]
+
+
+def test_modifications_are_folded_together_in_simple_mode(simple_mode):
+    assert _compact(
+        "user modify existing Fred '' '' ''",
+        "user modify existing '' '' fred@example.com ''",
+    ) == [
+        "user modify existing Fred '' fred@example.com ''",
+    ]
+
+
+def test_membership_changes_are_netted_out():
+    assert _compact(
+        'user create someone --first a --last user --group staff',
+        'group member add admins someone existing',
+        'group member remove staff someone',
+        'group member remove admins existing',
+        'group member remove admins former',
+        'group member add admins former',
+    ) == [
+        'user create someone --first a --last user',
+        'group member add admins someone',
+    ]
+
+
+def test_compact_command_rewrites_record_keeping_backup(tmpdir):
+    original_lines = [
+        'group create mygroup\n',
+        'group modify mygroup --desc something\n',
+    ]
+    with open(CONFIG.DIRECTORY_RECORD, 'w') as record_file:
+        record_file.writelines(original_lines)
+
+    result = click_run(directory.directory, ['record', 'compact'])
+
+    assert 'from 2 to 1 commands' in result.output
+    with open(CONFIG.DIRECTORY_RECORD) as record_file:
+        assert record_file.readlines() == [
+            'group create mygroup --desc something\n'
+        ]
+    backups = glob.glob(CONFIG.DIRECTORY_RECORD + '.*.bak')
+    assert len(backups) == 1
+    with open(backups[0]) as backup_file:
+        assert backup_file.readlines() == original_lines
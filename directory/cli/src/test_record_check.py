@@ -0,0 +1,89 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import click
+import pytest
+
+import directory
+import ipa_utils
+import record_check
+import test_utils
+
+
+def setUpModule():
+    test_utils.reload_in_advanced_mode()
+
+
+@pytest.fixture
+def existing_ids(mocker):
+    def ipa_find(ipa_command, *args, **kwargs):
+        if ipa_command == 'user-find':
+            return [{'User login': ['alice'], 'UID': ['1001']}]
+        return [{'Group name': ['staff'], 'GID': ['2001']}]
+
+    return mocker.patch.object(ipa_utils, 'ipa_find', side_effect=ipa_find)
+
+
+def _check(*lines):
+    with click.Context(directory.directory):
+        return record_check.check(directory.directory, list(enumerate(lines)))
+
+
+def test_all_invalid_lines_are_reported(existing_ids):
+    problems = _check(
+        'user create bob --first Bob --last Jones',
+        'user craete carol --first Carol --last Jones',
+        'user create dave --first Dave',
+        'group create admins',
+        'user modify bob --shel /bin/sh',
+    )
+
+    assert [line_number for line_number, _, _ in problems] == [1, 2, 3, 4]
+    assert 'No such command' in problems[0][2]
+    assert 'last' in problems[1][2]
+    assert 'restricted group' in problems[2][2]
+    # Nothing needed finding from IPA for these lines.
+    assert existing_ids.call_count == 0
+
+
+def test_id_collisions_are_found_from_single_index(existing_ids):
+    problems = _check(
+        'user create bob --first Bob --last Jones --uid 1001',
+        'user create alice --first Alice --last Smith --uid 1001',
+        'group create devs --gid 3001',
+        'group create ops --gid 3001',
+        'group delete devs',
+        'group create web --gid 3001',
+    )
+
+    assert problems == [
+        (0, 'user create bob --first Bob --last Jones --uid 1001',
+         'UID 1001 is already used by user alice'),
+        (3, 'group create ops --gid 3001',
+         'GID 3001 is already used by group devs'),
+    ]
+    assert existing_ids.call_count == 2
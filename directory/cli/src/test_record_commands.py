@@ -0,0 +1,75 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import directory
+import record_commands
+import test_utils
+
+
+def setUpModule():
+    test_utils.reload_in_advanced_mode()
+
+
+def _dependencies(*lines):
+    commands = [
+        record_commands.parse(directory.directory, line_number, line)
+        for line_number, line in enumerate(lines)
+    ]
+    return record_commands.dependencies(commands)
+
+
+def test_commands_for_different_entities_are_independent():
+    assert _dependencies(
+        'user create first --first a --last user --uid 2001',
+        'user create second --first a --last user --uid 2002',
+        'group modify mygroup --desc something',
+    ) == [set(), set(), set()]
+
+
+def test_membership_depends_on_entities_existing():
+    assert _dependencies(
+        'user create first --first a --last user --uid 2001',
+        'group create mygroup --gid 3001',
+        'group member add mygroup first',
+        'group member add mygroup second',
+        'user delete first',
+    ) == [set(), set(), {0, 1}, {1}, {0, 2}]
+
+
+def test_creates_leaving_ids_to_ipa_are_run_in_order():
+    assert _dependencies(
+        'user create first --first a --last user',
+        'group create mygroup',
+    ) == [set(), {0}]
+
+
+def test_unknown_commands_are_run_alone():
+    assert _dependencies(
+        'group modify mygroup --desc something',
+        'not a command',
+        'user modify first --shell /bin/sh',
+    ) == [set(), {0}, {1}]
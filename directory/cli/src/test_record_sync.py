@@ -0,0 +1,122 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import click
+import pytest
+
+import directory
+import ipa_utils
+import record_sync
+import test_utils
+
+
+def setUpModule():
+    test_utils.reload_in_advanced_mode()
+
+
+USERS = [
+    {
+        'User login': ['alice'],
+        'First name': ['Alice'],
+        'Last name': ['Smith'],
+        'Account disabled': ['False'],
+    },
+]
+
+GROUPS = [
+    {
+        'Group name': ['staff'],
+        'Description': ['Staff'],
+        'Member users': ['alice'],
+    },
+]
+
+
+@pytest.fixture
+def directory_snapshot(mocker):
+    def ipa_find(ipa_command, *args, **kwargs):
+        return {'user-find': USERS, 'group-find': GROUPS}.get(ipa_command, [])
+
+    return mocker.patch.object(ipa_utils, 'ipa_find', side_effect=ipa_find)
+
+
+def _plan(*lines):
+    with click.Context(directory.directory):
+        return record_sync.plan(directory.directory, list(enumerate(lines)))
+
+
+def test_commands_already_satisfied_are_skipped(directory_snapshot):
+    sync_plan = _plan(
+        'user create alice --first Alice --last Smith',
+        'group create staff --desc Staff',
+        'group member add staff alice',
+        'user enable alice',
+        'user delete nobody',
+    )
+
+    assert sync_plan.lines == []
+    assert sync_plan.skipped == 5
+    assert sync_plan.conflicts == []
+
+
+def test_only_changes_still_needed_are_run(directory_snapshot):
+    sync_plan = _plan(
+        'user create bob --first Bob --last Jones',
+        'group member add staff alice bob',
+        'user modify alice --last Jones',
+        'user modify alice --last Jones',
+        'group create admins2',
+        'user create alice --first Alice --last Jones --group admins2',
+    )
+
+    assert sync_plan.lines == [
+        (0, 'user create bob --first Bob --last Jones'),
+        (1, 'group member add staff bob'),
+        (2, 'user modify alice --last Jones'),
+        (4, 'group create admins2'),
+        (5, 'group member add admins2 alice'),
+    ]
+    assert sync_plan.skipped == 1
+
+
+def test_creates_differing_from_existing_entities_conflict(
+        directory_snapshot
+):
+    sync_plan = _plan('group create staff --desc Others')
+
+    assert sync_plan.lines == []
+    assert sync_plan.conflicts == [(
+        0, 'group create staff --desc Others',
+        'group staff already exists with a different Description'
+    )]
+
+
+def test_directory_found_once_for_all_lines(directory_snapshot):
+    _plan(*['user create user{} --first a --last b'.format(number)
+            for number in range(50)])
+
+    assert directory_snapshot.call_count == 1
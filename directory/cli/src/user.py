@@ -26,19 +26,22 @@
 #==============================================================================
 
 import click
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 
 import list_command
 from list_command import \
     field_with_same_name, \
     field_with_name, \
+    full_name, \
     group_with_users_gid
 import ipa_wrapper_command
 import ipa_utils
+import directory_cache
 import appliance_cli.text as text
 import appliance_cli.utils
 import utils
 import subprocess
+import threading
 import logger
 from exceptions import IpaRunError
 from option_transformer import OptionTransformer
@@ -46,7 +49,7 @@ from option_transformer import OptionTransformer
 
 USER_LIST_FIELD_CONFIGS = OrderedDict([
     ('User login', field_with_same_name),
-    ('Full name', field_with_same_name),
+    ('Full name', full_name),
     ('UID', field_with_same_name),
     ('GID', field_with_same_name),
     ('Primary group', group_with_users_gid),
@@ -73,19 +76,29 @@ def add_commands(directory):
         pass
 
     @user.command(help='List all users')
-    def list():
+    @list_command.refresh_option
+    @list_command.format_option
+    @list_command.fields_option
+    def list(refresh, output_format, fields):
         list_command.do(
             ipa_find_command='user-find',
             field_configs=USER_LIST_FIELD_CONFIGS,
             sort_key='UID',
             generate_additional_data=_additional_data_for_list,
             blacklist_key='User login',
-            blacklist_val_array=USER_BLACKLIST
+            blacklist_val_array=USER_BLACKLIST,
+            cache_kind='user',
+            refresh=refresh,
+            output_format=output_format,
+            fields=fields
         )
 
     @user.command(help='Show detailed information on a user')
     @click.argument('login')
-    def show(login):
+    @list_command.refresh_option
+    @list_command.format_option
+    @list_command.fields_option
+    def show(login, refresh, output_format, fields):
         _validate_blacklist_users(login)
         user_find_args = ['--login={}'.format(login)]
         try:
@@ -94,7 +107,12 @@ def add_commands(directory):
                 ipa_find_args=user_find_args,
                 field_configs=USER_SHOW_FIELD_CONFIGS,
                 generate_additional_data=_additional_data_for_show,
-                display=list_command.list_displayer
+                display=list_command.list_displayer,
+                cache_kind='user',
+                cache_key=login,
+                refresh=refresh,
+                output_format=output_format,
+                fields=fields
             )
         except IpaRunError:
             # No matching user found; for consistency raise error with similar
@@ -119,6 +137,7 @@ Optionally, ignore all arguments to be prompted for values.
                 argument_name='login',
                 transform_options_callback=_transform_create_options,
                 handle_result_callback=_handle_create_result,
+                handle_error_callback=_handle_create_error,
             )
 
             if all(a is not None for a in [login, first, last, email]):
@@ -263,6 +282,7 @@ Please enter the name of the user you want to modify:
             options=_create_options(),
             transform_options_callback=_transform_create_options,
             handle_result_callback=_handle_create_result,
+            handle_error_callback=_handle_create_error,
             help='Create a new user',
         ),
         ipa_wrapper_command.create(
@@ -299,27 +319,37 @@ def _additional_data_for_list(item_dict=None):
 
 
 def _groups_by_gid():
-    groups_by_gid = {}
-    for group_data in _all_groups():
-        try:
-            gid = group_data['GID'][0]
-            groups_by_gid[gid] = group_data
-        except KeyError:
-            # Sometimes groups don't have a GID (e.g. the `ipausers` group);
-            # skip over these.
-            continue
-    return groups_by_gid
-
-def _all_groups():
-    # Want to get all groups, normal/public and private; I would have thought
-    # there would be a single `ipa` command that would give these but AFAICT it
-    # can only be done using both of these.
-    public_groups = ipa_utils.ipa_find('group-find', all_fields=False)
-    private_groups = ipa_utils.ipa_find('group-find', ['--private'], all_fields=False)
-    return public_groups + private_groups
+    # Only the group names are needed to display users' primary groups, which
+    # the GID index gives without fetching every group each time.
+    return _GroupsByGid()
+
+
+# The groups by GID from the GID index; a GID missing from this may be for a
+# group added outside this CLI since the index was built, so the index is
+# fetched again (once) before the GID is given up on.
+class _GroupsByGid(dict):
+    def __init__(self):
+        super().__init__(self._groups())
+        self._refreshed = directory_cache.gid_index_ttl() <= 0
+
+    def __missing__(self, gid):
+        if self._refreshed:
+            raise KeyError(gid)
+        self._refreshed = True
+        self.update(self._groups(refresh=True))
+        return self[gid]
+
+    @staticmethod
+    def _groups(refresh=False):
+        return {
+            gid: {'Group name': [group_name]}
+            for gid, group_name
+            in directory_cache.group_names_by_gid(refresh=refresh).items()
+        }
 
 # split the additional data functions for list & show to save time
 # only returns 1 private group, for the GID of the specified user
+@list_command.field_requires('GID')
 def _additional_data_for_show(item_dict):
     gid = item_dict['GID'][0]
     return {
@@ -331,12 +361,29 @@ def _additional_data_for_show(item_dict):
 def _users_primary_group(gid):
     group_find_args = ['--gid={}'.format(gid)]
     # will only find max one group between the two calls
-    # if the first doesn't find the group it will error but continue due to `error_allowed`
+    # if either doesn't find the group it will error but continue due to `error_allowed`
     # if neither find it (i.e. if the GID is invalid) [{}] will be returned
-    primary_group = ipa_utils.ipa_find('group-find', group_find_args + ['--private'], error_allowed='0 groups matched')
-    if primary_group == [{}]:
-        primary_group = ipa_utils.ipa_find('group-find', group_find_args, error_allowed='0 groups matched')
-    return primary_group
+    if directory_cache.enabled():
+        return _cached_group_with_gid(gid)
+
+    # both are run at once, preferring the private group if found
+    private_group, public_group = ipa_utils.ipa_find_concurrently(
+        [
+            ('group-find', group_find_args + ['--private']),
+            ('group-find', group_find_args),
+        ],
+        error_allowed='0 groups matched'
+    )
+    if private_group == [{}]:
+        return public_group
+    return private_group
+
+def _cached_group_with_gid(gid):
+    for kind in ['private-group', 'group']:
+        for group_data in directory_cache.entries(kind):
+            if group_data.get('GID') == [gid]:
+                return [group_data]
+    return [{}]
 
 def _user_options(require_names=True):
     return {
@@ -418,6 +465,18 @@ def _transform_create_options(argument, options):
 def _validate_create_uid(uid):
     if not uid:
         return
+
+    if utils.currently_importing():
+        # Check against all UIDs found once for the import, rather than
+        # finding each UID; this also allows the check without waiting for
+        # any earlier commands still to be run in a batch, as the UID is
+        # reserved until the create has run.
+        used_uids = utils.memoized_during_import('used-uids', _UsedUids.find)
+        if not used_uids.reserve(uid):
+            error = "User with uid '" + uid + "' already exists"
+            raise click.ClickException(error)
+        return
+
     try:
         user_find_args = ['--uid={}'.format(uid)]
         matching_user_uid = ipa_utils.ipa_find('user-find', user_find_args)
@@ -430,6 +489,54 @@ def _validate_create_uid(uid):
         raise click.ClickException(error)
 
 
+# The UIDs of all users, found once during an import and then kept up to date
+# as users are created, modified and deleted.
+class _UsedUids:
+    def __init__(self, uids_by_login):
+        self._lock = threading.Lock()
+        self._uids_by_login = uids_by_login
+        self._uid_counts = Counter(uids_by_login.values())
+
+    @staticmethod
+    def find():
+        user_dicts = ipa_utils.ipa_find(
+            'user-find', error_allowed='0 users matched', all_fields=False
+        )
+        return _UsedUids({
+            user_dict['User login'][0]: user_dict['UID'][0]
+            for user_dict in user_dicts
+            if 'User login' in user_dict and 'UID' in user_dict
+        })
+
+    # Reserve `uid` for a user about to be created, unless it is already in
+    # use; gives whether it was reserved.
+    def reserve(self, uid):
+        with self._lock:
+            if self._uid_counts[uid]:
+                return False
+            self._uid_counts[uid] += 1
+            return True
+
+    def release(self, uid):
+        with self._lock:
+            self._uid_counts[uid] -= 1
+
+    def assign(self, login, uid):
+        with self._lock:
+            self._remove(login)
+            self._uids_by_login[login] = uid
+            self._uid_counts[uid] += 1
+
+    def remove(self, login):
+        with self._lock:
+            self._remove(login)
+
+    def _remove(self, login):
+        uid = self._uids_by_login.pop(login, None)
+        if uid is not None:
+            self._uid_counts[uid] -= 1
+
+
 def _validate_blacklist_users(argument, options={}):
     if argument in USER_BLACKLIST:
         error = "The user " + argument + " is a restricted user"
@@ -520,6 +627,15 @@ def _extra_name_options(first_name, last_name):
 def _handle_create_result(login, options, result):
     utils.run_post_command_script('POST_CREATE_SCRIPT', [login])
     _handle_new_temporary_password(login, options, result)
+    _handle_created_uid(login, options, result)
+
+
+def _handle_create_error(login, options, error):
+    # The UID reserved when validating the create is no longer going to be
+    # used.
+    used_uids = utils.import_memo_value('used-uids')
+    if used_uids and options['uid']:
+        used_uids.release(options['uid'])
 
 
 def _handle_modify_result(login, options, result):
@@ -527,11 +643,35 @@ def _handle_modify_result(login, options, result):
     if options['remove_password']:
         _handle_removed_password(login, options, result)
 
+    used_uids = utils.import_memo_value('used-uids')
+    if used_uids and options['uid']:
+        used_uids.assign(login, options['uid'])
+
 
 def _handle_delete_result(login, options, result):
     utils.run_post_command_script('POST_DELETE_SCRIPT', [login])
     _handle_removed_password(login, options, result)
 
+    used_uids = utils.import_memo_value('used-uids')
+    if used_uids:
+        used_uids.remove(login)
+
+
+def _handle_created_uid(login, options, result):
+    used_uids = utils.import_memo_value('used-uids')
+    if not used_uids:
+        return
+
+    if options['uid']:
+        # Now held by the created user rather than reserved.
+        used_uids.release(options['uid'])
+        used_uids.assign(login, options['uid'])
+    else:
+        # Otherwise IPA has chosen the UID, which is given in the result.
+        user_dict = ipa_utils.parse_find_output(result)[0]
+        if 'UID' in user_dict:
+            used_uids.assign(login, user_dict['UID'][0])
+
 
 def _handle_new_temporary_password(login, options, result):
     # Details of user will be output in similar format to find output.
@@ -561,7 +701,10 @@ def _standard_default_user_gid():
     # If a default GID is set within the config this takes precedence.
     # However if this value is absent or blank it will attempt to find the GID
     # of the clusterusers group
-    return utils.get_user_config('DEFAULT_GID') or _get_group_id('clusterusers')
+    return utils.get_user_config('DEFAULT_GID') or \
+        utils.memoized_during_import(
+            'clusterusers-gid', lambda: _get_group_id('clusterusers')
+        )
 
 def _get_group_id(group):
     # If present the clusterusers group now takes precedence.
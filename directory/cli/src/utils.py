@@ -27,8 +27,10 @@
 
 import click
 from click import ClickException
+from contextlib import contextmanager
 from pathlib import Path
 import shlex
+import threading
 
 from config import CONFIG
 import appliance_cli
@@ -38,14 +40,6 @@ from exceptions import IpaRunError
 
 import subprocess
 
-def obtain_kerberos_ticket():
-    # TODO: apparently this is a bad idea, consider using keytab - refer to:
-    # http://stackoverflow.com/questions/8144596/kerberos-kinit-enter-password-without-prompt.
-    password = directory_config()[CONFIG.PASSWORD_KEY]
-    kinit_command = 'echo {} | kinit admin'.format(password),
-    appliance_cli.utils.run(kinit_command, shell=True)
-
-
 # Note: Could be made generic, but not needed by another appliance CLI yet.
 def directory_config():
     try:
@@ -99,8 +93,36 @@ def detect_user_config():
 def get_password_policy():
     return get_user_config('DO_NOT_GENERATE_PASSWORD') == 'TRUE'
 
+# Values describing the command currently being run (rather than the whole
+# session) are kept per thread while running record lines concurrently; see
+# `separate_command_meta`.
+_command_state = threading.local()
+
+# Held while finding a value to memoize during an import, so concurrently run
+# record lines don't find it more than once.
+_import_memo_lock = threading.RLock()
+
+
+def set_original_command(command):
+    _command_meta()[CONFIG.ORIGINAL_COMMAND_META_KEY] = command
+
+
 def original_command():
-    return _meta()[CONFIG.ORIGINAL_COMMAND_META_KEY]
+    return _command_meta()[CONFIG.ORIGINAL_COMMAND_META_KEY]
+
+
+# Temporarily treat the given command as the original command, e.g. when
+# handling the result of a command deferred until after later commands have
+# been parsed.
+@contextmanager
+def original_command_as(command):
+    meta = _command_meta()
+    previous_command = meta.get(CONFIG.ORIGINAL_COMMAND_META_KEY)
+    meta[CONFIG.ORIGINAL_COMMAND_META_KEY] = command
+    try:
+        yield
+    finally:
+        meta[CONFIG.ORIGINAL_COMMAND_META_KEY] = previous_command
 
 
 def mark_import_started():
@@ -109,6 +131,64 @@ def mark_import_started():
     # Initialize new dict to track newly generated user passwords.
     _meta()[CONFIG.IMPORTED_USER_PASSWORDS_META_KEY] = {}
 
+    # And for values which only need to be found once per import.
+    _meta()[CONFIG.IMPORT_MEMO_META_KEY] = {}
+
+
+# The number of the record line currently being imported.
+def set_import_line(line_number):
+    _command_meta()[CONFIG.IMPORT_LINE_META_KEY] = line_number
+
+
+def import_line():
+    return _command_meta().get(CONFIG.IMPORT_LINE_META_KEY)
+
+
+# Keep the values describing the current command separate for this thread,
+# e.g. so a record line run on a worker thread is recorded and logged as
+# itself rather than whichever line another thread parsed last.
+@contextmanager
+def separate_command_meta():
+    _command_state.meta = {}
+    try:
+        yield
+    finally:
+        _command_state.meta = None
+
+
+# Get the value for `key` from `find_value`, only calling this once per import
+# (unless it gives None, or the value is forgotten); outside of an import this
+# is always called.
+def memoized_during_import(key, find_value):
+    if not currently_importing():
+        return find_value()
+
+    with _import_memo_lock:
+        memo = _meta()[CONFIG.IMPORT_MEMO_META_KEY]
+        if memo.get(key) is None:
+            memo[key] = find_value()
+        return memo[key]
+
+
+# The value already memoized for `key` during the current import, if any,
+# without finding it.
+def import_memo_value(key):
+    if not currently_importing():
+        return None
+
+    with _import_memo_lock:
+        return _meta()[CONFIG.IMPORT_MEMO_META_KEY].get(key)
+
+
+def forget_import_memo(*keys):
+    if not currently_importing():
+        return
+
+    with _import_memo_lock:
+        memo = _meta()[CONFIG.IMPORT_MEMO_META_KEY]
+        for key in keys:
+            memo.pop(key, None)
+
 
 def mark_import_finished():
     _set_import_status_meta_key(False)
@@ -137,6 +217,11 @@ def imported_user_passwords():
 def _meta():
     return click.get_current_context().meta
 
+
+def _command_meta():
+    meta = getattr(_command_state, 'meta', None)
+    return _meta() if meta is None else meta
+
 # Re-invoke `directory` command with given arguments string.
 
 
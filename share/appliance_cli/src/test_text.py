@@ -0,0 +1,106 @@
+#==============================================================================
+# Copyright (C) 2019-present Alces Flight Ltd.
+#
+# This file is part of Flight Directory.
+#
+# This program and the accompanying materials are made available under
+# the terms of the Eclipse Public License 2.0 which is available at
+# <https://www.eclipse.org/legal/epl-2.0>, or alternative license
+# terms made available by Alces Flight Ltd - please direct inquiries
+# about licensing to licensing@alces-flight.com.
+#
+# Flight Directory is distributed in the hope that it will be useful, but
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED INCLUDING, WITHOUT LIMITATION, ANY WARRANTIES OR CONDITIONS
+# OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY OR FITNESS FOR A
+# PARTICULAR PURPOSE. See the Eclipse Public License 2.0 for more
+# details.
+#
+# You should have received a copy of the Eclipse Public License 2.0
+# along with Flight Directory. If not, see:
+#
+#  https://opensource.org/licenses/EPL-2.0
+#
+# For more information on Flight Directory, please visit:
+# https://github.com/openflighthpc/flight-directory
+#==============================================================================
+
+import pytest
+from terminaltables import DoubleTable
+from unittest import mock
+
+import appliance_cli.text as text
+
+
+headers = ['Name', 'Description']
+rows = [
+    ['fred', 'Fred Flintstone'],
+    ['barney', 'Barney\nRubble'],
+    ['wilma', ''],
+]
+
+
+def expected_table(headers, rows):
+    table = DoubleTable([[text.bold(header) for header in headers]] + rows)
+    table.inner_row_border = True
+    return table.table
+
+
+def test_display_table_output_matches_whole_table(capsys):
+    text.display_table(headers, iter(rows))
+
+    output = capsys.readouterr().out
+    assert output == text.click.unstyle(expected_table(headers, rows)) + '\n'
+
+
+def test_display_table_displays_headers_for_no_rows(capsys):
+    text.display_table(headers, [])
+
+    output = capsys.readouterr().out
+    assert output == text.click.unstyle(expected_table(headers, [])) + '\n'
+
+
+def test_display_table_wraps_cells_wider_than_sampled_rows(
+        monkeypatch, capsys):
+    monkeypatch.setattr(text, 'TABLE_SAMPLE_ROWS', 1)
+
+    text.display_table(headers, [['fred', 'Fred'], ['barney', 'Barney']])
+
+    output = capsys.readouterr().out
+    assert output == text.click.unstyle(
+        expected_table(headers, [['fred', 'Fred'], ['barn\ney', 'Barney']])
+    ) + '\n'
+
+
+def test_display_table_wraps_wide_and_coloured_cells_by_display_width(
+        monkeypatch, capsys):
+    monkeypatch.setattr(text, 'TABLE_SAMPLE_ROWS', 1)
+    coloured = text.failure('barney')
+
+    text.display_table(
+        headers, [['fred', 'Fred'], ['漢字漢字', 'Kanji'], [coloured, 'Red']]
+    )
+
+    output = capsys.readouterr().out
+    assert output == text.click.unstyle(expected_table(headers, [
+        ['fred', 'Fred'], ['漢字\n漢字', 'Kanji'], ['barn\ney', 'Red']
+    ])) + '\n'
+
+
+def test_pager_is_closed_and_waited_on_if_lines_fail(monkeypatch):
+    monkeypatch.setattr(text, '_pager_command', lambda: 'less')
+    pager = mock.Mock()
+    monkeypatch.setattr(
+        text.subprocess, 'Popen', mock.Mock(return_value=pager)
+    )
+
+    def failing_lines():
+        yield 'first'
+        raise RuntimeError('lines failed')
+
+    with pytest.raises(RuntimeError):
+        text._echo_lines_via_pager(failing_lines())
+
+    pager.stdin.close.assert_called_once_with()
+    pager.wait.assert_called_once_with()
+
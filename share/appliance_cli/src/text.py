@@ -27,8 +27,14 @@
 
 import click
 from terminaltables import DoubleTable
+from terminaltables.width_and_alignment import max_dimensions, visible_width
 import textwrap
 import subprocess
+import itertools
+import os
+import re
+import shutil
+import sys
 
 def line_wrap(text):
     return textwrap.fill(
@@ -64,23 +70,178 @@ def bold(text):
     return click.style(text, bold=True)
 
 
+# Number of rows used to size the columns of a table before any of it is
+# displayed; cells in later rows too wide for their column are wrapped.
+TABLE_SAMPLE_ROWS = 1000
+
+# Number of lines of a table to write to the pager at a time.
+PAGER_CHUNK_LINES = 500
+
+
 def display_table(headers, data):
     bolded_headers = [bold(header) for header in headers]
-    table_data = [bolded_headers] + data
+    rows = iter(data)
+    sampled_rows = list(itertools.islice(rows, TABLE_SAMPLE_ROWS))
+    table_data = [bolded_headers] + sampled_rows
 
     # Issue with less displaying SingleTable so double is needed, appears NOT to be a unicode issue
     # TODO sort this ^
     table = DoubleTable(table_data)
     table.inner_row_border = True
-    click.echo_via_pager(table.table)
-
-    # Wanted to invoke less manually so could exit if less than one screen was to be displayed
-    # however there's a max length of cmd passable to Popen on the bash side of things
-    # (128kbs I think) and the table often exceeds that
-    #echoed_table = subprocess.Popen(("echo", table.table), stdout=subprocess.PIPE)
-    #subprocess.run(["less", "-R", "-F"], stdin=echoed_table.stdout)
-    #echoed_table.stdout.close()
-    #echoed_table.wait()
+
+    # Render the table line by line rather than via `table.table`, so the
+    # whole table is never held in memory and it can start being displayed
+    # before all rows are available.
+    lines = _table_lines(
+        table,
+        remaining_rows=rows,
+        sample_full=len(sampled_rows) == TABLE_SAMPLE_ROWS
+    )
+    _echo_lines_via_pager(lines)
+
+
+# Yield the lines of `table`, identical to those of `table.table`, followed by
+# any remaining rows, which are fitted to the columns sized from the table's
+# data.
+def _table_lines(table, remaining_rows=(), sample_full=False):
+    inner_widths, _, outer_widths, _ = max_dimensions(
+        table.table_data, table.padding_left, table.padding_right
+    )
+    if sample_full:
+        # Ensure there is room for any later values in columns which were
+        # empty in all sampled rows.
+        outer_widths = [
+            outer + max(1 - inner, 0)
+            for inner, outer in zip(inner_widths, outer_widths)
+        ]
+        inner_widths = [max(width, 1) for width in inner_widths]
+
+    fitted_rows = (_fit_row(row, inner_widths) for row in remaining_rows)
+    rows = itertools.chain(table.table_data, fitted_rows)
+
+    yield ''.join(table.horizontal_border('top', outer_widths))
+    for index, row in enumerate(rows):
+        if index == 0:
+            style = 'heading'
+        else:
+            border_style = 'heading' if index == 1 else 'row'
+            yield ''.join(table.horizontal_border(border_style, outer_widths))
+            style = 'row'
+
+        height = max([cell.count('\n') + 1 for cell in row], default=0)
+        for line in table.gen_row_lines(row, style, inner_widths, height):
+            yield ''.join(line)
+    yield ''.join(table.horizontal_border('bottom', outer_widths))
+
+
+def _fit_row(row, widths):
+    return [_fit_cell(cell, width) for cell, width in zip(row, widths)]
+
+
+# Parts of a cell measured when fitting it to a column: colour escape sequences
+# (kept whole, and taking no width) or single characters (which may be wide).
+_CELL_PART = re.compile(r'\033\[[\d;]+m|.', re.S)
+
+
+def _fit_cell(cell, width):
+    lines = []
+    for line in cell.splitlines() or ['']:
+        fitted_line = ''
+        fitted_width = 0
+        for part in _CELL_PART.findall(line):
+            part_width = visible_width(part)
+            # Always at least one character per line, even if wider than this.
+            if fitted_width and fitted_width + part_width > width:
+                lines.append(fitted_line)
+                fitted_line = ''
+                fitted_width = 0
+            fitted_line += part
+            fitted_width += part_width
+        lines.append(fitted_line)
+    return '\n'.join(lines)
+
+
+# Equivalent to `click.echo_via_pager`, but for lines which are still being
+# generated; these are written to the pager as they become available, rather
+# than first being joined into a single string.
+def _echo_lines_via_pager(lines):
+    pager_command = _pager_command()
+    if not pager_command:
+        for line in lines:
+            click.echo(line)
+        return
+
+    # As in Click, colours are only kept when the pager is `less` and will
+    # display these.
+    env = dict(os.environ)
+    colour = False
+    pager_parts = pager_command.rsplit('/', 1)[-1].split()
+    if pager_parts[0] == 'less':
+        less_flags = env.get('LESS', '') + ' '.join(pager_parts[1:])
+        if not less_flags:
+            env['LESS'] = '-R'
+            colour = True
+        elif 'r' in less_flags or 'R' in less_flags:
+            colour = True
+
+    pager = subprocess.Popen(
+        pager_command,
+        shell=True,
+        stdin=subprocess.PIPE,
+        env=env,
+        universal_newlines=True,
+        encoding=sys.stdout.encoding or 'utf-8',
+        errors='replace'
+    )
+    try:
+        while True:
+            chunk = list(itertools.islice(lines, PAGER_CHUNK_LINES))
+            if not chunk:
+                break
+            chunk_text = join_lines(*chunk) + '\n'
+            if not colour:
+                chunk_text = click.unstyle(chunk_text)
+            pager.stdin.write(chunk_text)
+            pager.stdin.flush()
+    except (IOError, KeyboardInterrupt):
+        # Pager has been quit before everything was displayed.
+        pass
+    finally:
+        # Whatever stopped the lines (including an error generating them, which
+        # is still raised), let the pager finish rather than leaving it waiting
+        # for more.
+        try:
+            pager.stdin.close()
+        except IOError:
+            pass
+
+        # As in Click, leave handling `^C` to the pager itself.
+        while True:
+            try:
+                pager.wait()
+            except KeyboardInterrupt:
+                pass
+            else:
+                break
+
+
+# The pager to use, as chosen by `click.echo_via_pager`, or None if output
+# should not be paged.
+def _pager_command():
+    if not (sys.stdin.isatty() and sys.stdout.isatty()):
+        return None
+
+    pager_command = os.environ.get('PAGER', '').strip()
+    if pager_command:
+        return pager_command
+    if os.environ.get('TERM') in ('dumb', 'emacs'):
+        return None
+    if shutil.which('less'):
+        return 'less'
+    if shutil.which('more'):
+        return 'more'
+    return None
+
 
 def help_text_literal_paragraph(*parts):
     """Get text as a paragraph which will have indentation preserved in help"""